@@ -0,0 +1,531 @@
+# ai.py
+# Computer-controlled players for PyWars
+# Dec 2014
+
+import time
+from map import Objective
+from gameState import GameState
+import combat
+
+class SearchTimeout(Exception):
+    pass
+
+class GoalIndex(object):
+    """
+    Coords bucketed into square cells so that the ones nearest a tile can be
+    found without looking at all of them
+    """
+    cellSize = 8
+
+    def __init__(self, coordsList):
+        self.cells = dict() # (cell row, cell col) -> list of coords
+        self.count = 0
+        for (row, col) in coordsList:
+            key = (row / GoalIndex.cellSize, col / GoalIndex.cellSize)
+            self.cells.setdefault(key, []).append((row, col))
+            self.count += 1
+
+    def getNearest(self, coords, count):
+        """Get the count coords nearest to coords, searching rings of cells
+        outward until enough have been found"""
+        row, col = coords
+        cellRow, cellCol = row / GoalIndex.cellSize, col / GoalIndex.cellSize
+        found = []
+        radius = 0
+        extraRings = 1 # a closer goal may lie just past the ring that filled
+        while len(found) < self.count:
+            for dRow in xrange(-radius, radius + 1):
+                for dCol in xrange(-radius, radius + 1):
+                    if max(abs(dRow), abs(dCol)) == radius:
+                        key = (cellRow + dRow, cellCol + dCol)
+                        found.extend(self.cells.get(key, []))
+            radius += 1
+            if len(found) >= count:
+                if extraRings == 0: break
+                extraRings -= 1
+        found.sort(key=lambda (goalRow, goalCol):
+                   abs(goalRow - row) + abs(goalCol - col))
+        return found[:count]
+
+class TurnPlanner(object):
+    """
+    Plans the turn of the active team of a GameState within a time budget
+    given in seconds. A budget in search nodes can be given as well or
+    instead, which unlike time makes the plan the same on every run.
+    Attacks are scored with the damage distributions of combat.py rather
+    than rolled, so planning never draws from the game's random numbers.
+    """
+    objectiveValues = {0: 20000, 1: 3000, 2: 5000} # by objective type
+    killBonus = 0.5 # of the value of a destroyed unit
+    approachValue = 100 # per tile closer to the nearest goal
+    defenseValue = 20 # per point of terrain defense
+    blockingPenalty = 1000 # for standing where a capture or purchase could be
+    goalsPerUnit = 4
+    branching = 3 # actions searched per unit
+    maxDepth = 4
+    purchaseSample = 50 # enemy units considered when choosing purchases
+
+    def __init__(self, state, timeBudget=0.5, nodeBudget=None):
+        self.state = state
+        self.timeBudget = timeBudget
+        self.nodeBudget = nodeBudget
+        self.unitValues = dict([(GameState.shopTypes[typeNum], cost) for
+                                (typeNum, cost) in
+                                GameState.shopCosts.iteritems()])
+        self.team = state.activeTeam
+        self.deadline = None
+        self.depthReached = 0
+        self.nodes = 0
+        self.units = [] # starting coords of the units to plan, in order
+        self.candidates = dict() # start -> list of destinations
+        self.bestActions = dict() # index -> action chosen at the last depth
+        self.commands = None # the commands plan planned
+        self.applied = [] # the commands play applied
+
+    ##################################################################
+    # Setup
+    ##################################################################
+
+    def setUp(self):
+        state = self.state
+        teamNum = self.team.teamNumber
+        self.enemies = dict()
+        for (unit, coords) in state.unitCoords.iteritems():
+            if unit.teamNum != teamNum:
+                self.enemies[coords] = unit
+        self.enemyGoals = GoalIndex(sorted(self.enemies))
+        self.objectiveGoals = GoalIndex(sorted(
+            [coords for coords in state.objectiveHealth
+             if state.getObjective(coords)[0] != teamNum]))
+        units = [(state.getUnitCoords(unit), unit)
+                 for unit in state.activeUnits]
+        units.sort(key=self.getUnitOrder)
+        self.units = [coords for (coords, unit) in units]
+
+    def getUnitOrder(self, (coords, unit)):
+        """Plan units near an enemy first, the most valuable first, so that
+        the units that can attack get first pick of the tiles"""
+        nearest = self.enemyGoals.getNearest(coords, 1)
+        inContact = False
+        if len(nearest) > 0:
+            distance = self.getDistance(coords, nearest[0])
+            inContact = distance <= (unit.movementPoints + 1 +
+                                     unit.artilleryMaxRange)
+        return (not inContact, -self.unitValues[type(unit)], coords)
+
+    def getDistance(self, (row, col), (otherRow, otherCol)):
+        return abs(row - otherRow) + abs(col - otherCol)
+
+    def getCandidates(self, start):
+        """Get the tiles the unit at start might end its move on, as (dest,
+        position score, targets, can capture) tuples. Computed once per
+        unit, since only the tiles claimed by other units change while
+        planning."""
+        if start in self.candidates:
+            return self.candidates[start]
+        state = self.state
+        unit = state.getUnit(start)
+        goals = self.enemyGoals.getNearest(start, TurnPlanner.goalsPerUnit)
+        if unit.canCapture:
+            goals += self.objectiveGoals.getNearest(start,
+                                                    TurnPlanner.goalsPerUnit)
+        candidates = []
+        for dest in state.getMovementRange(start):
+            other = state.getUnit(dest)
+            if other != None and other not in state.activeUnits:
+                continue # a unit that has already moved will stay there
+            if unit.isArtilleryUnit:
+                if dest == start:
+                    targets = state.getTargets(start)
+                else:
+                    targets = []
+            else:
+                targets = self.getAdjacentEnemies(dest)
+            objective = state.getObjective(dest)
+            canCapture = (unit.canCapture and objective != None and
+                          objective[0] != unit.teamNum)
+            candidates.append((dest, self.getPositionScore(unit, dest, goals),
+                               targets, canCapture))
+        self.candidates[start] = candidates
+        return candidates
+
+    def getAdjacentEnemies(self, (row, col)):
+        targets = []
+        for (dRow, dCol) in [(-1, 0), (0, 1), (1, 0), (0, -1)]:
+            if (row + dRow, col + dCol) in self.enemies:
+                targets.append((row + dRow, col + dCol))
+        return targets
+
+    def getPositionScore(self, unit, dest, goals):
+        """Score a tile for standing on: close to the nearest goal, or at
+        firing range from it for artillery, on good defensive terrain, and
+        not in the way of capturing an objective or buying at a factory"""
+        score = TurnPlanner.defenseValue * self.state.defense.get(*dest)
+        objective = self.state.getObjective(dest)
+        if objective != None:
+            if ((objective[0] != unit.teamNum and not unit.canCapture) or
+                objective == (unit.teamNum, 2)):
+                score -= TurnPlanner.blockingPenalty
+        if len(goals) > 0:
+            distance = min([self.getDistance(dest, goal) for goal in goals])
+            if unit.isArtilleryUnit:
+                distance = abs(distance - unit.artilleryMaxRange)
+            score -= TurnPlanner.approachValue * distance
+        return score
+
+    ##################################################################
+    # Search
+    ##################################################################
+
+    def resetContext(self):
+        self.taken = dict() # dest -> start of the unit that claimed it
+        self.vacated = set() # starts of the units planned to move away
+        self.enemyHealth = dict() # coords -> expected health
+        self.objectiveHealth = dict() # coords -> expected capture health
+        self.undoStack = []
+
+    def checkTime(self):
+        self.nodes += 1
+        if ((self.deadline != None and time.time() > self.deadline) or
+            (self.nodeBudget != None and self.nodes > self.nodeBudget)):
+            raise SearchTimeout()
+
+    def isFree(self, dest, start):
+        if dest in self.taken:
+            return False
+        if dest == start or dest in self.vacated:
+            return True
+        return self.state.getUnit(dest) == None
+
+    def scoreAttack(self, unit, dest, target):
+        """Score an attack by the value of the expected damage dealt and
+        the chance of destroying the target, less the value of the expected
+        damage taken in return if it survives. Returns the score and the
+        damage dealt."""
+        state = self.state
+        defender = self.enemies[target]
+        health = self.enemyHealth.get(target, defender.health)
+        if health <= 0:
+            return None, 0
+        defenderValue = self.unitValues[type(defender)]
+        damage = combat.getDamageDistribution(unit, defender,
+                                              state.defense.get(*target))
+        dealt = min(health, damage.expected)
+        killProbability = damage.getKillProbability(health)
+        score = (dealt * defenderValue / 100.0 +
+                 killProbability * TurnPlanner.killBonus * defenderValue)
+        if (killProbability < 1 and
+            not (unit.isArtilleryUnit or defender.isArtilleryUnit)):
+            taken = min(unit.health, combat.getExpectedDamage(
+                defender, unit, state.defense.get(*dest), True,
+                health - dealt))
+            score -= ((1 - killProbability) * taken *
+                      self.unitValues[type(unit)] / 100.0)
+        return score, dealt
+
+    def scoreCapture(self, unit, dest):
+        """Score a capture by the share of the objective's value it takes.
+        Returns the score and the capture health taken."""
+        health = self.objectiveHealth.get(dest,
+                                          self.state.objectiveHealth[dest])
+        progress = unit.health / 10
+        value = TurnPlanner.objectiveValues[self.state.getObjective(dest)[1]]
+        if progress >= health:
+            return value, progress
+        return value * progress / float(Objective.baseHealth), progress
+
+    def getActions(self, index):
+        """Get the actions open to a unit given the tiles and damage already
+        planned, best first, as (score, dest, command, target, effect)
+        tuples"""
+        start = self.units[index]
+        unit = self.state.getUnit(start)
+        actions = []
+        for (dest, positionScore, targets, canCapture) in \
+                self.getCandidates(start):
+            if not self.isFree(dest, start):
+                continue
+            actions.append((positionScore, dest, 'wait', None, 0))
+            if canCapture:
+                score, progress = self.scoreCapture(unit, dest)
+                actions.append((positionScore + score, dest, 'capture', None,
+                                progress))
+            for target in targets:
+                score, dealt = self.scoreAttack(unit, dest, target)
+                if score != None:
+                    actions.append((positionScore + score, dest, 'attack',
+                                    target, dealt))
+        actions.sort(reverse=True)
+        return actions
+
+    def getOrderedActions(self, index):
+        """Get the actions worth searching for a unit: the best few, with
+        the one chosen at the previous depth first"""
+        actions = self.getActions(index)
+        best = actions[:TurnPlanner.branching]
+        previous = self.bestActions.get(index)
+        if previous != None:
+            for action in actions:
+                if action[1:4] == previous[1:4]:
+                    if action in best:
+                        best.remove(action)
+                    best.insert(0, action)
+                    break
+        return best
+
+    def applyAction(self, index, action):
+        score, dest, command, target, effect = action
+        start = self.units[index]
+        self.taken[dest] = start
+        if dest != start:
+            self.vacated.add(start)
+        old = None
+        if command == 'attack':
+            old = self.enemyHealth.get(target)
+            health = self.enemies[target].health if old == None else old
+            self.enemyHealth[target] = health - effect
+        elif command == 'capture':
+            old = self.objectiveHealth.get(dest)
+            health = self.state.objectiveHealth[dest] if old == None else old
+            self.objectiveHealth[dest] = health - effect
+        self.undoStack.append((start, action, old))
+
+    def undoAction(self):
+        start, (score, dest, command, target, effect), old = \
+            self.undoStack.pop()
+        del self.taken[dest]
+        self.vacated.discard(start)
+        if command == 'attack':
+            health = self.enemyHealth
+        elif command == 'capture':
+            health, target = self.objectiveHealth, dest
+        else:
+            return
+        if old == None:
+            del health[target]
+        else:
+            health[target] = old
+
+    def search(self, index, depth):
+        """Get the best total score of the units from index on, looking
+        depth units ahead"""
+        if depth == 0 or index >= len(self.units):
+            return 0
+        actions = self.getOrderedActions(index)
+        if len(actions) == 0:
+            return self.search(index + 1, depth - 1)
+        best = None
+        for action in actions:
+            self.checkTime()
+            score = action[0]
+            if depth > 1:
+                self.applyAction(index, action)
+                score += self.search(index + 1, depth - 1)
+                self.undoAction()
+            if best == None or score > best:
+                best = score
+        return best
+
+    def planUnits(self, depth, plan):
+        """Choose an action for every unit in order, looking depth - 1 units
+        ahead of each, adding (start, action) pairs to plan. A generator
+        that yields after each unit."""
+        self.resetContext()
+        chosen = dict()
+        for index in xrange(len(self.units)):
+            best = bestScore = None
+            for action in self.getOrderedActions(index):
+                self.checkTime()
+                score = action[0]
+                if depth > 1:
+                    self.applyAction(index, action)
+                    score += self.search(index + 1, depth - 1)
+                    self.undoAction()
+                if best == None or score > bestScore:
+                    best, bestScore = action, score
+            if best != None:
+                self.applyAction(index, best)
+                chosen[index] = best
+                plan.append((self.units[index], best))
+            yield
+        self.bestActions = chosen
+
+    ##################################################################
+    # Purchases
+    ##################################################################
+
+    def getPurchases(self, plan):
+        """Get the buy commands for the factories left free by plan"""
+        state = self.state
+        teamNum = self.team.teamNumber
+        dests = set([action[1] for (start, action) in plan])
+        vacated = set([start for (start, action) in plan
+                       if action[1] != start])
+        capturers = len([unit for unit in self.team.units
+                         if unit.canCapture])
+        neededCapturers = 2 + self.objectiveGoals.count / 3
+        funds = self.team.funds
+        commands = []
+        self.purchaseScores = dict() # typeNum -> score
+        for coords in sorted(self.team.heldObjectives):
+            if state.getObjective(coords) != (teamNum, 2):
+                continue
+            if coords in dests or (state.getUnit(coords) != None and
+                                   coords not in vacated):
+                continue
+            affordable = [typeNum for (typeNum, cost) in
+                          sorted(GameState.shopCosts.iteritems())
+                          if cost <= funds]
+            if len(affordable) == 0:
+                break
+            if capturers < neededCapturers and 1 in affordable:
+                typeNum = 1
+            else:
+                typeNum = max(affordable, key=self.getPurchaseScore)
+            if GameState.shopTypes[typeNum].canCapture:
+                capturers += 1
+            funds -= GameState.shopCosts[typeNum]
+            commands.append(('buy', coords, typeNum))
+        return commands
+
+    def getPurchaseScore(self, typeNum):
+        """Score a unit type by the value of the damage it would be expected
+        to deal to a sample of the enemy's units"""
+        if typeNum in self.purchaseScores:
+            return self.purchaseScores[typeNum]
+        unit = GameState.shopTypes[typeNum](self.team.teamNumber)
+        enemies = [self.enemies[coords] for coords in
+                   sorted(self.enemies)[:TurnPlanner.purchaseSample]]
+        damages = combat.getExpectedDamages([(unit, enemy, 0)
+                                             for enemy in enemies])
+        score = 0
+        for (enemy, damage) in zip(enemies, damages):
+            score += damage * self.unitValues[type(enemy)]
+        self.purchaseScores[typeNum] = score
+        return score
+
+    ##################################################################
+    # Planning and playing
+    ##################################################################
+
+    def plan(self):
+        """Plan the turn. Returns a list of commands for GameState.apply,
+        not including endTurn: each unit's move followed by its action at
+        its destination, then the purchases."""
+        for step in self.planSteps():
+            pass
+        return self.commands
+
+    def planSteps(self):
+        """Plan the turn as plan does, a piece at a time: a generator that
+        yields after setting up, after each unit is planned and before
+        choosing purchases, so that a renderer can go on drawing while the
+        computer thinks. Time spent between steps doesn't count against the
+        time budget. When it is done, self.commands holds the plan."""
+        if self.timeBudget != None:
+            self.deadline = time.time() + self.timeBudget
+        for step in self.planPieces():
+            pausedAt = time.time()
+            yield
+            if self.deadline != None:
+                self.deadline += time.time() - pausedAt
+
+    def planPieces(self):
+        """The work of planSteps, yielding between pieces of it"""
+        self.setUp()
+        yield
+        plan = []
+        try:
+            for depth in xrange(1, TurnPlanner.maxDepth + 1):
+                current = []
+                for step in self.planUnits(depth, current):
+                    yield
+                plan = current
+                self.depthReached = depth
+                if depth >= len(self.units):
+                    break # looking further ahead would change nothing
+        except SearchTimeout:
+            if self.depthReached == 0:
+                plan = current # part of a turn is better than none
+        yield
+        commands = []
+        for (start, (score, dest, command, target, effect)) in plan:
+            commands.append(('move', start, dest))
+            if command == 'attack':
+                commands.append((command, dest, target))
+            else:
+                commands.append((command, dest))
+        self.commands = commands + self.getPurchases(plan)
+
+    def play(self, commands):
+        """Apply planned commands to the game state. Attacks are rolled as
+        they are played, so a unit whose target has already been destroyed
+        attacks the best target left instead, and a unit that can no longer
+        do what was planned waits. Returns the commands applied."""
+        for command in self.playSteps(commands):
+            pass
+        return self.applied
+
+    def playSteps(self, commands):
+        """Apply planned commands as play does, one at a time: a generator
+        that yields each command once it has been applied, so that a
+        renderer can show the moves one after another"""
+        state = self.state
+        self.resetContext() # score attacks on the health units really have
+        applied = self.applied = []
+        coords = None # where the unit that last moved ended up
+        for command in commands:
+            name = command[0]
+            if name == 'move':
+                start, dest = command[1:]
+                unit = state.getUnit(start)
+                coords = None
+                if unit == None or unit not in state.activeUnits:
+                    continue
+                if dest != start and state.getUnit(dest) != None:
+                    dest = start
+                if dest != start:
+                    applied.append(('move', start, dest))
+                    state.apply(applied[-1])
+                    yield applied[-1]
+                distanceMoved = self.getDistance(start, dest)
+                coords = dest
+            elif name == 'buy':
+                if state.apply(command) != None:
+                    applied.append(command)
+                    yield command
+            elif coords != None:
+                if name == 'attack':
+                    command = self.getAttack(coords, command[2],
+                                             distanceMoved)
+                elif name == 'capture' and not state.canCapture(coords):
+                    command = ('wait', coords)
+                else: # the unit may have stayed put instead of moving
+                    command = (name, coords) + command[2:]
+                applied.append(command)
+                state.apply(command)
+                coords = None
+                yield command
+            if state.gameIsOver:
+                break
+
+    def getAttack(self, coords, target, distanceMoved):
+        """Get the command for the unit at coords to attack target, or the
+        best target left if target is gone, or to wait if there is none"""
+        state = self.state
+        if not state.canAttack(coords, distanceMoved):
+            return ('wait', coords)
+        targets = state.getTargets(coords)
+        if target not in targets:
+            unit = state.getUnit(coords)
+            target = max(targets, key=lambda other:
+                         self.scoreAttack(unit, coords, other)[0])
+        return ('attack', coords, target)
+
+def playTurn(state, timeBudget=0.5, nodeBudget=None):
+    """Plan and play the turn of the active team of a GameState, up to but
+    not including endTurn. Returns the TurnPlanner, whose applied attribute
+    holds the commands that were played."""
+    planner = TurnPlanner(state, timeBudget, nodeBudget)
+    planner.play(planner.plan())
+    return planner
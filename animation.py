@@ -0,0 +1,112 @@
+# animation.py
+# Units moving along their paths for PyWars
+# Dec 2014
+
+import time
+import pygame
+from pygame.locals import *
+from map import Tile
+
+class MoveAnimation(object):
+    """
+    A tile-sized image sliding along a path of tile coords at a number of
+    tiles per second. onFinish is called once it reaches the end.
+    """
+    def __init__(self, image, path, speed, onFinish=None):
+        self.image = image
+        self.path = path
+        self.speed = speed
+        self.onFinish = onFinish
+        self.elapsed = 0.0
+        self.duration = (len(path) - 1) / float(speed)
+        self.shownRect = None # where it was last drawn, as a screen rect
+
+    def isDone(self):
+        return self.elapsed >= self.duration
+
+    def step(self, seconds):
+        self.elapsed = min(self.elapsed + seconds, self.duration)
+
+    def finish(self):
+        self.elapsed = self.duration
+
+    def getRect(self):
+        """Get the rect of the screen surface the image is at now"""
+        tiles = self.elapsed * self.speed
+        index = min(int(tiles), len(self.path) - 2)
+        fraction = tiles - index
+        (row, col), (nextRow, nextCol) = self.path[index:index + 2]
+        left = (col + (nextCol - col) * fraction) * Tile.size
+        top = (row + (nextRow - row) * fraction) * Tile.size
+        return pygame.Rect(int(round(left)), int(round(top)), Tile.size,
+                           Tile.size)
+
+class Animator(object):
+    """
+    Plays animations over the view of a Viewport
+    """
+    maxStep = 0.1 # seconds; a longer frame doesn't make sprites jump
+
+    def __init__(self, viewport):
+        self.viewport = viewport
+        self.animations = []
+        self.stale = [] # screen rects of finished animations to erase
+        self.lastUpdate = None
+
+    def add(self, animation):
+        self.animations.append(animation)
+
+    def isBusy(self):
+        return len(self.animations) > 0
+
+    def update(self):
+        """Step the animations by the time since the last update"""
+        if not self.isBusy():
+            self.lastUpdate = None
+            return
+        now = time.time()
+        if self.lastUpdate == None:
+            step = 1.0 / 60 # the first frame of an animation
+        else:
+            step = min(now - self.lastUpdate, Animator.maxStep)
+        self.lastUpdate = now
+        for animation in self.animations:
+            animation.step(step)
+        self.removeDone()
+
+    def finish(self):
+        """Skip every animation to its end, e.g. to fast-forward"""
+        for animation in self.animations:
+            animation.finish()
+        self.removeDone()
+
+    def removeDone(self):
+        done = [animation for animation in self.animations
+                if animation.isDone()]
+        if len(done) == 0:
+            return
+        self.animations = [animation for animation in self.animations
+                           if not animation.isDone()]
+        for animation in done:
+            if animation.shownRect != None:
+                self.stale.append(animation.shownRect)
+            if animation.onFinish != None:
+                animation.onFinish()
+
+    def present(self):
+        """Erase the sprites where they were last drawn and draw them where
+        they are now. Called after the viewport has been presented, which
+        may have copied the view over them."""
+        erased = self.stale
+        self.stale = []
+        for animation in self.animations:
+            rect = animation.getRect()
+            if animation.shownRect != None:
+                rect.union_ip(animation.shownRect) # one copy for both
+            erased.append(rect)
+        # erase them all before drawing any, in case they overlap
+        for rect in erased:
+            self.viewport.presentRect(rect)
+        for animation in self.animations:
+            animation.shownRect = animation.getRect()
+            self.viewport.drawOver(animation.image, animation.shownRect)
@@ -4,22 +4,34 @@
 
 # Based on Advance Wars (Intelligent Systems, Nintendo)
 
-import copy
-import random
+import time
 import pygame
 from pygame.locals import *
 from pygameBaseClass import PygameBaseClass
+from imageCache import loadImage
+from textCache import renderText, getFont
+import gameState
+import mapFile
+import saveGame
+import ai
+import pathfinding
+import combat
+import music
+from threatMap import ThreatMap
+from minimap import Minimap
+from viewport import Viewport
+from chunkedSurface import ChunkedSurface
+from tileRenderer import TileRenderer
+from animation import Animator, MoveAnimation
+from gameState import GameState
 from map import *
 from units import *
 
-class Team(object):
-    colors = ["Red", "Blue", "Green", "Yellow"]
+class Team(gameState.Team):
+    """A team in the game rules, plus where that player left the cursor and
+    camera"""
     def __init__(self, teamNumber, funds, cursorCoords, camRect):
-        self.teamNumber = teamNumber
-        self.funds = funds
-        self.color = Team.colors[teamNumber]
-        self.heldObjectives = []
-        self.units = set()
+        super(Team, self).__init__(teamNumber, funds)
         self.cursorCoords = cursorCoords
         self.camLeft = camRect[0]
         self.camTop = camRect[1]
@@ -30,100 +42,98 @@ class Team(object):
     def getHudImage(self):
         filename = self.color + 'Background.png'
         path = os.path.join('backgrounds', filename)
-        image = pygame.image.load(path)
+        image = loadImage(path)
         return image
 
 class Battle(PygameBaseClass):
-    """Main gametype"""
-
-    shopTypes = {
-        1: Infantry,
-        2: RocketInf,
-        3: APC,
-        4: SmTank,
-        5: LgTank,
-        6: Artillery
-    }
-    shopCosts = {
-        1: 1000,
-        2: 3000,
-        3: 4000,
-        4: 7000,
-        5: 16000,
-        6: 6000
-    }
+    """Main gametype. The rules live in self.state (a GameState); Battle
+    handles input and draws the state."""
+
+    shopTypes = GameState.shopTypes
+    shopCosts = GameState.shopCosts
+    autosavePath = os.path.join('saves', 'autosave' + saveGame.extension)
+    aiTimeBudget = 0.5 # seconds a computer player may plan its turn for
+    aiFrameBudget = 0.01 # seconds of that it may plan for in each frame
+    animateMoves = True # False to show moves at once, e.g. for playback
+    moveSpeed = 12.0 # tiles per second units slide at
 
     @staticmethod
-    def loadUnits(unitString):
-        if len(unitString) == 0: return []
-        units = []
-        unitIdentifiers = unitString.splitlines()
-        for i in xrange(len(unitIdentifiers)):
-            thisUnitStr = unitIdentifiers[i]
-            thisUnitList = thisUnitStr.split()
-            team = int(thisUnitList[0])
-            type = int(thisUnitList[1])
-            rowAndCol = thisUnitList[2].split(',')
-            coords = (int(rowAndCol[0]), int(rowAndCol[1]))
-            units.append((team, type, coords))
-        return units
+    def fromFile(path, firstPlayer=None, seed=None):
+        scenario = mapFile.read(path)
+        map = Map(grids=scenario.getGrids())
+        return Battle(map, scenario.numPlayers, scenario.initialFunds,
+                      scenario.units, firstPlayer, seed)
 
     @staticmethod
-    def fromFile(path):
-        with open(path, "rt") as input:
-            save = input.read()
-        saveContents = save.split('\n*\n')
-        mapString = saveContents[0]
-        numPlayers = int(saveContents[1])
-        initialFunds = int(saveContents[2])
-        unitString = saveContents[3]
-        map = Map(mapString)
-        units = Battle.loadUnits(unitString)
-        return Battle(map, numPlayers, initialFunds, units)
+    def fromSave(path):
+        """Continue a battle saved by Battle.save or the autosave"""
+        snapshot = saveGame.load(path)
+        scenario = snapshot.getScenario()
+        map = Map(grids=scenario.getGrids())
+        battle = Battle(map, scenario.numPlayers, scenario.initialFunds,
+                        scenario.units, snapshot.playerIndex, startTurn=False)
+        snapshot.restore(battle.state)
+        return battle
 
     ##################################################################
     # Game setup
     ##################################################################
 
-    def __init__(self, map, numPlayers, initialFunds=5000, initialUnits=[]):
+    def __init__(self, map, numPlayers, initialFunds=5000, initialUnits=[],
+                 firstPlayer=None, seed=None, startTurn=True):
+        """firstPlayer, seed and startTurn are passed on to GameState, e.g.
+        to replay a battle the same way or to restore a save"""
         # super(Battle, self).__init__('Battle')
         self.map = map
         self.rows, self.cols = map.rows, map.cols
-        self.unitSpace = self.getUnitSpace()
         self.numPlayers = numPlayers
         self.initialFunds = initialFunds
-        self.teams = self.createTeams()
-        self.placeInitialUnits(initialUnits)
+        self.state = GameState(map.getContents(), numPlayers, initialFunds,
+                               initialUnits, self.createTeams(), firstPlayer,
+                               seed, startTurn, map.terrain, map.defense)
+        self.unitSpace = self.state.unitSpace
+        self.teams = self.state.teams
+        self.autoSaver = None
+        self.aiPlayers = set() # team numbers played by the computer
 
     def initGraphics(self):
         self.camWidth = 16
         self.camHeight = 10
-        self.camLeft, self.camTop = (0, 0)
         self.screenTopLeft = (0, 128)
         self.screenDisplaySize = (1024, 640)
         self.screenSize = (self.map.cols*Tile.size, self.map.rows*Tile.size)
-        self.screen = pygame.Surface(self.screenSize)
-        self.camTop = 0
-        self.camLeft = 0
-        self.camBottom = 10
-        self.camRight = 16
-
-    def getUnitSpace(self):
-        """Create an empty 2D list the size of the map"""
-        contents = []
-        for row in xrange(self.rows):
-            contents += [[None] * self.cols]
-        return contents
+        self.screen = ChunkedSurface(self.screenSize, self.drawArea)
+        self.viewport = Viewport(self.compositor, Rect(self.screenTopLeft,
+                                                       self.screenDisplaySize),
+                                 self.screen)
+        self.renderer = TileRenderer(self.map, self.screen, self.presentTile)
+        self.renderer.addGroup('units', TileRenderer.unitLayer)
+        self.renderer.addGroup('moved', TileRenderer.unitLayer)
+        self.renderer.addGroup('danger', TileRenderer.overlayLayer)
+        self.renderer.addGroup('movement', TileRenderer.overlayLayer)
+        self.renderer.addGroup('cursor', TileRenderer.cursorLayer)
+        self.renderer.addGroup('target', TileRenderer.cursorLayer)
+        self.animator = Animator(self.viewport)
+        self.hiddenUnits = set() # tiles whose unit an animation shows
+        self.hudIsDirty = False
+        self.hudRects = [] # HUD widgets drawn in the last frame
+        self.hudBackground = None
+        if self.rows > self.camHeight or self.cols > self.camWidth:
+            self.minimap = Minimap(self.state, self.getMinimapArea())
+        else:
+            self.minimap = None # the camera shows the whole map
+
+    def getMinimapArea(self):
+        """Get the part of the top bar between the widest turn text and the
+        funds"""
+        font = getFont('Tahoma', 64, True)
+        textWidth = max([font.size("%s's Turn" % color)[0]
+                         for color in Team.colors])
+        left = 48 + textWidth + 16
+        return Rect(left, 8, 1056 - left, 112)
 
     def getHQCoords(self, teamNum):
-        map = self.map.map
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                tile = map[row][col]
-                if (isinstance(tile, Objective) and
-                    tile.typeNum == 0 and
-                    tile.teamNum == teamNum):
-                    return (row, col)
+        return self.map.hqCoords.get(teamNum)
 
     def getCamRect(self, hqCoords):
         row, col = hqCoords
@@ -154,33 +164,19 @@ class Battle(PygameBaseClass):
         teams = []
         for teamNumber in xrange(self.numPlayers):
             hqCoords = self.getHQCoords(teamNumber)
+            if hqCoords == None: # the team was eliminated in a saved game
+                hqCoords = (0, 0)
             camRect = self.getCamRect(hqCoords)
             teams.append(Team(teamNumber, self.initialFunds, hqCoords, camRect))
         return teams
 
-    def placeInitialUnits(self, initialUnits):
-        """Add the initial units to the unit space"""
-        for item in initialUnits:
-            teamNum, typeNum, coords = item
-            type = Battle.shopTypes[typeNum]
-            team = self.teams[teamNum]
-            row, col = coords
-            unit = type(teamNum)
-            self.unitSpace[row][col] = unit
-            team.units.add(unit)
-
     def beginMusic(self):
-        pygame.mixer.music.fadeout(1000)
         musicpath = os.path.join('audio', 'battle.ogg')
-        pygame.mixer.music.load(musicpath)
-        pygame.mixer.music.set_volume(0.2)
-        pygame.mixer.music.play(-1)
+        music.play(musicpath, 0.2)
 
     def initGame(self):
         """Set up initial game conditions"""
         self.beginMusic()
-        self.gameIsOver = False
-        self.eliminatedPlayers = set()
         self.contextMenuIsOpen = False
         self.contextMenuOptions = [False, False]
         self.inAttackMode = False
@@ -190,34 +186,32 @@ class Battle(PygameBaseClass):
         self.attackKey = '2'
         self.unitIsSelected = False
         self.captureKey = '3'
-        self.getHeldObjectives()
-        firstPlayer = random.randrange(self.numPlayers)
-        self.playerIndex = firstPlayer
-        self.activePlayer = self.teams[self.playerIndex]
-        self.activeUnits = copy.copy(self.activePlayer.units)
+        self.activePlayer = self.state.activeTeam
         self.loadCursor()
         self.loadMovementOverlay()
         self.loadMovedMarker()
         self.loadTargetOverlay()
+        self.loadDangerOverlay()
+        self.threatMap = None # the danger zone, while it is shown
+        self.aiPlanner = None # the computer player's planner, while it plans
+        self.aiPlanning = None # and its planSteps
+        self.aiCommands = None # the computer player's turn, while it plays
+        self.fastForward = False # show the rest of this turn's moves at once
         self.movementRange = set()
+        self.movementPaths = None
         self.cursorCoords = (0, 0)
         self.targetCoords = None
         self.targets = []
         self.targetIndex = 0
+        self.forecasts = dict() # (attacker, target, coords...) -> Forecast
         self.drawMap()
         self.drawAllUnits()
         self.beginTurn()
+        self.autosave()
 
-    def getHeldObjectives(self):
-        """Add each objective to the heldObjectives list of the team that
-        holds it"""
-        map = self.map
-        for row in xrange(map.rows):
-            for col in xrange(map.cols):
-                tile = self.map.map[row][col]
-                if isinstance(tile, Objective) and tile.teamNum != 4:
-                    holdingTeam = self.teams[tile.teamNum]
-                    holdingTeam.heldObjectives.append(tile)
+    @property
+    def gameIsOver(self):
+        return self.state.gameIsOver
 
     def loadCursor(self):
         """Create a white overlay, one tile in size, and store it in
@@ -255,60 +249,70 @@ class Battle(PygameBaseClass):
         pygame.draw.rect(self.targetOverlay, color, rect)
         self.targetOverlay.set_alpha(128)
 
+    def loadDangerOverlay(self):
+        """Create an orange overlay, one tile in size, and store it in
+        self.dangerOverlay"""
+        self.dangerOverlay = pygame.Surface((Tile.size, Tile.size))
+        color = pygame.Color('#ff6000')
+        rect = pygame.Rect(0, 0, Tile.size, Tile.size)
+        pygame.draw.rect(self.dangerOverlay, color, rect)
+        self.dangerOverlay.set_alpha(96)
+
     ##################################################################
     # Gameplay methods
     ##################################################################
 
     def beginTurn(self):
-        """Start the turn of the active player"""
-        self.activePlayer = self.teams[self.playerIndex]
-        additionalFundsPerBuilding = 1000
-        newFunds = (additionalFundsPerBuilding *
-                     len(self.activePlayer.heldObjectives))
-        self.activePlayer.funds += newFunds
-        self.activeUnits = copy.copy(self.activePlayer.units)
+        """Show the turn of the active player. The game state has already
+        paid the player and healed its units."""
+        self.activePlayer = self.state.activeTeam
+        self.fastForward = False
         self.placeCursor(self.activePlayer.cursorCoords)
-        self.camLeft = self.activePlayer.camLeft
-        self.camRight = self.activePlayer.camRight
-        self.camTop = self.activePlayer.camTop
-        self.camBottom = self.activePlayer.camBottom
+        self.viewport.jumpTo(self.activePlayer.camLeft * Tile.size,
+                             self.activePlayer.camTop * Tile.size)
         self.selection = None
+        self.forecasts.clear() # units have been healed
+        if self.threatMap != None:
+            self.showDangerZone() # the zone of the new active player
         self.clearMovementRange()
-        self.restoreUnitHealth()
         self.drawAllUnits()
         self.drawScreen()
-        self.drawHUD()
 
     def placeCursor(self, coords):
-        """Move the cursor to a new location, redrawing the old and new
-        locations"""
-        oldRow, oldCol = self.cursorCoords
+        """Move the cursor to a new location"""
         self.cursorCoords = coords
-        self.redrawMapTile((oldRow, oldCol))
-        self.redrawMapTile(self.cursorCoords)
-
-    def placeUnit(self, team, type, coords):
-        """Place and draw the given unit in the given tile"""
-        row, col = coords
-        teamColor = self.teams[team].color
-        self.unitSpace[row][col] = type(team)
-        self.drawUnit(coords)
+        self.renderer.setSprites('cursor', {coords: self.cursor})
 
     def adjustCam(self):
+        """Scroll the camera, if need be, to keep the cursor in view"""
         row, col = self.cursorCoords
-        if col < self.camLeft:
-            self.camLeft -= 1
-            self.camRight -= 1
-        elif col >= self.camRight:
-            self.camLeft += 1
-            self.camRight += 1
-        if row < self.camTop:
-            self.camTop -= 1
-            self.camBottom -= 1
-        elif row >= self.camBottom:
-            self.camTop += 1
-            self.camBottom += 1
-        self.drawScreen()
+        self.viewport.scrollToShow(self.map.getTileRect(row, col))
+        self.drawHUD()
+
+    def jumpToTile(self, coords):
+        """Center the camera on a tile, e.g. one clicked on the minimap, and
+        move the cursor there if it is free to move"""
+        row, col = coords
+        tile = self.map.getTileRect(row, col)
+        width, height = self.viewport.rect.size
+        self.viewport.jumpTo(tile.centerx - width / 2,
+                             tile.centery - height / 2)
+        if not (self.gameIsOver or self.isComputerTurn() or
+                self.shopIsOpen or self.inAttackMode or
+                self.contextMenuIsOpen):
+            self.placeCursor(coords)
+        self.drawHUD()
+
+    def jumpToNextUnit(self):
+        """Jump to the active player's next unit that hasn't moved, in
+        reading order after the cursor"""
+        teamNumber = self.activePlayer.teamNumber
+        idle = sorted([coords for (unit, coords)
+                       in self.state.unitCoords.iteritems()
+                       if unit.teamNum == teamNumber and not unit.hasMoved])
+        if len(idle) > 0:
+            later = [coords for coords in idle if coords > self.cursorCoords]
+            self.jumpToTile(later[0] if len(later) > 0 else idle[0])
 
     def moveCursor(self, dir):
         """Handle motion of the cursor by the arrow keys"""
@@ -329,123 +333,59 @@ class Battle(PygameBaseClass):
             self.placeCursor(coords)
             self.adjustCam()
 
-    def getNextTiles(self, map, unit, coords):
-        """Return a list of the tiles adjacent to (row, col), sorted by
-        movement cost for the given unit"""
-        row, col = coords
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        nextTiles = []
-        for (dRow, dCol) in directions:
-            nextRow = row + dRow
-            nextCol = col + dCol
-            nextTiles.append((nextRow, nextCol))
-        return nextTiles
-
-    def isBlocked(self, coords):
-        """Return true if (row, col) is occupied by an enemy team"""
-        row, col = coords
-        unit = self.unitSpace[row][col]
-        activeTeam = self.activePlayer.color
-        return (unit != None) and (unit.team != activeTeam)
-
-    def movementRangeHelperFunction(self, map, unit, coords, movementPoints):
-        """Do a weighted floodfill method to populate the movement range"""
-        row, col = coords
-        if not (0 <= row < self.rows and 0 <= col < self.cols): return
-        terrainType = map[row][col].terrainType
-        movementCost = unit.movementCost[terrainType]
-        pointsAfterMove = movementPoints - movementCost
-        if (pointsAfterMove > 0 and movementCost != -1 and
-            not self.isBlocked(coords)):
-            self.movementRange.add(coords)
-            for newCoords in self.getNextTiles(map, unit, coords):
-                self.movementRangeHelperFunction(map, unit,
-                                                 newCoords, pointsAfterMove)
-
     def getMovementRange(self):
         """Calculate movement range from the current selection"""
-        map = self.map.map
-        row, col = self.selection
-        unit = self.unitSpace[row][col]
-        movementPoints = unit.movementPoints
-        self.movementRange.add(self.selection)
-        for newCoords in self.getNextTiles(map, unit, self.selection):
-                    self.movementRangeHelperFunction(map, unit,
-                                                     newCoords,
-                                                     movementPoints)
+        self.movementPaths = self.state.getMovementRange(self.selection)
+        self.movementRange = set(self.movementPaths)
         self.drawMovementRange()
 
     def clearMovementRange(self):
-        """Clear the movement range and redrawing all of the tiles"""
-        oldMovementRange = self.movementRange
+        """Clear the movement range and its overlay"""
         self.movementRange = set()
-        for tile in oldMovementRange:
-            self.redrawMapTile(tile)
-        self.drawScreen()
+        self.movementPaths = None
+        self.renderer.setSprites('movement', {})
+        self.drawHUD()
 
-    def checkArtilleryRange(self, unit, coords):
-        maxDistance = unit.artilleryMaxRange
-        minDistance = unit.artilleryMinRange
-        cRow, cCol = coords
-        for row in xrange(cRow - maxDistance, cRow + maxDistance + 1):
-            for col in xrange(cCol - maxDistance, cCol + maxDistance + 1):
-                taxicabDistance = abs(row - cRow) + abs(col - cCol)
-                if ((0 <= row < self.rows) and (0 <= col < self.cols) and
-                    self.isBlocked((row, col)) and
-                    (minDistance <= taxicabDistance <= maxDistance)):
-                    return True
-        return False
-
-    def checkAdjacent(self, coords):
-        cRow, cCol = coords
-        adjacentDir = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-        for (dRow, dCol) in adjacentDir:
-            newRow, newCol = cRow + dRow, cCol + dCol
-            if ((0 <= newRow <= self.rows and 0 <= newCol < self.cols) and
-                self.isBlocked((newRow, newCol))):
-                return True
-        return False
-
-    def canAttack(self, unit, coords, distanceMoved):
-        if unit.isArtilleryUnit and distanceMoved == 0:
-            return self.checkArtilleryRange(unit, coords)
-        elif not unit.isArtilleryUnit:
-            return self.checkAdjacent(coords)
-        else:
-            return False
+    def showDangerZone(self):
+        """Shade every tile that another team's units could attack next
+        turn"""
+        self.threatMap = ThreatMap(self.state, self.activePlayer.teamNumber)
+        self.renderer.setSprites('danger', dict.fromkeys(self.threatMap,
+                                                         self.dangerOverlay))
 
-    def canCapture(self, unit, coords):
-        row, col = coords
-        tile = self.map.map[row][col]
-        return (unit.canCapture and isinstance(tile, Objective) and
-                (unit.team != tile.team))
+    def hideDangerZone(self):
+        self.threatMap = None
+        self.renderer.setSprites('danger', {})
 
-    def openContextMenu(self, unit, coords, distanceMoved):
+    def toggleDangerZone(self):
+        if self.threatMap == None:
+            self.showDangerZone()
+        else:
+            self.hideDangerZone()
+
+    def openContextMenu(self, coords, distanceMoved):
         self.contextMenuIsOpen = True
         self.contextMenuOptions = [False, False]
         self.attackKey = None
         self.captureKey = None
         key = 1
-        if self.canAttack(unit, coords, distanceMoved):
+        if self.state.canAttack(coords, distanceMoved):
             key += 1
             self.attackKey = str(key)
             self.contextMenuOptions[0] = True
-        if self.canCapture(unit, coords):
+        if self.state.canCapture(coords):
             key += 1
             self.captureKey = str(key)
             self.contextMenuOptions[1] = True
         self.drawHUD()
 
-    def moveUnit(self, old, new):
-        """Move the unit from one tile to another"""
-        oldRow, oldCol = old
-        newRow, newCol = new
-        if self.unitSpace[newRow][newCol] == None:
-            unit = self.unitSpace[oldRow][oldCol]
-            self.unitSpace[newRow][newCol] = unit
-            self.unitSpace[oldRow][oldCol] = None
-            self.redrawMapTile(old)
-            self.redrawMapTile(new)
+    def moveUnit(self, old, new, path=None):
+        """Move the unit from one tile to another, sliding along path, the
+        tiles it passes through, if one is given"""
+        unit = self.state.getUnit(old)
+        self.state.moveUnit(old, new)
+        self.animateMove(unit, path)
+        self.redrawChangedTiles()
         self.selection = None
         self.clearMovementRange()
 
@@ -456,28 +396,27 @@ class Battle(PygameBaseClass):
             # get the selection and movement range
             row, col = self.cursorCoords
             unit = self.unitSpace[row][col]
-            tile = self.map.map[row][col]
+            objective = self.state.getObjective(self.cursorCoords)
             if ((unit != None) and
-                (unit.team == self.activePlayer.color) and
-                (unit in self.activeUnits)):
+                (unit.teamNum == self.activePlayer.teamNumber) and
+                (unit in self.state.activeUnits)):
                 self.unitIsSelected = True
                 self.selection = self.cursorCoords
                 self.getMovementRange()
-            elif ((unit == None) and isinstance(tile, Objective) and
-                  (tile.team == self.activePlayer.color) and
-                  (tile.type == 'Factory')):
+            elif ((unit == None) and objective != None and
+                  objective == (self.activePlayer.teamNumber, 2)):
                 self.shopIsOpen = True
                 self.shopCoords = self.cursorCoords
-                self.drawScreen()
+                self.drawHUD()
         elif (self.cursorCoords in self.movementRange and
               (self.unitSpace[row][col] == None or
                self.selection == self.cursorCoords)):
             self.oldCoords = oldRow, oldCol = self.selection
             self.newCoords = newRow, newCol = self.cursorCoords
-            self.moveUnit(self.selection, self.cursorCoords)
+            self.moveUnit(self.selection, self.cursorCoords,
+                          self.movementPaths.getPath(self.cursorCoords))
             taxicabDistance = abs(newRow - oldRow) + abs(newCol - oldCol)
-            unit = self.unitSpace[newRow][newCol]
-            self.openContextMenu(unit, self.newCoords, taxicabDistance)
+            self.openContextMenu(self.newCoords, taxicabDistance)
         else:
             self.clearSelection
 
@@ -487,53 +426,118 @@ class Battle(PygameBaseClass):
         self.selection = None
         self.clearMovementRange()
 
-    def restoreObjectives(self):
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                unit = self.unitSpace[row][col]
-                objective = self.map.map[row][col]
-                if (isinstance(objective, Objective) and
-                    (unit == None or unit.team == objective.team)):
-                    objective.health = Objective.baseHealth
-
-    def restoreUnitHealth(self):
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                unit = self.unitSpace[row][col]
-                objective = self.map.map[row][col]
-                if ((unit != None) and isinstance(objective, Objective) and
-                    (unit.team == objective.team) and
-                    (unit.team == self.activePlayer.color)):
-                    unit.health += 50
-                    if unit.health > 100:
-                        unit.health = 100
+    def storeView(self):
+        """Store the current player's cursor position and camera, to the
+        nearest tile"""
+        self.activePlayer.cursorCoords = self.cursorCoords
+        x, y = self.viewport.getPosition()
+        self.activePlayer.camLeft = int(round(float(x) / Tile.size))
+        self.activePlayer.camRight = self.activePlayer.camLeft + self.camWidth
+        self.activePlayer.camTop = int(round(float(y) / Tile.size))
+        self.activePlayer.camBottom = (self.activePlayer.camTop +
+                                       self.camHeight)
 
     def endTurn(self):
         """Store the current player's cursor position and begin the next
         player's turn"""
-        self.restoreObjectives()
-        for unit in self.activePlayer.units:
-            unit.hasMoved = False
-        self.activePlayer.cursorCoords = self.cursorCoords
-        self.activePlayer.camLeft = self.camLeft
-        self.activePlayer.camRight = self.camRight
-        self.activePlayer.camTop = self.camTop
-        self.activePlayer.camBottom = self.camBottom
-        self.playerIndex += 1
-        while self.playerIndex in self.eliminatedPlayers:
-            self.playerIndex += 1
-        self.playerIndex %= self.numPlayers
+        self.storeView()
+        self.state.endTurn()
         self.beginTurn()
-
-    def wait(self):
-        row, col = self.newCoords
-        unit = self.unitSpace[row][col]
-        unit.hasMoved = True
+        self.autosave()
+
+    def isComputerTurn(self):
+        return self.activePlayer.teamNumber in self.aiPlayers
+
+    def isBusy(self):
+        """The camera glides and units slide without waiting for keys, and
+        so is a computer player's turn played"""
+        return (self.viewport.isMoving() or self.animator.isBusy() or
+                (self.isComputerTurn() and not self.gameIsOver))
+
+    def update(self):
+        """Move the camera and the sliding units, and play the turn of a
+        computer player"""
+        self.viewport.update()
+        self.animator.update()
+        if self.isComputerTurn() and not self.gameIsOver:
+            self.playComputerTurn()
+
+    def playComputerTurn(self):
+        """Plan the computer player's turn a little in each frame, then play
+        its commands one at a time, each once the moves before it have been
+        shown"""
+        if self.aiCommands == None:
+            if self.aiPlanner == None:
+                self.clearSelection()
+                self.aiPlanner = ai.TurnPlanner(self.state, self.aiTimeBudget)
+                self.aiPlanning = self.aiPlanner.planSteps()
+            stop = time.time() + self.aiFrameBudget
+            for step in self.aiPlanning:
+                if time.time() > stop:
+                    return # plan on in the next frame
+            planner = self.aiPlanner
+            self.aiPlanner = self.aiPlanning = None
+            self.aiCommands = planner.playSteps(planner.commands)
+        while not self.animator.isBusy():
+            command = next(self.aiCommands, None)
+            if command == None:
+                self.aiCommands = None
+                self.endTurn()
+                return
+            if command[0] == 'move':
+                start, dest = command[1:]
+                unit = self.state.getUnit(dest)
+                path = pathfinding.getMovementRange(
+                    self.state.terrain, unit, start,
+                    self.state.isBlocked).getPath(dest)
+                self.animateMove(unit, path)
+            self.redrawChangedTiles()
+            if self.gameIsOver:
+                self.aiCommands = None
+                self.drawHUD()
+                return
+
+    def animateMove(self, unit, path):
+        """Show a unit that has just moved sliding along its path, unless
+        moves aren't animated or are being fast-forwarded. Its tile shows
+        no unit until it arrives."""
+        if (not self.animateMoves or self.fastForward or path == None or
+            len(path) < 2):
+            return
+        dest = path[-1]
+        def arrive():
+            self.hiddenUnits.discard(dest)
+            self.drawUnit(dest)
+        self.hiddenUnits.add(dest)
+        self.animator.add(MoveAnimation(unit.image, path, self.moveSpeed,
+                                        arrive))
+
+    def save(self, path):
+        """Save the battle as it stands to path"""
+        self.storeView()
+        return saveGame.save(saveGame.Snapshot.fromState(self.state), path)
+
+    def autosave(self):
+        """Save the battle to autosavePath at the start of every turn. The
+        first save is a full snapshot and later ones append what changed."""
+        if self.autoSaver == None:
+            directory = os.path.dirname(self.autosavePath)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.autoSaver = saveGame.AutoSaver(self.autosavePath)
+        self.autoSaver.save(self.state)
+
+    def finishAction(self):
+        """Close the menus once the selected unit has acted"""
         self.unitIsSelected = False
-        self.activeUnits.remove(unit)
         self.contextMenuIsOpen = False
-        self.redrawMapTile(self.newCoords)
-        self.drawScreen()
+        self.forecasts.clear() # health may have changed
+        self.redrawChangedTiles()
+        self.drawHUD()
+
+    def wait(self):
+        self.state.wait(self.newCoords)
+        self.finishAction()
 
     def revertMove(self):
         self.moveUnit(self.newCoords, self.oldCoords)
@@ -541,117 +545,45 @@ class Battle(PygameBaseClass):
         self.unitIsSelected = False
         self.drawHUD()
 
-    def endGame(self):
-        self.gameIsOver = True
-        self.winner = None
-        for team in self.teams:
-            if team.teamNumber not in self.eliminatedPlayers:
-                self.winner = team
-        self.drawScreen()
-
-    def removeTeam(self, teamNum):
-        self.eliminatedPlayers.add(teamNum)
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                unit = self.unitSpace[row][col]
-                tile = self.map.map[row][col]
-                if unit != None and unit.teamNum == teamNum:
-                    self.unitSpace[row][col] = None
-                if isinstance(tile, Objective) and tile.teamNum == teamNum:
-                    typeNum = tile.typeNum
-                    if typeNum == 0: typeNum = 1 # replace HQ with a city
-                    self.map.map[row][col] = Objective((4, typeNum))
-        if self.numPlayers - len(self.eliminatedPlayers) == 1:
-            self.endGame()
-        self.map.refreshImage()
-        self.drawMap()
-        self.drawAllUnits()
-        self.drawScreen()
+    def redrawChangedTiles(self):
+        """Bring the map and screen up to date with the tiles the game state
+        changed. Objectives that changed hands get new map tiles; redrawing
+        the tile above as well covers their overflow."""
+        changedTiles = self.state.changedTiles
+        self.state.changedTiles = set()
+        if self.threatMap != None:
+            for coords in self.threatMap.update(changedTiles):
+                if coords in self.threatMap:
+                    self.renderer.setSprite('danger', coords,
+                                            self.dangerOverlay)
+                else:
+                    self.renderer.setSprite('danger', coords, None)
+        if self.minimap != None:
+            self.minimap.update(changedTiles)
+        for coords in changedTiles:
+            row, col = coords
+            objective = self.state.getObjective(coords)
+            if objective != None and objective != self.map.getContent(coords):
+                self.map.changeTile(objective, coords)
+                self.redrawMapTile(coords)
+                if row > 0:
+                    self.redrawMapTile((row - 1, col))
+            self.drawUnit(coords)
 
     def capture(self):
-        row, col = self.newCoords
-        objective = self.map.map[row][col]
-        unit = self.unitSpace[row][col]
-        objective.health -= (unit.health / 10)
-        if objective.health <= 0:
-            oldTeam = objective.teamNum
-            if oldTeam != 4:
-                self.teams[oldTeam].heldObjectives.remove(objective)
-            team = unit.teamNum
-            type = objective.typeNum
-            if type == 0:
-                self.removeTeam(oldTeam)
-                type = 1 # don't allow a team to gain more than one HQ
-            newObjective = Objective((team, type))
-            self.map.map[row][col] = newObjective
-            self.activePlayer.heldObjectives.append(newObjective)
-            self.map.refreshImage()
-            self.redrawMapTile((row, col))
-            self.redrawMapTile((row-1, col))
-            self.drawScreen()
-        self.wait()
+        self.state.capture(self.newCoords)
+        self.finishAction()
 
     def moveTarget(self):
-        oldCoords = None
-        newCoords = self.targets[self.targetIndex]
-        if self.targetCoords != None:
-            oldCoords = self.targetCoords
-        self.targetCoords = newCoords
-        if oldCoords != None:
-            self.redrawMapTile(oldCoords)
-        self.redrawMapTile(newCoords)
-        self.drawScreen()
-
-    def getArtilleryTargets(self):
-        cRow, cCol = self.attackerCoords
-        unit = self.unitSpace[cRow][cCol]
-        maxDistance = unit.artilleryMaxRange
-        minDistance = unit.artilleryMinRange
-        for row in xrange(cRow - maxDistance, cRow + maxDistance + 1):
-            for col in xrange(cCol - maxDistance, cCol + maxDistance + 1):
-                taxicabDistance = abs(row - cRow) + abs(col - cCol)
-                if ((0 <= row < self.rows) and (0 <= col < self.cols) and
-                    self.isBlocked((row, col)) and
-                    (minDistance <= taxicabDistance <= maxDistance)):
-                    self.targets.append((row, col))
-
-    def getTargets(self):
-        cRow, cCol = self.attackerCoords
-        directions = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        for (dRow, dCol) in directions:
-            row = cRow + dRow
-            col = cCol + dCol
-            if ((0 <= row < self.rows) and (0 <= col < self.cols) and
-                self.isBlocked((row, col))):
-                self.targets.append((row, col))
-
-    def removeUnit(self, coords):
-        row, col = coords
-        unit = self.unitSpace[row][col]
-        team = self.teams[unit.teamNum]
-        team.units.remove(unit)
-        self.unitSpace[row][col] = None
-        if len(team.units) == 0:
-            self.removeTeam(unit.teamNum)
+        self.targetCoords = self.targets[self.targetIndex]
+        self.renderer.setSprites('target',
+                                 {self.targetCoords: self.targetOverlay})
+        self.drawHUD()
 
     def attack(self):
-        atkRow, atkCol = self.attackerCoords
-        defRow, defCol = self.targets[self.targetIndex]
-        attacker = self.unitSpace[atkRow][atkCol]
-        defender = self.unitSpace[defRow][defCol]
-        atkEnv = self.map.defense[atkRow][atkCol]
-        defEnv = self.map.defense[defRow][defCol]
-        defender.health -= attacker.getAttackDamage(defender, defEnv)
-        if defender.health <= 0:
-            self.removeUnit((defRow, defCol))
-        elif not attacker.isArtilleryUnit and not defender.isArtilleryUnit:
-            attacker.health -= defender.getRetaliatoryDamage(attacker, atkEnv)
-            if attacker.health <= 0:
-                self.removeUnit((atkRow, atkCol))
-        self.unitIsSelected = False
-        self.contextMenuIsOpen = False
-        if self.unitSpace[atkRow][atkCol] != None:
-            self.wait()
+        target = self.targets[self.targetIndex]
+        self.state.attack(self.attackerCoords, target)
+        self.finishAction()
 
     def contextMenu(self, keyName):
         if keyName == '1':
@@ -663,16 +595,26 @@ class Battle(PygameBaseClass):
         elif keyName == 'x':
             self.revertMove()
 
+    def getForecast(self, targetCoords):
+        """Get the combat.Forecast of the selected unit attacking
+        targetCoords. Forecasts are kept until a unit's health changes."""
+        attacker = self.state.getUnit(self.attackerCoords)
+        target = self.state.getUnit(targetCoords)
+        key = (attacker, target, self.attackerCoords, targetCoords)
+        forecast = self.forecasts.get(key)
+        if forecast == None:
+            forecast = combat.Forecast(self.state, self.attackerCoords,
+                                       targetCoords)
+            self.forecasts[key] = forecast
+        return forecast
+
     def enterAttackMode(self):
         self.inAttackMode = True
-        row, col = self.attackerCoords = self.cursorCoords
-        self.targets = []
+        self.attackerCoords = self.cursorCoords
+        self.targets = self.state.getTargets(self.attackerCoords)
+        for targetCoords in self.targets:
+            self.getForecast(targetCoords)
         self.targetIndex = 0
-        unit = self.unitSpace[row][col]
-        if unit.isArtilleryUnit:
-            self.getArtilleryTargets()
-        else:
-            self.getTargets()
         self.moveTarget()
 
     def attackMode(self, keyName):
@@ -687,42 +629,34 @@ class Battle(PygameBaseClass):
         elif keyName == 'z':
             self.inAttackMode = False
             self.attack()
-            self.redrawMapTile(self.attackerCoords)
-            self.redrawMapTile(self.targetCoords)
-            self.drawScreen()
+            self.renderer.setSprites('target', {})
+            self.drawHUD()
         elif keyName == 'x':
             self.inAttackMode = False
-            self.redrawMapTile(self.attackerCoords)
-            self.redrawMapTile(self.targetCoords)
-            self.drawScreen()
+            self.renderer.setSprites('target', {})
+            self.drawHUD()
 
     def shop(self, keyName):
         if keyName == 'x':
             self.shopIsOpen = False
-            self.drawScreen()
+            self.drawHUD()
         elif keyName in '123456':
             num = int(keyName)
-            cost = Battle.shopCosts[num]
-            if cost <= self.activePlayer.funds:
-                self.activePlayer.funds -= cost
-                type = Battle.shopTypes[num]
-                team = self.activePlayer.teamNumber
-                self.placeUnit(team, type, self.shopCoords)
-                row, col = self.shopCoords
-                unit = self.unitSpace[row][col]
-                self.activePlayer.units.add(unit)
-                unit.hasMoved = True
-                self.redrawMapTile(self.shopCoords)
+            if self.state.buyUnit(self.shopCoords, num) != None:
+                self.redrawChangedTiles()
                 self.shopIsOpen = False
-                self.drawScreen()
+                self.drawHUD()
 
     def onKeyDown(self, event):
         """Handle keypresses"""
         keyName = pygame.key.name(event.key)
+        self.animator.finish() # a key shows the moves under way at once
         if keyName == 'escape':
             self.quit()
         elif self.gameIsOver:
             self.quit()
+        elif self.isComputerTurn():
+            self.fastForward = True # and the rest of the computer's turn
         elif self.shopIsOpen:
             self.shop(keyName)
         elif self.inAttackMode:
@@ -737,125 +671,173 @@ class Battle(PygameBaseClass):
             self.clearSelection()
         elif keyName == 'space':
             self.endTurn()
+        elif keyName == 'd':
+            self.toggleDangerZone()
+        elif keyName == 'n':
+            self.jumpToNextUnit()
+
+    def onMouseMotion(self, event):
+        """Pan the camera while the mouse is near an edge of the map"""
+        self.viewport.panAt(event.pos)
+
+    def onMouseButtonDown(self, event):
+        """Jump to the tile clicked on the minimap"""
+        if event.button == 1 and self.minimap != None:
+            coords = self.minimap.getCoordsAt(event.pos)
+            if coords != None:
+                self.jumpToTile(coords)
 
     ##################################################################
     # Drawing to "screen" surface
     ##################################################################
 
     def redrawMapTile(self, coords):
-        """Redraw the tile at the given coords"""
-        row, col = coords
-        left, top = col * Tile.size, row * Tile.size
-        width = height = Tile.size
-        self.drawMap(pygame.Rect(left, top, width, height))
-        self.drawUnit(coords)
-        if coords in self.movementRange:
-            self.drawMovementOverlay(coords)
-        if coords == self.cursorCoords:
-            self.drawCursor(coords)
-        if self.inAttackMode and coords == self.targetCoords:
-            self.drawTargetOverlay(coords)
+        """Redraw the tile at the given coords at the end of the frame, e.g.
+        after its terrain changed. Units and overlays are kept up to date
+        by the renderer, which redraws the tiles whose sprites changed."""
+        self.renderer.markDirty(coords)
+
+    def drawArea(self, rect):
+        """Draw a part of the screen surface from scratch. The screen calls
+        this for each chunk of it the camera shows that it hasn't kept."""
+        self.renderer.drawArea(rect)
 
     def drawMap(self, boundingBox=None):
         """Draw the game map to the screen. If a boundingBox rect is given,
-        only draw that portion of the map. Otherwise, draw the entire map."""
+        only draw that portion of the map. Otherwise, draw the entire map,
+        which is done chunk by chunk as the camera shows it."""
         if boundingBox == None:
-            self.screen.blit(self.map.image, (0,0))
+            self.screen.clear()
+            self.renderer.clear()
             self.drawScreen()
         else:
-            self.screen.blit(self.map.image, boundingBox, area=boundingBox)
-
-    def drawMovedMarker(self, coords):
-        row, col = coords
-        top, left = row * Tile.size, col * Tile.size
-        self.screen.blit(self.movedMarker, (left, top))
+            self.map.drawArea(self.screen, boundingBox)
 
     def drawUnit(self, coords):
-        """Draw a single unit at the specified unit space coords"""
+        """Show the unit at coords, if there is one, with a marker if it
+        has moved"""
         row, col = coords
         unit = self.unitSpace[row][col]
-        if unit != None:
-            drawCoords = (col*Tile.size, row*Tile.size)
-            self.screen.blit(unit.image, drawCoords)
-            if unit.hasMoved:
-                self.drawMovedMarker(coords)
+        if unit == None or coords in self.hiddenUnits:
+            self.renderer.setSprite('units', coords, None)
+            self.renderer.setSprite('moved', coords, None)
+        else:
+            self.renderer.setSprite('units', coords, unit.image)
+            self.renderer.setSprite('moved', coords, self.movedMarker
+                                    if unit.hasMoved else None)
 
     def drawAllUnits(self):
-        """Draw all the units in the unit space"""
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                unit = self.unitSpace[row][col]
-                if unit != None:
-                    self.redrawMapTile((row,col))
-        self.drawScreen()
-
-    def drawCursor(self, coords):
-        """Draws a white rectangle"""
-        row, col = coords
-        top, left = row * Tile.size, col * Tile.size
-        self.screen.blit(self.cursor, (left, top))
-
-    def drawMovementOverlay(self, coords):
-        """Draw an overlay on the tile specified by the coords"""
-        row, col = coords
-        top, left = row * Tile.size, col * Tile.size
-        self.screen.blit(self.movementOverlay, (left, top))
+        """Show all the units in the unit space"""
+        for coords in self.state.unitCoords.values():
+            self.drawUnit(coords)
+        self.drawHUD()
 
     def drawMovementRange(self):
-        """Placeholder. draws a green rectangle"""
-        for tile in self.movementRange:
-            self.redrawMapTile(tile)
-        self.drawScreen()
-
-    def drawTargetOverlay(self, coords):
-        row, col = coords
-        top, left = row * Tile.size, col * Tile.size
-        self.screen.blit(self.targetOverlay, (left, top))
+        """Shade the tiles of the movement range"""
+        self.renderer.setSprites('movement', dict.fromkeys(
+            self.movementRange, self.movementOverlay))
+        self.drawHUD()
 
     ##################################################################
     # Drawing to the screen
     ##################################################################
 
     def drawScreen(self):
-        displayTopLeft = (self.camLeft * Tile.size, self.camTop * Tile.size)
-        displayDimensions = (self.camWidth * Tile.size,
-                             self.camHeight * Tile.size)
-        boundingBox = Rect(displayTopLeft, displayDimensions)
-        self.display.blit(self.screen, self.screenTopLeft, area=boundingBox)
-        self.drawHUD()
-        pygame.display.flip()
+        """Schedule the camera's view of the screen surface and the HUD to
+        be redrawn at the end of the frame"""
+        self.viewport.invalidate()
+        self.hudIsDirty = True
+
+    def drawHUD(self):
+        """Schedule the HUD to be redrawn at the end of the frame"""
+        self.hudIsDirty = True
+
+    def drawFrame(self):
+        """Draw whatever was scheduled while handling this frame's events.
+        Called once per frame by the main loop."""
+        self.renderer.flush()
+        self.viewport.present()
+        self.animator.present()
+        if self.hudIsDirty:
+            self.renderHUD()
+        self.drawMinimap()
+
+    def drawMinimap(self):
+        """Draw the minimap if it changed or the camera moved"""
+        cameraRect = self.viewport.getSourceRect()
+        if self.minimap != None and self.minimap.needsDrawing(cameraRect):
+            self.compositor.markDirty(self.minimap.draw(self.display,
+                                                        cameraRect))
+
+    def getViewportRect(self):
+        """Get the part of the display showing the map"""
+        return self.viewport.rect
+
+    def presentTile(self, coords):
+        """Copy a single redrawn tile to the display, if the camera can see
+        it and the whole view isn't about to be copied anyway"""
+        row, col = coords
+        self.viewport.presentRect(self.map.getTileRect(row, col))
+
+    def blitHUD(self, surface, coords):
+        """Draw a HUD widget, remembering where so that it can be erased
+        the next time the HUD is drawn"""
+        rect = self.display.blit(surface, coords)
+        self.hudRects.append(rect)
+        self.compositor.markDirty(rect)
 
     def drawBackground(self):
+        """Draw the whole HUD background, e.g. when the active team
+        changes"""
         background = self.activePlayer.hudImage
         self.display.blit(background, (0, 0))
+        self.hudBackground = background
+        if self.minimap != None:
+            self.minimap.isDirty = True # drawn over
+        viewport = self.getViewportRect()
+        width, height = self.display.get_size()
+        self.compositor.markDirty(Rect(0, 0, width, viewport.top))
+        self.compositor.markDirty(Rect(viewport.right, viewport.top,
+                                       width - viewport.right,
+                                       height - viewport.top))
+
+    def eraseHUD(self):
+        """Restore the background under the widgets drawn last time"""
+        background = self.activePlayer.hudImage
+        if background is not self.hudBackground:
+            self.drawBackground()
+        else:
+            for rect in self.hudRects:
+                self.display.blit(background, rect, area=rect)
+                self.compositor.markDirty(rect)
+                if (self.minimap != None and
+                    self.minimap.rect.inflate(4, 4).colliderect(rect)):
+                    self.minimap.isDirty = True
+        self.hudRects = []
 
     def drawHUDTileImage(self, tile, coords):
         x, y = coords
         image = tile.staticImage
-        self.display.blit(image, (x, y - tile.overflow))
+        self.blitHUD(image, (x, y - tile.overflow))
 
     def drawHUDTileName(self, tile, coords):
-        nameFont = pygame.font.SysFont('Arial', 24, True)
         nameText = tile.name
-        name = nameFont.render(nameText, 1, (0, 0, 0))
-        self.display.blit(name, coords)
+        name = renderText(nameText, 'Arial', 24, True)
+        self.blitHUD(name, coords)
 
     def drawHUDTileDef(self, tile, coords):
-        defFont = pygame.font.SysFont('Arial', 18)
         defText = "Def: " + str(tile.defense)
-        defSurf = defFont.render(defText, 1, (0, 0, 0))
-        self.display.blit(defSurf, coords)
+        defSurf = renderText(defText, 'Arial', 18)
+        self.blitHUD(defSurf, coords)
 
-    def drawHUDObjHealth(self, tile, coords):
-        healthFont = pygame.font.SysFont('Arial', 18)
-        healthText = "HP: " + str(tile.health)
-        health = healthFont.render(healthText, 1, (0, 0, 0))
-        self.display.blit(health, coords)
+    def drawHUDObjHealth(self, health, coords):
+        healthText = "HP: " + str(health)
+        health = renderText(healthText, 'Arial', 18)
+        self.blitHUD(health, coords)
 
     def drawTerrainInfo(self):
         left, top = 1024, 654
-        row, col = self.cursorCoords
-        tile = self.map.map[row][col]
+        tile = self.map.getTile(self.cursorCoords)
         imageCoords = (left + 32 , top + 4)
         self.drawHUDTileImage(tile, imageCoords)
         nameCoords = (left + 112, top)
@@ -864,35 +846,32 @@ class Battle(PygameBaseClass):
         self.drawHUDTileDef(tile, defCoords)
         if isinstance(tile, Objective):
             healthCoords = (left + 112, top + 48)
-            self.drawHUDObjHealth(tile, healthCoords)
+            health = self.state.objectiveHealth[self.cursorCoords]
+            self.drawHUDObjHealth(health, healthCoords)
 
     def drawHUDUnitImage(self, unit, coords):
         image = unit.image
-        self.display.blit(image, coords)
+        self.blitHUD(image, coords)
 
     def drawHUDUnitName(self, unit, coords):
-        nameFont = pygame.font.SysFont('Arial', 24, True)
         nameText = unit.type
-        name = nameFont.render(nameText, 1, (0, 0, 0))
-        self.display.blit(name, coords)
+        name = renderText(nameText, 'Arial', 24, True)
+        self.blitHUD(name, coords)
 
     def drawHUDUnitAtk(self, unit, coords):
-        atkFont = pygame.font.SysFont('Arial', 18)
         atkText = "Atk: " + str(unit.attack)
-        atk = atkFont.render(atkText, 1, (0, 0, 0))
-        self.display.blit(atk, coords)
+        atk = renderText(atkText, 'Arial', 18)
+        self.blitHUD(atk, coords)
 
     def drawHUDUnitDef(self, unit, coords):
-        defFont = pygame.font.SysFont('Arial', 18)
         defText = "Def: " + str(unit.defense)
-        defSurf = defFont.render(defText, 1, (0, 0, 0))
-        self.display.blit(defSurf, coords)
+        defSurf = renderText(defText, 'Arial', 18)
+        self.blitHUD(defSurf, coords)
 
     def drawHUDUnitHealth(self, unit, coords):
-        healthFont = pygame.font.SysFont('Arial', 18)
         healthText = "HP: " + str(unit.health)
-        health = healthFont.render(healthText, 1, (0, 0, 0))
-        self.display.blit(health, coords)
+        health = renderText(healthText, 'Arial', 18)
+        self.blitHUD(health, coords)
 
     def drawUnitInfo(self):
         left, top = 1024, 512
@@ -911,31 +890,27 @@ class Battle(PygameBaseClass):
             self.drawHUDUnitHealth(unit, healthCoords)
 
     def drawHUDWait(self, coords):
-        waitFont = pygame.font.SysFont('Arial', 24, True)
         waitText = "(1) to Wait"
-        wait = waitFont.render(waitText, 1, (0, 0, 0))
-        self.display.blit(wait, coords)
+        wait = renderText(waitText, 'Arial', 24, True)
+        self.blitHUD(wait, coords)
 
     def drawHUDAttack(self, (left, top), num):
         coords = (left, top + (24*(num-1)))
-        attackFont = pygame.font.SysFont('Arial', 24, True)
         attackText = "(%d) to Attack" % num
-        attack = attackFont.render(attackText, 1, (0, 0, 0))
-        self.display.blit(attack, coords)
+        attack = renderText(attackText, 'Arial', 24, True)
+        self.blitHUD(attack, coords)
 
     def drawHUDCapture(self, (left, top), num):
         coords = (left, top + (24*(num-1)))
-        captureFont = pygame.font.SysFont('Arial', 24, True)
         captureText = "(%d) to Capture" % num
-        capture = captureFont.render(captureText, 1, (0, 0, 0))
-        self.display.blit(capture, coords)
+        capture = renderText(captureText, 'Arial', 24, True)
+        self.blitHUD(capture, coords)
 
     def drawExitContextMenu(self, (left, top), num):
         coords = (left, top + (24*(num-1)))
-        exitFont = pygame.font.SysFont('Arial', 24, True)
         exitText = "(x) to Undo Move"
-        exit = exitFont.render(exitText, 1, (0, 0, 0))
-        self.display.blit(exit, coords)
+        exit = renderText(exitText, 'Arial', 24, True)
+        self.blitHUD(exit, coords)
 
     def drawContextMenu(self):
         left, top = 1000, 144
@@ -954,19 +929,18 @@ class Battle(PygameBaseClass):
 
     def drawAtkInstr(self, coords):
         left, top = coords
-        instrFont = pygame.font.SysFont('Arial', 24, True)
         instrText1 = "Use left/right arrow"
         instrText2 = "keys to select target"
         instrText3 = "(z) Attack"
         instrText4 = "(x) Back"
-        instr1 = instrFont.render(instrText1, 1, (0, 0, 0))
-        instr2 = instrFont.render(instrText2, 1, (0, 0, 0))
-        instr3 = instrFont.render(instrText3, 1, (0, 0, 0))
-        instr4 = instrFont.render(instrText4, 1, (0, 0, 0))
-        self.display.blit(instr1, (left + 48, top ))
-        self.display.blit(instr2, (left + 48, top + 24))
-        self.display.blit(instr3, (left + 48, top + 48))
-        self.display.blit(instr4, (left + 48, top + 72))
+        instr1 = renderText(instrText1, 'Arial', 24, True)
+        instr2 = renderText(instrText2, 'Arial', 24, True)
+        instr3 = renderText(instrText3, 'Arial', 24, True)
+        instr4 = renderText(instrText4, 'Arial', 24, True)
+        self.blitHUD(instr1, (left + 48, top ))
+        self.blitHUD(instr2, (left + 48, top + 24))
+        self.blitHUD(instr3, (left + 48, top + 48))
+        self.blitHUD(instr4, (left + 48, top + 72))
 
     def drawTarget(self, coords):
         left, top = coords
@@ -983,30 +957,45 @@ class Battle(PygameBaseClass):
         healthCoords = (left + 136, top + 68)
         self.drawHUDUnitHealth(unit, healthCoords)
 
+    def drawForecast(self, coords):
+        left, top = coords
+        forecast = self.getForecast(self.targetCoords)
+        dealtText = "Deals %d-%d (avg %d)" % (forecast.dealt.minimum,
+                                              forecast.dealt.maximum,
+                                              round(forecast.expectedDealt))
+        killText = "Destroys: %d%%" % round(100 * forecast.killProbability)
+        if forecast.maxTaken > 0:
+            takenText = "Takes up to %d back (avg %d)" % (
+                forecast.maxTaken, round(forecast.expectedTaken))
+        else:
+            takenText = "Takes no damage back"
+        self.blitHUD(renderText(dealtText, 'Arial', 18), (left + 56, top))
+        self.blitHUD(renderText(killText, 'Arial', 18), (left + 56, top + 20))
+        self.blitHUD(renderText(takenText, 'Arial', 18), (left + 56, top + 40))
+
     def drawAttackInstructions(self):
         left, top = 1000, 144
         self.drawAtkInstr((left, top))
         self.drawTarget((left, top + 96))
+        self.drawForecast((left, top + 192))
 
     def drawTurnText(self, coords):
-        turnFont = pygame.font.SysFont('Tahoma', 64, True)
         turnText = "%s's Turn" % self.activePlayer.color
-        turn = turnFont.render(turnText, 1, (0, 0, 0))
-        self.display.blit(turn, coords)
+        turn = renderText(turnText, 'Tahoma', 64, True)
+        self.blitHUD(turn, coords)
 
     def drawMoneyText(self, coords):
         left, top = coords
-        moneyFont = pygame.font.SysFont('Arial', 24, True)
         moneyText1 = "Funds: $%d" % self.activePlayer.funds
         moneyText2 = "Buildings: %d" % len(self.activePlayer.heldObjectives)
         moneyText3 = "+$%d per Turn" % (1000 *
                                         len(self.activePlayer.heldObjectives))
-        money1 = moneyFont.render(moneyText1, 1, (0, 0, 0))
-        money2 = moneyFont.render(moneyText2, 1, (0, 0, 0))
-        money3 = moneyFont.render(moneyText3, 1, (0, 0, 0))
-        self.display.blit(money1, coords)
-        self.display.blit(money2, (left, top + 24))
-        self.display.blit(money3, (left, top + 48))
+        money1 = renderText(moneyText1, 'Arial', 24, True)
+        money2 = renderText(moneyText2, 'Arial', 24, True)
+        money3 = renderText(moneyText3, 'Arial', 24, True)
+        self.blitHUD(money1, coords)
+        self.blitHUD(money2, (left, top + 24))
+        self.blitHUD(money3, (left, top + 48))
 
     def drawPlayerInfo(self):
         left, top = 0, 0
@@ -1018,55 +1007,57 @@ class Battle(PygameBaseClass):
         text1 = 'Arrow keys to move'
         text2 = '(z) to select unit'
         text3 = '(space) to end turn'
-        textFont = pygame.font.SysFont('Arial', 24, True)
-        t1 = textFont.render(text1, 1, (0, 0, 0))
-        t2 = textFont.render(text2, 1, (0, 0, 0))
-        t3 = textFont.render(text3, 1, (0, 0, 0))
-        self.display.blit(t1, (left + 48, top))
-        self.display.blit(t2, (left + 48, top + 24))
-        self.display.blit(t3, (left + 48, top + 48))
+        text4 = '(d) to show danger zone'
+        text5 = '(n) to find next unit'
+        t1 = renderText(text1, 'Arial', 24, True)
+        t2 = renderText(text2, 'Arial', 24, True)
+        t3 = renderText(text3, 'Arial', 24, True)
+        t4 = renderText(text4, 'Arial', 24, True)
+        t5 = renderText(text5, 'Arial', 24, True)
+        self.blitHUD(t1, (left + 48, top))
+        self.blitHUD(t2, (left + 48, top + 24))
+        self.blitHUD(t3, (left + 48, top + 48))
+        self.blitHUD(t4, (left + 48, top + 72))
+        self.blitHUD(t5, (left + 48, top + 96))
 
     def drawMovementInstr(self):
         left, top = 1000, 144
         text1 = 'Arrow keys to move'
         text2 = '(z) to move unit'
         text3 = '(x) to undo'
-        textFont = pygame.font.SysFont('Arial', 24, True)
-        t1 = textFont.render(text1, 1, (0, 0, 0))
-        t2 = textFont.render(text2, 1, (0, 0, 0))
-        t3 = textFont.render(text3, 1, (0, 0, 0))
-        self.display.blit(t1, (left + 48, top))
-        self.display.blit(t2, (left + 48, top + 24))
-        self.display.blit(t3, (left + 48, top + 48))
+        t1 = renderText(text1, 'Arial', 24, True)
+        t2 = renderText(text2, 'Arial', 24, True)
+        t3 = renderText(text3, 'Arial', 24, True)
+        self.blitHUD(t1, (left + 48, top))
+        self.blitHUD(t2, (left + 48, top + 24))
+        self.blitHUD(t3, (left + 48, top + 48))
 
     def drawShop(self):
         left, top = 1048, 144
-        textFont = pygame.font.SysFont('Arial', 24, True)
         for option in xrange(6):
             key = option + 1
             text = '(%d) %s $%d' % (key, self.shopTypes[key].__name__,
                                       self.shopCosts[key])
-            tSurf = textFont.render(text, 1, (0, 0, 0))
-            self.display.blit(tSurf, (left, top + (24 * option)))
+            tSurf = renderText(text, 'Arial', 24, True)
+            self.blitHUD(tSurf, (left, top + (24 * option)))
         text = '(x) exit'
-        tSurf = textFont.render(text, 1, (0, 0, 0))
-        self.display.blit(tSurf, (left, top + (24 * 6)))
+        tSurf = renderText(text, 'Arial', 24, True)
+        self.blitHUD(tSurf, (left, top + (24 * 6)))
 
     def drawGameOver(self):
         left, top = 1000, 144
         text1 = 'Game Over!'
-        text2 = '%s wins!!!' % self.winner.color
+        text2 = '%s wins!!!' % self.state.winner.color
         text3 = 'Press any key to exit'
-        textFont = pygame.font.SysFont('Arial', 24, True)
-        t1 = textFont.render(text1, 1, (0, 0, 0))
-        t2 = textFont.render(text2, 1, (0, 0, 0))
-        t3 = textFont.render(text3, 1, (0, 0, 0))
-        self.display.blit(t1, (left + 48, top))
-        self.display.blit(t2, (left + 48, top + 24))
-        self.display.blit(t3, (left + 48, top + 48))
-
-    def drawHUD(self):
-        self.drawBackground()
+        t1 = renderText(text1, 'Arial', 24, True)
+        t2 = renderText(text2, 'Arial', 24, True)
+        t3 = renderText(text3, 'Arial', 24, True)
+        self.blitHUD(t1, (left + 48, top))
+        self.blitHUD(t2, (left + 48, top + 24))
+        self.blitHUD(t3, (left + 48, top + 48))
+
+    def renderHUD(self):
+        self.eraseHUD()
         self.drawTerrainInfo()
         self.drawUnitInfo()
         self.drawPlayerInfo()
@@ -1082,7 +1073,7 @@ class Battle(PygameBaseClass):
             self.drawMovementInstr()
         else:
             self.drawHUDInstr()
-        pygame.display.flip()
+        self.hudIsDirty = False
 
 # testMapPath = os.path.join('maps', 'gauntlet.tpm')
 # a = Battle.fromFile(testMapPath)
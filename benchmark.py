@@ -0,0 +1,512 @@
+# benchmark.py
+# Benchmarks for PyWars hot paths
+# Dec 2014
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import timeit
+from map import Map
+from units import *
+import pathfinding
+import mapFile
+import saveGame
+import ai
+import combat
+from threatMap import ThreatMap
+from grid import TerrainGrid
+from gameState import GameState
+import pygame
+from textCache import TextCache
+
+unitTypes = [Infantry, RocketInf, APC, SmTank, LgTank, Artillery]
+syntheticSizes = [(50, 50), (200, 200)]
+legacyCallLimit = 2000000 # give up on the flood fill after this many calls
+failedChecks = [] # names of the correctness checks that didn't pass
+
+class CallLimitExceeded(Exception):
+    pass
+
+def legacyMovementRange(terrain, unit, start, isBlocked=None):
+    """The recursive flood fill formerly used by Battle.getMovementRange,
+    kept here as the baseline. Raises CallLimitExceeded if it takes more
+    than legacyCallLimit calls."""
+    rows, cols = len(terrain), len(terrain[0])
+    movementRange = set([start])
+    calls = [0]
+    def helper(coords, movementPoints):
+        calls[0] += 1
+        if calls[0] > legacyCallLimit:
+            raise CallLimitExceeded()
+        row, col = coords
+        if not (0 <= row < rows and 0 <= col < cols): return
+        movementCost = unit.movementCost[terrain[row][col]]
+        pointsAfterMove = movementPoints - movementCost
+        if (pointsAfterMove > 0 and movementCost != -1 and
+            not (isBlocked != None and isBlocked(coords))):
+            movementRange.add(coords)
+            for (dRow, dCol) in pathfinding.directions:
+                helper((row + dRow, col + dCol), pointsAfterMove)
+    row, col = start
+    for (dRow, dCol) in pathfinding.directions:
+        helper((row + dRow, col + dCol), unit.movementPoints)
+    return movementRange
+
+def loadTerrain(path):
+    """Get the terrain grid of a .tpm file without loading any sprites"""
+    with open(path, 'rt') as input:
+        mapString = input.read().split('\n*\n')[0]
+    terrain = []
+    for row in Map.loadContents(mapString):
+        terrain.append([tile if type(tile) == int else 7 for tile in row])
+    return terrain
+
+def syntheticTerrain(rows, cols, seed=0):
+    """Generate a random map, mostly plains and roads"""
+    generator = random.Random(seed)
+    weightedTypes = [1] * 10 + [2] * 4 + [3] * 3 + [4, 0, 5, 6]
+    terrain = []
+    for row in xrange(rows):
+        terrain.append([generator.choice(weightedTypes)
+                        for col in xrange(cols)])
+    return terrain
+
+def getStart(terrain):
+    """Get the passable tile closest to the middle of the map"""
+    rows, cols = len(terrain), len(terrain[0])
+    candidates = [(row, col) for row in xrange(rows) for col in xrange(cols)
+                  if terrain[row][col] not in (0, 5)]
+    middle = (rows / 2, cols / 2)
+    return min(candidates, key=lambda (row, col):
+               abs(row - middle[0]) + abs(col - middle[1]))
+
+def check(name, passed):
+    """Get the status to print for a correctness check, remembering it if
+    it failed so that the run exits with an error"""
+    if passed:
+        return 'ok'
+    failedChecks.append(name)
+    return 'MISMATCH'
+
+def timeCall(function, repeat=5):
+    """Get the best of repeat runs of function, in seconds"""
+    best = None
+    for i in xrange(repeat):
+        start = timeit.default_timer()
+        function()
+        elapsed = timeit.default_timer() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchmarkMovementRange(name, terrain):
+    start = getStart(terrain)
+    grid = TerrainGrid.fromLists(terrain)
+    for unit in unitTypes:
+        reach = pathfinding.getMovementRange(grid, unit, start)
+        newTime = timeCall(lambda:
+                           pathfinding.getMovementRange(grid, unit, start))
+        try:
+            legacyRange = []
+            legacyTime = timeCall(lambda: legacyRange.append(
+                legacyMovementRange(terrain, unit, start)), repeat=1)
+            if legacyRange[0] != set(reach):
+                legacy = check('movement range, %s %s' % (name, unit.type),
+                               False)
+            else:
+                legacy = '%10.2fms %8.1fx' % (legacyTime * 1000,
+                                               legacyTime / newTime)
+        except CallLimitExceeded:
+            legacy = '  gave up after %d calls' % legacyCallLimit
+        print '%-16s %-10s %5d tiles %8.2fms  %s' % (name, unit.type,
+                                                    len(reach),
+                                                    newTime * 1000, legacy)
+        sys.stdout.flush()
+
+def benchmarkText():
+    """Time drawing the in-game HUD instructions uncached and cached"""
+    pygame.font.init()
+    lines = ['Arrow keys to move', '(z) to select unit', '(space) to end turn',
+             'Funds: $5000', 'Buildings: 3', '+$3000 per Turn']
+    def uncached():
+        for line in lines:
+            font = pygame.font.SysFont('Arial', 24, True)
+            font.render(line, 1, (0, 0, 0))
+    cache = TextCache()
+    def cached():
+        for line in lines:
+            cache.render(line, 'Arial', 24, True)
+    uncachedTime = timeCall(uncached)
+    cachedTime = timeCall(cached)
+    print
+    print 'HUD text, %d lines: %.3fms uncached, %.3fms cached (%.1fx)' % (
+        len(lines), uncachedTime * 1000, cachedTime * 1000,
+        uncachedTime / cachedTime)
+
+def benchmarkMapEdits(rows=200, cols=200, edits=200):
+    """Time Map.changeTile against drawing the whole map image on a large
+    map"""
+    generator = random.Random(0)
+    editMap = Map((rows, cols))
+    def edit():
+        coords = (generator.randrange(rows), generator.randrange(cols))
+        editMap.changeTile(generator.choice([0, 2, 3, 4, 5]), coords)
+    editTime = timeCall(lambda: [edit() for i in xrange(edits)]) / edits
+    imageTime = timeCall(editMap.getImage, repeat=1)
+    print 'Map edit, %dx%d: %.3fms per changeTile, %.1fms per getImage' % (
+        rows, cols, editTime * 1000, imageTime * 1000)
+
+def getListSize(lists):
+    """Get the bytes used by a 2D list of small ints (which are shared)"""
+    return sys.getsizeof(lists) + sum([sys.getsizeof(row) for row in lists])
+
+def benchmarkMapMemory(rows=200, cols=200):
+    """Compare the map's grids with the nested lists they replaced"""
+    terrain = syntheticTerrain(rows, cols)
+    gridMap = Map('\n'.join([' '.join(map(str, row)) for row in terrain]))
+    grids = [gridMap.terrain, gridMap.owners, gridMap.objectiveTypes,
+             gridMap.defense]
+    gridSize = sum([sys.getsizeof(grid.cells) for grid in grids])
+    listSize = sum([getListSize(grid.toLists()) for grid in grids])
+    tile = gridMap.getTile((0, 0))
+    tileSize = sys.getsizeof(tile) + sys.getsizeof(tile.__dict__)
+    print 'Map storage, %dx%d: %dKB of grids, %dKB as nested lists' % (
+        rows, cols, gridSize / 1024, listSize / 1024),
+    print 'plus %dKB of Tile objects' % (rows * cols * tileSize / 1024)
+
+def scaleScenario(scenario, rows, cols):
+    """Tile a scenario's map and units until it is rows x cols"""
+    contents = scenario.getContents()
+    scaled = [[contents[row % scenario.rows][col % scenario.cols]
+               for col in xrange(cols)] for row in xrange(rows)]
+    units = []
+    for top in xrange(0, rows, scenario.rows):
+        for left in xrange(0, cols, scenario.cols):
+            for (team, typeNum, (row, col)) in scenario.units:
+                if top + row < rows and left + col < cols:
+                    units.append((team, typeNum, (top + row, left + col)))
+    return mapFile.Scenario.fromContents(scaled, scenario.numPlayers,
+                                         scenario.initialFunds, units)
+
+def benchmarkMapFiles(rows=1024, cols=1024):
+    """Time loading and saving the bundled maps, scaled up, as .tpm and
+    .pwm files, checking that both formats give back the same scenario"""
+    print
+    print '%-16s %9s %9s %9s %9s %9s  %s' % ('map %dx%d' % (rows, cols),
+                                             'tpm load', 'pwm load',
+                                             'no mmap', 'tpm save',
+                                             'pwm save', 'round trip')
+    directory = tempfile.mkdtemp()
+    try:
+        for filename in sorted(os.listdir('maps')):
+            if not filename.endswith(mapFile.textExtension):
+                continue
+            original = mapFile.read(os.path.join('maps', filename))
+            scenario = scaleScenario(original, rows, cols)
+            textPath = os.path.join(directory, 'map.tpm')
+            binaryPath = os.path.join(directory, 'map.pwm')
+            textSave = timeCall(lambda: mapFile.write(scenario, textPath),
+                                repeat=1)
+            binarySave = timeCall(lambda:
+                                  mapFile.write(scenario, binaryPath))
+            loaded = []
+            textLoad = timeCall(lambda:
+                                loaded.append(mapFile.read(textPath)),
+                                repeat=1)
+            binaryLoad = timeCall(lambda:
+                                  loaded.append(mapFile.read(binaryPath)))
+            plainLoad = timeCall(lambda: mapFile.read(binaryPath, False))
+            roundTrip = check('map files, %s' % filename[:-4],
+                              all([result == scenario for result in loaded]))
+            print '%-16s %7.0fms %7.1fms %7.1fms %7.0fms %7.1fms  %s' % (
+                filename[:-4], textLoad * 1000, binaryLoad * 1000,
+                plainLoad * 1000, textSave * 1000, binarySave * 1000,
+                roundTrip)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+
+def moveSomeUnits(state, count, rng):
+    """Move up to count of the active team's units one tile each, the
+    way a turn of play changes a few units at a time"""
+    units = sorted(state.activeUnits, key=state.getUnitCoords)
+    for unit in rng.sample(units, min(count, len(units))):
+        row, col = state.getUnitCoords(unit)
+        for (dRow, dCol) in Map.neighbourDirs:
+            new = (row + dRow, col + dCol)
+            if (state.isOnMap(new) and state.getUnit(new) == None and
+                state.terrain.getMovementCosts(unit)[
+                    state.terrain.getIndex(*new)] >= 0):
+                state.moveUnit((row, col), new)
+                state.wait(new)
+                break
+
+def benchmarkSaves(rows=256, cols=256, turns=20, movesPerTurn=20):
+    """Compare saving a battle in full every turn against the autosave's
+    per-turn deltas, checking that the save file loads back to the state
+    that was saved"""
+    print
+    print '%-16s %7s %9s %9s %9s %9s  %s' % ('save %dx%d' % (rows, cols),
+                                             'units', 'full', 'delta',
+                                             'full save', 'delta save',
+                                             'round trip')
+    directory = tempfile.mkdtemp()
+    try:
+        for filename in sorted(os.listdir('maps')):
+            if not filename.endswith(mapFile.textExtension):
+                continue
+            original = mapFile.read(os.path.join('maps', filename))
+            scenario = scaleScenario(original, rows, cols)
+            state = GameState(scenario.getContents(), scenario.numPlayers,
+                              scenario.initialFunds, scenario.units,
+                              firstPlayer=0)
+            fullPath = os.path.join(directory, 'full.pws')
+            autoSaver = saveGame.AutoSaver(os.path.join(directory,
+                                                        'auto.pws'))
+            autoSaver.save(state)
+            rng = random.Random(0)
+            fullTime = deltaTime = 0.0
+            fullBytes = deltaBytes = 0
+            for turn in xrange(turns):
+                moveSomeUnits(state, movesPerTurn, rng)
+                state.endTurn()
+                start = timeit.default_timer()
+                snapshot = saveGame.Snapshot.fromState(state)
+                fullBytes += saveGame.save(snapshot, fullPath)
+                fullTime += timeit.default_timer() - start
+                start = timeit.default_timer()
+                deltaBytes += autoSaver.save(state)
+                deltaTime += timeit.default_timer() - start
+            loaded = saveGame.load(autoSaver.path)
+            restored = saveGame.Snapshot.fromState(loaded.toGameState())
+            roundTrip = check('saves, %s' % filename[:-4],
+                              saveGame.load(fullPath) == snapshot and
+                              loaded == snapshot and restored == snapshot)
+            print '%-16s %7d %7dKB %7dKB %7.1fms %7.1fms  %s' % (
+                filename[:-4], len(state.unitCoords), fullBytes / 1024,
+                deltaBytes / 1024, fullTime * 1000 / turns,
+                deltaTime * 1000 / turns, roundTrip)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory)
+
+def getRandomAttacks(count, seed=0):
+    """Make count random (attacker, defender, terrain defense) triples"""
+    rng = random.Random(seed)
+    attacks = []
+    for i in xrange(count):
+        attacker = rng.choice(combat.unitTypes)(0)
+        attacker.health = rng.randint(1, 100)
+        defender = rng.choice(combat.unitTypes)(1)
+        defender.health = rng.randint(1, 100)
+        attacks.append((attacker, defender, rng.choice(combat.envFactors)))
+    return attacks
+
+def damageTablesMatch(attacks):
+    """Check the tables in combat.py against Unit.getBaseDamage, for both
+    attacks and retaliations"""
+    for (attacker, defender, envFactor) in attacks:
+        if (combat.getBaseDamage(attacker, defender, envFactor) !=
+            attacker.getBaseDamage(defender, envFactor, attacker.attack)):
+            return False
+        if (combat.getBaseDamage(attacker, defender, envFactor, True) !=
+            attacker.getBaseDamage(defender, envFactor,
+                                   attacker.getRetaliationAttack())):
+            return False
+    return True
+
+def benchmarkDamage(count=10000):
+    """Time working out the damage of many attacks from the formula in
+    Unit.getBaseDamage and from the tables in combat.py"""
+    attacks = getRandomAttacks(count)
+    def formula():
+        return [attacker.getBaseDamage(defender, envFactor, attacker.attack)
+                for (attacker, defender, envFactor) in attacks]
+    def lookup():
+        return [combat.getBaseDamage(attacker, defender, envFactor)
+                for (attacker, defender, envFactor) in attacks]
+    def batch():
+        return combat.getBaseDamages(attacks)
+    def killFormula():
+        return [combat.DamageDistribution(attacker.getBaseDamage(
+                    defender, envFactor, attacker.attack)).getKillProbability(
+                    defender.health)
+                for (attacker, defender, envFactor) in attacks]
+    def killBatch():
+        return combat.getKillProbabilities(attacks)
+    killErrors = [abs(a - b) for (a, b) in zip(killFormula(), killBatch())]
+    # the tables must follow changed stats once rebuilt, as in tournaments
+    attack = LgTank.attack
+    LgTank.attack = attack + 7
+    combat.buildTables()
+    try:
+        rebuiltMatch = damageTablesMatch(attacks)
+    finally:
+        LgTank.attack = attack
+        combat.buildTables()
+    status = check('damage tables', formula() == lookup() == batch() and
+                   max(killErrors) < 1e-9 and damageTablesMatch(attacks) and
+                   rebuiltMatch)
+    print
+    print '%-32s %9s  (%d attacks, results %s)' % ('damage', 'time', count,
+                                                  status)
+    print '%-32s %7.2fms' % ('tables built at import',
+                             timeCall(combat.buildTables) * 1000)
+    for (name, function) in [('base damage, formula', formula),
+                             ('base damage, table lookup', lookup),
+                             ('base damage, batched', batch),
+                             ('kill probability, formula', killFormula),
+                             ('kill probability, batched', killBatch)]:
+        print '%-32s %7.2fms' % (name, timeCall(function) * 1000)
+
+def getThreatsPerUnit(state, teamNum):
+    """Find a danger zone one enemy unit at a time, for comparison with
+    threatMap.ThreatMap"""
+    threatened = set()
+    for (unit, (cRow, cCol)) in state.unitCoords.iteritems():
+        if unit.teamNum == teamNum:
+            continue
+        if unit.isArtilleryUnit:
+            maxDistance = unit.artilleryMaxRange
+            for row in xrange(cRow - maxDistance, cRow + maxDistance + 1):
+                for col in xrange(cCol - maxDistance, cCol + maxDistance + 1):
+                    taxicabDistance = abs(row - cRow) + abs(col - cCol)
+                    if (unit.artilleryMinRange <= taxicabDistance <=
+                        maxDistance and state.isOnMap((row, col))):
+                        threatened.add((row, col))
+            continue
+        def isBlocked((row, col)):
+            other = state.unitSpace[row][col]
+            return other != None and other.teamNum != unit.teamNum
+        reach = pathfinding.getMovementRange(state.terrain, unit,
+                                             (cRow, cCol), isBlocked)
+        for (row, col) in reach:
+            if ((row, col) != (cRow, cCol) and
+                state.unitSpace[row][col] != None):
+                continue
+            for (dRow, dCol) in pathfinding.directions:
+                if state.isOnMap((row + dRow, col + dCol)):
+                    threatened.add((row + dRow, col + dCol))
+    return threatened
+
+def benchmarkThreats(rows=128, cols=128, moves=40):
+    """Time finding the danger zone of the first team one unit at a
+    time, grouped by team and class, and kept up to date as single units
+    move, on the bundled maps scaled up"""
+    print
+    print '%-16s %7s %9s %9s %9s  %s' % ('danger %dx%d' % (rows, cols),
+                                         'units', 'per unit', 'grouped',
+                                         'update', 'check')
+    for filename in sorted(os.listdir('maps')):
+        if not filename.endswith(mapFile.textExtension):
+            continue
+        original = mapFile.read(os.path.join('maps', filename))
+        scenario = scaleScenario(original, rows, cols)
+        state = GameState(scenario.getContents(), scenario.numPlayers,
+                          scenario.initialFunds, scenario.units,
+                          firstPlayer=1)
+        perUnitTime = timeCall(lambda: getThreatsPerUnit(state, 0), 3)
+        groupedTime = timeCall(lambda: ThreatMap(state, 0), 3)
+        threatMap = ThreatMap(state, 0)
+        rng = random.Random(0)
+        updateTime = 0.0
+        for move in xrange(moves):
+            state.changedTiles = set()
+            moveSomeUnits(state, 1, rng)
+            start = timeit.default_timer()
+            threatMap.update(state.changedTiles)
+            updateTime += timeit.default_timer() - start
+        status = check('danger zone, %s' % filename[:-4],
+                       set(threatMap) == getThreatsPerUnit(state, 0))
+        print '%-16s %7d %7.1fms %7.1fms %7.2fms  %s' % (
+            filename[:-4], len(state.unitCoords), perUnitTime * 1000,
+            groupedTime * 1000, updateTime * 1000 / moves, status)
+        sys.stdout.flush()
+
+def benchmarkAI(turns=12, timeBudget=0.5, scaledSize=128):
+    """Time computer players playing against each other on the bundled
+    maps, as they are and scaled up"""
+    print
+    print '%-20s %9s %9s %7s %8s' % ('ai, %.1fs budget' % timeBudget,
+                                     'mean turn', 'max turn', 'depth',
+                                     'nodes')
+    for filename in sorted(os.listdir('maps')):
+        if not filename.endswith(mapFile.textExtension):
+            continue
+        original = mapFile.read(os.path.join('maps', filename))
+        for scenario in [original,
+                         scaleScenario(original, scaledSize, scaledSize)]:
+            state = GameState(scenario.getContents(), scenario.numPlayers,
+                              scenario.initialFunds, scenario.units,
+                              firstPlayer=0, seed=0)
+            times = []
+            depths = []
+            nodes = 0
+            while len(times) < turns and not state.gameIsOver:
+                start = timeit.default_timer()
+                planner = ai.playTurn(state, timeBudget)
+                times.append(timeit.default_timer() - start)
+                depths.append(planner.depthReached)
+                nodes += planner.nodes
+                if not state.gameIsOver:
+                    state.endTurn()
+            name = '%s %dx%d' % (filename[:-4], scenario.rows, scenario.cols)
+            print '%-20s %7.0fms %7.0fms %3d-%-3d %8d' % (
+                name, sum(times) * 1000 / len(times), max(times) * 1000,
+                min(depths), max(depths), nodes / len(times))
+            sys.stdout.flush()
+
+def checkBlockedMoves():
+    """Play planned moves onto tiles that another unit of the team stands
+    on, checking that the unit that stays put is the one that waits, and
+    that the other neither acts nor captures"""
+    scenario = mapFile.read(os.path.join('maps', 'vortex.tpm'))
+    passed = True
+    for (start, dest, action) in [((2, 6), (2, 7), 'wait'),
+                                  ((2, 15), (3, 15), 'capture')]:
+        state = GameState(scenario.getContents(), scenario.numPlayers,
+                          scenario.initialFunds,
+                          [(0, 1, start), (0, 1, dest)], firstPlayer=0,
+                          seed=0)
+        mover, blocker = state.getUnit(start), state.getUnit(dest)
+        health = state.objectiveHealth.get(dest)
+        planner = ai.TurnPlanner(state)
+        planner.play([('move', start, dest), (action, dest)])
+        passed = (passed and planner.applied == [('wait', start)] and
+                  mover.hasMoved and blocker in state.activeUnits and
+                  state.objectiveHealth.get(dest) == health)
+    print
+    print 'ai moves onto taken tiles: %s' % check('blocked moves', passed)
+
+def main():
+    """Print the benchmarks. Returns 1 if any correctness check failed."""
+    print '%-16s %-10s %11s %10s  %s' % ('map', 'unit', 'reachable',
+                                         'new', 'legacy (speedup)')
+    for filename in sorted(os.listdir('maps')):
+        if filename.endswith('.tpm'):
+            terrain = loadTerrain(os.path.join('maps', filename))
+            benchmarkMovementRange(filename[:-4], terrain)
+    for (rows, cols) in syntheticSizes:
+        name = 'random %dx%d' % (rows, cols)
+        benchmarkMovementRange(name, syntheticTerrain(rows, cols))
+    benchmarkText()
+    benchmarkMapEdits()
+    benchmarkMapMemory()
+    benchmarkMapFiles()
+    benchmarkSaves()
+    benchmarkDamage()
+    benchmarkThreats()
+    benchmarkAI()
+    checkBlockedMoves()
+    if len(failedChecks) > 0:
+        print
+        print '%d checks failed: %s' % (len(failedChecks),
+                                        ', '.join(failedChecks))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.setrecursionlimit(10000)
+    sys.exit(main())
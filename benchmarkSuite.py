@@ -0,0 +1,341 @@
+# benchmarkSuite.py
+# Regression benchmarks for PyWars
+# Dec 2014
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import timeit
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+from pygame.locals import *
+from imageCache import imageCache
+import mapFile
+from map import Map
+from battle import Battle
+from mapEditor import Editor
+from gameState import GameState
+from compositor import FrameCompositor
+from benchmark import syntheticTerrain
+
+baselinePath = 'benchmarkBaseline.json'
+defaultTolerance = 0.25 # slower than the baseline by more than this fails
+noiseFloor = 0.05 # ms; differences smaller than this are never reported
+generatedSize = (128, 128)
+rangeMapSize = (128, 128)
+scriptedTurns = 4
+rounds = 3 # every case is timed once per round, so that a stretch of
+           # time when the machine is busy with something else only
+           # affects some of the rounds
+minimumTime = 0.1 # seconds to repeat each case for in each round
+maximumRepeat = 1000
+
+def getMapPaths():
+    return [os.path.join('maps', filename)
+            for filename in sorted(os.listdir('maps'))
+            if filename.endswith(mapFile.textExtension)]
+
+def getMapName(path):
+    return os.path.basename(path)[:-len(mapFile.textExtension)]
+
+def generatedScenario():
+    """A large random map with no objectives or units"""
+    rows, cols = generatedSize
+    return mapFile.Scenario.fromContents(syntheticTerrain(rows, cols), 2,
+                                         5000, [])
+
+def initDisplay():
+    """Open the (dummy) display the way PygameBaseClass.run does"""
+    pygame.init()
+    # the dummy driver's display is 8 bit unless asked otherwise, which no
+    # real window is, and blitting to 8 bit surfaces costs very differently
+    pygame.display.set_mode((1280, 768), 0, 32)
+    imageCache.convertAll()
+
+def startBattle(battle, directory):
+    """Set up a Battle the way runAsChild does, without its main loop"""
+    battle.autosavePath = os.path.join(directory, 'autosave.pws')
+    battle.display = pygame.display.get_surface()
+    battle.compositor = FrameCompositor(battle.display)
+    battle.initGraphics()
+    battle.initGame()
+    battle.presentFrame()
+    return battle
+
+def timeBest(function, repeat, setup=None):
+    """Get the best time of running function at least repeat times and
+    for at least minimumTime seconds, in ms. If setup is given, it is
+    called before each run, untimed, and its result passed to function."""
+    best = None
+    total = 0.0
+    runs = 0
+    while runs < maximumRepeat and (runs < repeat or total < minimumTime):
+        if setup == None:
+            start = timeit.default_timer()
+            function()
+        else:
+            argument = setup()
+            start = timeit.default_timer()
+            function(argument)
+        elapsed = timeit.default_timer() - start
+        total += elapsed
+        runs += 1
+        if best == None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+##################################################################
+# Cases
+##################################################################
+
+def getMapCases():
+    """Map construction and Map.getImage on every bundled map and on a
+    generated one"""
+    cases = []
+    sources = [(getMapName(path), mapFile.read(path))
+               for path in getMapPaths()]
+    rows, cols = generatedSize
+    sources.append(('random %dx%d' % (rows, cols), generatedScenario()))
+    for (name, scenario) in sources:
+        grids = scenario.getGrids()
+        loaded = Map(grids=grids)
+        repeat = 1 if scenario.rows * scenario.cols > 10000 else 3
+        cases.append(('map load ' + name, lambda grids=grids:
+                      Map(grids=grids), repeat))
+        cases.append(('map image ' + name, loaded.getImage, repeat))
+    return cases
+
+def getRangeBattle(directory):
+    """A battle on a generated map with one unit of each class on the first
+    team, standing on plains far enough apart not to block each other"""
+    rows, cols = rangeMapSize
+    contents = syntheticTerrain(rows, cols)
+    units = []
+    for (index, typeNum) in enumerate(sorted(GameState.shopTypes)):
+        coords = (rows / 2, (index + 1) * cols / 8)
+        contents[coords[0]][coords[1]] = 1
+        units.append((0, typeNum, coords))
+    scenario = mapFile.Scenario.fromContents(contents, 2, 5000, units)
+    battle = Battle(Map(grids=scenario.getGrids()), 2, 5000, units,
+                    firstPlayer=0, seed=0)
+    return startBattle(battle, directory)
+
+def getMovementRangeCases(directory):
+    """Battle.getMovementRange, and clearing it again, for every class"""
+    battle = getRangeBattle(directory)
+    cases = []
+    for (unit, coords) in sorted(battle.state.unitCoords.iteritems(),
+                                 key=lambda (unit, coords): coords):
+        def showRange(coords=coords):
+            battle.selection = coords
+            battle.getMovementRange()
+            battle.clearSelection()
+        cases.append(('movement range ' + unit.type, showRange, 5))
+    return cases
+
+def getChunkCases(directory):
+    """Drawing a chunk of the screen of a battle on a generated map, with
+    its units, from scratch"""
+    battle = getRangeBattle(directory)
+    def drawChunk():
+        battle.screen.clear()
+        battle.screen.getChunk((0, 0))
+    return [('chunk draw', drawChunk, 5)]
+
+def getEditorCases(directory):
+    """Editor.getSaveString on every bundled map and on a generated one"""
+    paths = getMapPaths()
+    rows, cols = generatedSize
+    generatedPath = os.path.join(directory, 'random %dx%d%s' % (
+        rows, cols, mapFile.textExtension))
+    mapFile.write(generatedScenario(), generatedPath)
+    cases = []
+    for path in paths + [generatedPath]:
+        editor = Editor(path)
+        cases.append(('editor save ' + getMapName(path),
+                      editor.getSaveString, 3))
+    return cases
+
+##################################################################
+# Scripted battle
+##################################################################
+
+def pressKey(battle, keyName):
+    """Handle a key press and present the frame, as the main loop would"""
+    if len(keyName) == 1:
+        key = getattr(pygame.locals, 'K_' + keyName)
+    else:
+        key = getattr(pygame.locals, 'K_' + keyName.upper())
+    battle.onKeyDown(pygame.event.Event(KEYDOWN, key=key))
+    viewport = battle.viewport
+    if viewport.isMoving():
+        # the camera arrives at once rather than gliding over real time,
+        # so the time taken doesn't depend on the scroll speed
+        viewport.jumpTo(viewport.targetX, viewport.targetY)
+    battle.animator.finish() # and so do units that move
+    battle.presentFrame()
+
+def moveCursorTo(battle, coords):
+    row, col = battle.cursorCoords
+    targetRow, targetCol = coords
+    keys = (['down'] * (targetRow - row) + ['up'] * (row - targetRow) +
+            ['right'] * (targetCol - col) + ['left'] * (col - targetCol))
+    for keyName in keys:
+        pressKey(battle, keyName)
+
+def getDestination(battle, start):
+    """Get the empty tile in the selected unit's range that is farthest
+    from where it stands"""
+    state = battle.state
+    free = [coords for coords in battle.movementRange
+            if state.getUnit(coords) == None] + [start]
+    return max(free, key=lambda (row, col): (abs(row - start[0]) +
+                                             abs(col - start[1]), row, col))
+
+def playUnit(battle, coords):
+    """Select the unit at coords, move it as far as it can go, then
+    attack the first target it has or wait"""
+    moveCursorTo(battle, coords)
+    pressKey(battle, 'z')
+    moveCursorTo(battle, getDestination(battle, coords))
+    pressKey(battle, 'z')
+    if battle.attackKey != None:
+        pressKey(battle, battle.attackKey)
+        pressKey(battle, 'z')
+    else:
+        pressKey(battle, '1')
+
+def buyUnits(battle):
+    """Buy an Infantry at each of the active team's empty factories"""
+    teamNum = battle.activePlayer.teamNumber
+    for coords in sorted(battle.activePlayer.heldObjectives):
+        if (battle.state.getObjective(coords) == (teamNum, 2) and
+            battle.state.getUnit(coords) == None):
+            moveCursorTo(battle, coords)
+            pressKey(battle, 'z')
+            pressKey(battle, '1')
+            if battle.shopIsOpen: # not enough funds
+                pressKey(battle, 'x')
+
+def playScript(battle, turns=scriptedTurns):
+    """Play turns of a battle through the key handler, with the danger
+    zone shown, moving every unit of each team in order and then buying
+    more"""
+    pressKey(battle, 'd')
+    for turn in xrange(turns):
+        for coords in sorted(battle.state.getUnitCoords(unit)
+                             for unit in battle.state.activeUnits):
+            if battle.gameIsOver:
+                return
+            if battle.state.getUnit(coords) != None:
+                playUnit(battle, coords)
+        buyUnits(battle)
+        pressKey(battle, 'space')
+
+def getScriptCases(directory):
+    """The scripted turns on every bundled map, each on a fresh battle"""
+    cases = []
+    for path in getMapPaths():
+        def setup(path=path):
+            return startBattle(Battle.fromFile(path, firstPlayer=0, seed=0),
+                               directory)
+        cases.append(('scripted turns ' + getMapName(path), playScript, 3,
+                      setup))
+    return cases
+
+##################################################################
+# Running and comparing
+##################################################################
+
+def runSuite(directory):
+    """Time every case in each of the rounds, returning a list of (name,
+    best ms)"""
+    cases = (getMapCases() + getMovementRangeCases(directory) +
+             getChunkCases(directory) + getEditorCases(directory) +
+             getScriptCases(directory))
+    best = dict()
+    for round in xrange(rounds):
+        for case in cases:
+            ms = timeBest(*case[1:])
+            best[case[0]] = min(best.get(case[0], ms), ms)
+    return [(case[0], best[case[0]]) for case in cases]
+
+def loadBaseline(path):
+    if not os.path.exists(path):
+        return dict()
+    with open(path, 'rt') as input:
+        return json.load(input)['cases']
+
+def saveBaseline(results, path):
+    with open(path, 'wt') as output:
+        json.dump({'cases': dict(results)}, output, indent=1,
+                  sort_keys=True)
+
+def compare(ms, baselineMs, tolerance):
+    """Get how a time compares with its baseline: 'new', 'ok', 'faster'
+    or 'SLOWER'"""
+    if baselineMs == None:
+        return 'new'
+    if abs(ms - baselineMs) < noiseFloor:
+        return 'ok'
+    if ms > baselineMs * (1 + tolerance):
+        return 'SLOWER'
+    if ms < baselineMs / (1 + tolerance):
+        return 'faster'
+    return 'ok'
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Time the hot paths and '
+                                     'compare them with a baseline')
+    parser.add_argument('--baseline', default=baselinePath,
+                        help='baseline file (default: %s)' % baselinePath)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the times as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=defaultTolerance,
+                        help='fraction slower than the baseline that '
+                        'counts as a regression (default: %.2f)' %
+                        defaultTolerance)
+    args = parser.parse_args(argv)
+
+    baseline = loadBaseline(args.baseline)
+    initDisplay()
+    directory = tempfile.mkdtemp()
+    try:
+        results = runSuite(directory)
+    finally:
+        shutil.rmtree(directory)
+        pygame.quit()
+    regressions = 0
+    print '%-28s %10s %10s %8s' % ('case', 'ms', 'baseline', 'change')
+    for (name, ms) in results:
+        baselineMs = baseline.get(name)
+        status = compare(ms, baselineMs, args.tolerance)
+        if status == 'SLOWER':
+            regressions += 1
+        if baselineMs == None:
+            print '%-28s %10.3f %10s %8s  %s' % (name, ms, '-', '-', status)
+        else:
+            print '%-28s %10.3f %10.3f %+7.0f%%  %s' % (
+                name, ms, baselineMs, (ms - baselineMs) * 100 / baselineMs,
+                status)
+    if args.save_baseline:
+        saveBaseline(results, args.baseline)
+        print 'saved %d cases to %s' % (len(results), args.baseline)
+    elif len(baseline) == 0:
+        print 'no baseline yet: run with --save-baseline to store one'
+    elif regressions > 0:
+        print '%d of %d cases slower than the baseline by more than %d%%' % (
+            regressions, len(results), args.tolerance * 100)
+        return 1
+    else:
+        print 'no regressions'
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
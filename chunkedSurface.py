@@ -0,0 +1,204 @@
+# chunkedSurface.py
+# Map-sized drawing surface for PyWars, kept in chunks
+# Dec 2014
+
+import pygame
+from pygame.locals import *
+
+class ChunkedSurface(object):
+    """
+    Stands in for a large surface, with the part of the Surface interface
+    the game draws with: blit, fill, get_clip, set_clip and the size
+    getters. drawArea(rect) is called to draw a part of it from scratch,
+    through those same methods, and copyTo shows a part of it.
+    """
+    defaultChunkSize = 1024 # pixels along each side; 16 tiles
+    defaultBudget = 64 << 20 # bytes of chunks kept
+
+    def __init__(self, size, drawArea, chunkSize=None, budget=None):
+        if chunkSize == None:
+            chunkSize = self.defaultChunkSize
+        if budget == None:
+            budget = self.defaultBudget
+        self.width, self.height = size
+        self.bounds = pygame.Rect(0, 0, self.width, self.height)
+        self.drawArea = drawArea
+        self.chunkSize = chunkSize
+        self.budget = budget
+        self.chunks = dict() # (chunkRow, chunkCol) -> (surface, rect)
+        self.lastShown = dict() # (chunkRow, chunkCol) -> showCount then
+        self.showCount = 0 # chunks shown so far
+        self.usedBytes = 0
+        self.clip = self.get_rect()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_size(self):
+        return (self.width, self.height)
+
+    def get_rect(self):
+        return self.bounds.copy()
+
+    def get_clip(self):
+        return self.clip.copy()
+
+    def set_clip(self, rect=None):
+        """Limit drawing to rect, or to the whole surface if it is None"""
+        if rect == None:
+            self.clip = self.get_rect()
+        else:
+            self.clip = pygame.Rect(rect).clip(self.bounds)
+
+    ##################################################################
+    # Chunks
+    ##################################################################
+
+    def getChunkRect(self, key):
+        chunkRow, chunkCol = key
+        size = self.chunkSize
+        rect = pygame.Rect(chunkCol * size, chunkRow * size, size, size)
+        return rect.clip(self.bounds)
+
+    def getChunkKeys(self, rect):
+        """Get the keys of the chunks that rect overlaps"""
+        rect = rect.clip(self.bounds)
+        if rect.width <= 0 or rect.height <= 0:
+            return []
+        size = self.chunkSize
+        firstRow, lastRow = rect.top / size, (rect.bottom - 1) / size
+        firstCol, lastCol = rect.left / size, (rect.right - 1) / size
+        if firstRow == lastRow and firstCol == lastCol:
+            return [(firstRow, firstCol)] # the usual case, e.g. a tile
+        return [(chunkRow, chunkCol)
+                for chunkRow in xrange(firstRow, lastRow + 1)
+                for chunkCol in xrange(firstCol, lastCol + 1)]
+
+    @staticmethod
+    def getBytes(chunk):
+        return chunk.get_width() * chunk.get_height() * chunk.get_bytesize()
+
+    def getChunk(self, key):
+        """Get the surface and rect of a chunk, drawing it if it isn't kept,
+        and mark it as the most recently shown"""
+        self.showCount += 1
+        self.lastShown[key] = self.showCount
+        chunk = self.chunks.get(key)
+        if chunk != None:
+            self.hits += 1
+            return chunk
+        self.misses += 1
+        rect = self.getChunkRect(key)
+        chunk = (pygame.Surface(rect.size), rect)
+        # kept before it is drawn, so that drawArea's blits land on it
+        self.chunks[key] = chunk
+        self.usedBytes += self.getBytes(chunk[0])
+        oldClip = self.clip
+        self.clip = rect
+        try:
+            self.drawArea(rect)
+        finally:
+            self.clip = oldClip
+        self.evict()
+        return chunk
+
+    def prefetch(self, rect):
+        """Draw the chunk under rect nearest its center that isn't kept, if
+        there is one, so that a camera moving towards it doesn't have to
+        wait for several at once. Returns True if one was drawn."""
+        centerX, centerY = rect.center
+        def getDistance(key):
+            chunkX, chunkY = self.getChunkRect(key).center
+            return (chunkX - centerX) ** 2 + (chunkY - centerY) ** 2
+        keys = self.getChunkKeys(rect)
+        if len(keys) * self.chunkSize ** 2 * 4 > self.budget:
+            return False # they would only push each other out
+        missing = [key for key in keys if key not in self.chunks]
+        if len(missing) == 0:
+            return False
+        self.getChunk(min(missing, key=getDistance))
+        return True
+
+    def evict(self):
+        """Drop the least recently shown chunks until the rest fit in the
+        budget, always keeping the latest"""
+        while self.usedBytes > self.budget and len(self.chunks) > 1:
+            key = min(self.lastShown, key=self.lastShown.get)
+            surface, rect = self.chunks.pop(key)
+            del self.lastShown[key]
+            self.usedBytes -= self.getBytes(surface)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every chunk, e.g. after the whole map has changed"""
+        self.chunks.clear()
+        self.lastShown.clear()
+        self.usedBytes = 0
+
+    ##################################################################
+    # Drawing
+    ##################################################################
+
+    def blit(self, source, dest, area=None):
+        """Draw source with its top left at dest, on the chunks that are
+        kept. Chunks that aren't kept are drawn from scratch later."""
+        left, top = dest[0], dest[1]
+        if area == None:
+            width, height = source.get_size()
+        else:
+            width, height = area[2], area[3]
+        rect = pygame.Rect(left, top, width, height)
+        target = rect.clip(self.clip)
+        # chunks clip to their own edges, so only a clip rect needs setting
+        isClipped = target != rect
+        for key in self.getChunkKeys(target):
+            chunk = self.chunks.get(key)
+            if chunk == None:
+                continue
+            surface, chunkRect = chunk
+            if isClipped:
+                surface.set_clip(target.move(-chunkRect.left,
+                                             -chunkRect.top))
+            surface.blit(source, (left - chunkRect.left, top - chunkRect.top),
+                         area)
+            if isClipped:
+                surface.set_clip(None)
+
+    def fill(self, color, rect=None):
+        if rect == None:
+            target = self.clip
+        else:
+            target = pygame.Rect(rect).clip(self.clip)
+        for key in self.getChunkKeys(target):
+            chunk = self.chunks.get(key)
+            if chunk != None:
+                surface, chunkRect = chunk
+                surface.fill(color, target.move(-chunkRect.left,
+                                                -chunkRect.top))
+
+    def copyTo(self, surface, dest, area):
+        """Copy area of this surface to dest on another surface, drawing
+        the chunks under it that aren't kept"""
+        area = pygame.Rect(area)
+        offsetX, offsetY = dest[0] - area.left, dest[1] - area.top
+        for key in self.getChunkKeys(area):
+            chunk, chunkRect = self.getChunk(key)
+            part = chunkRect.clip(area)
+            surface.blit(chunk, (part.left + offsetX, part.top + offsetY),
+                         area=part.move(-chunkRect.left, -chunkRect.top))
+
+    def getStats(self):
+        """Get the chunk counters as a dict"""
+        return {
+            'chunks': len(self.chunks),
+            'usedBytes': self.usedBytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
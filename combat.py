@@ -0,0 +1,257 @@
+# combat.py
+# Damage distributions for PyWars
+# Dec 2014
+
+from array import array
+from units import *
+from map import Tile, Objective
+from gameState import GameState
+
+unitTypes = sorted(GameState.shopTypes.values(), key=lambda unitType:
+                   unitType.type)
+envFactors = sorted(set([0] + Tile.defenseValues.values() +
+                        Objective.defenseValues.values()))
+maxHealth = 100
+
+class DamageDistribution(object):
+    """
+    The distribution of the damage of an attack with a given base damage:
+    uniform over the whole numbers from baseDamage - allowance to
+    baseDamage + allowance, where allowance is Unit.randomnessFactor of the
+    base damage, with anything below 0 counted as 0
+    """
+    def __init__(self, baseDamage):
+        self.baseDamage = baseDamage
+        self.allowance = Unit.getRandomAllowance(baseDamage)
+        self.low = baseDamage - self.allowance
+        self.high = baseDamage + self.allowance
+        self.outcomes = self.high - self.low + 1
+
+    @property
+    def minimum(self):
+        return max(0, self.low)
+
+    @property
+    def maximum(self):
+        return max(0, self.high)
+
+    @property
+    def expected(self):
+        """The range is symmetric about the base damage and never goes
+        below 0 unless the base damage does"""
+        return max(0, self.baseDamage)
+
+    def getProbability(self, damage):
+        """Get the probability of dealing exactly damage"""
+        if damage < 0:
+            return 0.0
+        if damage == 0:
+            return self.getProbabilityAtMost(0)
+        if self.low <= damage <= self.high:
+            return 1.0 / self.outcomes
+        return 0.0
+
+    def getProbabilityAtMost(self, damage):
+        if damage < self.minimum:
+            return 0.0
+        if damage >= self.maximum:
+            return 1.0
+        return float(damage - self.low + 1) / self.outcomes
+
+    def getKillProbability(self, health):
+        """Get the probability of dealing at least health damage"""
+        if health <= 0:
+            return 1.0
+        return 1.0 - self.getProbabilityAtMost(health - 1)
+
+    def roll(self, rng):
+        """Draw a damage from the distribution using rng, a random.Random
+        or the random module"""
+        return max(0, rng.randint(self.low, self.high))
+
+def getDamageDistribution(attacker, defender, envFactor=0,
+                          retaliation=False, health=None):
+    """Get the DamageDistribution of attacker attacking defender on terrain
+    with the given defense factor, or striking back at it if retaliation
+    is True. The attacker's current health is used unless health is
+    given."""
+    return DamageDistribution(getBaseDamage(attacker, defender, envFactor,
+                                            retaliation, health))
+
+##################################################################
+# Damage tables
+##################################################################
+
+def getAttackTable(retaliation=False):
+    """Map each (attacker type, defender type) to half of the attacker's
+    strength against the defender, the least base damage it can do before
+    defense"""
+    table = dict()
+    for attackerType in unitTypes:
+        attacker = attackerType(0)
+        if retaliation:
+            attack = attacker.getRetaliationAttack()
+        else:
+            attack = attackerType.attack
+        for defenderType in unitTypes:
+            defender = defenderType(1)
+            table[(attackerType, defenderType)] = (
+                (attack + attacker.getAttackModifier(defender)) * 0.5)
+    return table
+
+def getDefenseTable():
+    """Map each (defender type, terrain defense factor) to the damage the
+    defense absorbs"""
+    table = dict()
+    for defenderType in unitTypes:
+        for envFactor in envFactors:
+            table[(defenderType, envFactor)] = (0.1 * defenderType.defense *
+                                                envFactor)
+    return table
+
+def getDamageTable(retaliation=False):
+    """Map each (attacker type, defender type, terrain defense factor) to an
+    array of the base damage for every attacker health from 0 to
+    maxHealth, computed as Unit.getBaseDamage does"""
+    strengths = getAttackTable(retaliation)
+    defenses = getDefenseTable()
+    table = dict()
+    for ((attackerType, defenderType), minimumBaseDamage) in \
+            strengths.iteritems():
+        for envFactor in envFactors:
+            baseDefense = defenses[(defenderType, envFactor)]
+            table[(attackerType, defenderType, envFactor)] = array('i',
+                [int(minimumBaseDamage + minimumBaseDamage *
+                     (health / float(maxHealth)) - baseDefense)
+                 for health in xrange(maxHealth + 1)])
+    return table
+
+attackDamages = dict() # (attacker type, defender type, env) -> array
+retaliationDamages = dict()
+
+def buildTables():
+    """Tabulate the base damage of every attack. Done at import; call it
+    again after changing unit stats."""
+    attackDamages.clear()
+    attackDamages.update(getDamageTable())
+    retaliationDamages.clear()
+    retaliationDamages.update(getDamageTable(retaliation=True))
+
+buildTables()
+
+def getBaseDamage(attacker, defender, envFactor=0, retaliation=False,
+                  health=None):
+    """Get the base damage of an attack, as Unit.getBaseDamage computes it,
+    from the tables. The attacker's current health is used unless health
+    is given."""
+    if health == None:
+        health = attacker.health
+    if retaliation:
+        damages = retaliationDamages.get((type(attacker), type(defender),
+                                          envFactor))
+    else:
+        damages = attackDamages.get((type(attacker), type(defender),
+                                     envFactor))
+    if damages == None or not 0 <= health <= maxHealth:
+        # not in the tables, e.g. a unit type that is not in the shop
+        if retaliation:
+            attack = attacker.getRetaliationAttack()
+        else:
+            attack = attacker.attack
+        return attacker.getBaseDamage(defender, envFactor, attack, health)
+    return damages[health]
+
+def getExpectedDamage(attacker, defender, envFactor=0, retaliation=False,
+                      health=None):
+    return max(0, getBaseDamage(attacker, defender, envFactor, retaliation,
+                                health))
+
+##################################################################
+# Batched evaluation
+##################################################################
+
+def getBaseDamages(attacks, retaliation=False):
+    """Get the base damage of each (attacker, defender, terrain defense
+    factor) in attacks"""
+    if retaliation:
+        getRow = retaliationDamages.get
+    else:
+        getRow = attackDamages.get
+    damages = []
+    for (attacker, defender, envFactor) in attacks:
+        row = getRow((type(attacker), type(defender), envFactor))
+        health = attacker.health
+        if row != None and 0 <= health <= maxHealth:
+            damages.append(row[health])
+        else:
+            damages.append(getBaseDamage(attacker, defender, envFactor,
+                                         retaliation))
+    return damages
+
+def getExpectedDamages(attacks, retaliation=False):
+    """Get the expected damage of each (attacker, defender, terrain defense
+    factor) in attacks"""
+    return [max(0, baseDamage)
+            for baseDamage in getBaseDamages(attacks, retaliation)]
+
+def getKillProbabilities(attacks, retaliation=False):
+    """Get the probability of each (attacker, defender, terrain defense
+    factor) in attacks destroying the defender"""
+    probabilities = []
+    baseDamages = getBaseDamages(attacks, retaliation)
+    randomnessFactor = Unit.randomnessFactor
+    for ((attacker, defender, envFactor), baseDamage) in zip(attacks,
+                                                            baseDamages):
+        health = defender.health
+        if baseDamage <= 0:
+            probabilities.append(0.0 if health > 0 else 1.0)
+            continue
+        allowance = int(round(randomnessFactor * baseDamage))
+        low, high = baseDamage - allowance, baseDamage + allowance
+        if health <= low:
+            probabilities.append(1.0)
+        elif health > high:
+            probabilities.append(0.0)
+        else:
+            probabilities.append(float(high - health + 1) /
+                                 (high - low + 1))
+    return probabilities
+
+##################################################################
+# Forecasts
+##################################################################
+
+class Forecast(object):
+    """
+    What to expect when the unit at attackerCoords attacks the unit at
+    targetCoords: the distribution of the damage dealt, the chance of
+    destroying the target, and the expected and greatest damage it strikes
+    back with if it survives
+    """
+    def __init__(self, state, attackerCoords, targetCoords):
+        attacker = state.getUnit(attackerCoords)
+        defender = state.getUnit(targetCoords)
+        health = defender.health
+        self.dealt = getDamageDistribution(attacker, defender,
+                                           state.defense.get(*targetCoords))
+        self.killProbability = self.dealt.getKillProbability(health)
+        self.expectedDealt = 0.0
+        for damage in xrange(self.dealt.minimum, self.dealt.maximum + 1):
+            self.expectedDealt += (self.dealt.getProbability(damage) *
+                                   min(health, damage))
+        self.expectedTaken = 0.0
+        self.maxTaken = 0
+        if (attacker.isArtilleryUnit or defender.isArtilleryUnit or
+            self.killProbability == 1):
+            return
+        envFactor = state.defense.get(*attackerCoords)
+        for damage in xrange(self.dealt.minimum,
+                             min(self.dealt.maximum, health - 1) + 1):
+            taken = getExpectedDamage(defender, attacker, envFactor, True,
+                                      health - damage)
+            self.expectedTaken += (self.dealt.getProbability(damage) *
+                                   min(attacker.health, taken))
+        # the strongest strike back comes from the least damaged survivor
+        strongest = getDamageDistribution(defender, attacker, envFactor, True,
+                                          health - self.dealt.minimum)
+        self.maxTaken = min(attacker.health, strongest.maximum)
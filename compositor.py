@@ -0,0 +1,68 @@
+# compositor.py
+# Dirty rectangle tracking for PyWars
+# Dec 2014
+
+import pygame
+from pygame.locals import *
+
+class FrameCompositor(object):
+    """
+    Collects the dirty rects of a frame and presents them in one update
+    """
+    def __init__(self, display):
+        self.display = display
+        self.bounds = display.get_rect()
+        self.dirtyRects = []
+        # profiling counters
+        self.pixelsLastFrame = 0
+        self.rectsLastFrame = 0
+        self.pixelsPushed = 0
+        self.framesPresented = 0
+
+    def markDirty(self, rect):
+        """Mark part of the display as changed this frame"""
+        rect = pygame.Rect(rect).clip(self.bounds)
+        if rect.width > 0 and rect.height > 0:
+            self.dirtyRects.append(rect)
+
+    def markAllDirty(self):
+        self.dirtyRects = [self.bounds.copy()]
+
+    @staticmethod
+    def mergeRects(rects):
+        """Merge overlapping rects so no pixel is pushed twice"""
+        merged = []
+        for rect in rects:
+            rect = rect.copy()
+            overlapping = rect.collidelist(merged)
+            while overlapping != -1:
+                rect.union_ip(merged.pop(overlapping))
+                overlapping = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def present(self):
+        """Push this frame's dirty rects to the screen"""
+        rects = self.mergeRects(self.dirtyRects)
+        self.dirtyRects = []
+        self.rectsLastFrame = len(rects)
+        self.pixelsLastFrame = sum([rect.width * rect.height
+                                    for rect in rects])
+        if len(rects) == 0:
+            return
+        pygame.display.update(rects)
+        self.pixelsPushed += self.pixelsLastFrame
+        self.framesPresented += 1
+
+    def getStats(self):
+        """Get the profiling counters as a dict"""
+        if self.framesPresented == 0:
+            averagePixels = 0
+        else:
+            averagePixels = self.pixelsPushed / self.framesPresented
+        return {
+            'pixelsLastFrame': self.pixelsLastFrame,
+            'rectsLastFrame': self.rectsLastFrame,
+            'framesPresented': self.framesPresented,
+            'averagePixelsPerFrame': averagePixels
+        }
@@ -0,0 +1,85 @@
+# frameClock.py
+# Frame pacing and timing for PyWars
+# Dec 2014
+
+import time
+import pygame
+
+class FrameClock(object):
+    """
+    Paces a main loop and measures it. Each frame the loop calls getEvents,
+    then getUpdateSteps if it updates in fixed steps, and endFrame once the
+    frame has been presented.
+    """
+    maxUpdateSteps = 5 # per frame, so that one slow frame can't snowball
+
+    def __init__(self, frameRate=60, updateRate=None):
+        self.frameRate = frameRate
+        self.updateRate = updateRate
+        if updateRate != None:
+            self.stepTime = 1.0 / updateRate
+        self.clock = pygame.time.Clock()
+        self.lastUpdate = None # when the last update steps were handed out
+        self.accumulated = 0.0 # seconds of game time not yet stepped
+        self.frameStart = time.time()
+        # profiling counters
+        self.frames = 0
+        self.busyTime = 0.0 # seconds spent handling events and drawing
+        self.idleTime = 0.0 # seconds spent sleeping or waiting for events
+        self.lastFrameTime = 0.0
+        self.maxFrameTime = 0.0
+
+    def getEvents(self, wait):
+        """Get the events that arrived since the last frame. If wait is
+        True, sleep until there is at least one, however long that takes;
+        otherwise sleep only as much as keeps the loop to frameRate."""
+        start = time.time()
+        if wait:
+            events = [pygame.event.wait()] + pygame.event.get()
+            self.lastUpdate = None # the game stood still while we slept
+        else:
+            self.clock.tick(self.frameRate)
+            events = pygame.event.get()
+        self.frameStart = time.time()
+        self.idleTime += self.frameStart - start
+        return events
+
+    def getUpdateSteps(self):
+        """Get how many steps of stepTime seconds the game should be updated
+        by this frame to keep up with the time that has passed"""
+        now = time.time()
+        if self.lastUpdate == None:
+            self.accumulated = self.stepTime # start moving again at once
+        else:
+            self.accumulated += now - self.lastUpdate
+        self.lastUpdate = now
+        steps = int(self.accumulated / self.stepTime)
+        if steps > FrameClock.maxUpdateSteps:
+            # too far behind to catch up: let the game slow down instead
+            steps = FrameClock.maxUpdateSteps
+            self.accumulated = 0.0
+        else:
+            self.accumulated -= steps * self.stepTime
+        return steps
+
+    def endFrame(self):
+        frameTime = time.time() - self.frameStart
+        self.frames += 1
+        self.busyTime += frameTime
+        self.lastFrameTime = frameTime
+        self.maxFrameTime = max(self.maxFrameTime, frameTime)
+
+    def getStats(self):
+        """Get the profiling counters as a dict"""
+        totalTime = self.busyTime + self.idleTime
+        stats = {'frames': self.frames, 'framesPerSecond': 0,
+                 'averageFrameMs': 0, 'lastFrameMs': 0, 'maxFrameMs': 0,
+                 'idlePercent': 0}
+        if totalTime > 0:
+            stats['framesPerSecond'] = self.frames / totalTime
+            stats['idlePercent'] = self.idleTime * 100 / totalTime
+        if self.frames > 0:
+            stats['averageFrameMs'] = self.busyTime * 1000 / self.frames
+            stats['lastFrameMs'] = self.lastFrameTime * 1000
+            stats['maxFrameMs'] = self.maxFrameTime * 1000
+        return stats
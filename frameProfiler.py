@@ -0,0 +1,253 @@
+# frameProfiler.py
+# Opt-in frame profiling for PyWars
+# Dec 2014
+
+import sys
+import json
+import time
+import inspect
+import pygame
+from textCache import renderText
+
+handlerNames = ['onKeyDown', 'onKeyUp', 'onMouseMotion', 'onMouseButtonDown',
+                'onMouseButtonUp', 'update']
+drawingPrefixes = ['draw', 'redraw', 'render', 'blit', 'erase', 'present']
+tracePath = 'pywarsTrace.json'
+
+active = None # the installed Profiler, if profiling is on
+
+class Histogram(object):
+    """
+    Counts durations in buckets that double in width, from under 1/8 ms
+    up, so any number of them takes the same small space
+    """
+    bounds = [0.125 * 2 ** i for i in xrange(14)] # upper bounds in ms
+
+    def __init__(self):
+        self.buckets = [0] * (len(Histogram.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, ms):
+        index = 0
+        while index < len(Histogram.bounds) and ms > Histogram.bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += ms
+        self.maximum = max(self.maximum, ms)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def getPercentile(self, percent):
+        """Get the upper bound of the bucket that holds the given
+        percentile, or the maximum if it is in the last bucket"""
+        target = self.count * percent / 100.0
+        seen = 0
+        for (index, count) in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count > 0:
+                if index < len(Histogram.bounds):
+                    return min(Histogram.bounds[index], self.maximum)
+                break
+        return self.maximum
+
+class Profiler(object):
+    """
+    Times the event handlers and drawing methods of the game mode classes
+    given to install, and counts blits and display updates per frame
+    """
+    maxTraceEvents = 200000 # stop tracing after this many, to bound memory
+    overlayLines = 6 # the slowest methods shown in the overlay
+
+    def __init__(self, countBlits=False):
+        self.countBlits = countBlits
+        self.histograms = dict() # 'Class.method' -> Histogram
+        self.originals = [] # (owner, name, what it had, if its own)
+        self.traceEvents = []
+        self.droppedEvents = 0
+        self.startTime = time.time()
+        self.frames = 0
+        self.blits = 0 # in the frame being drawn
+        self.updates = 0
+        self.lastFrameBlits = 0
+        self.lastFrameUpdates = 0
+        self.totalBlits = 0
+        self.totalUpdates = 0
+
+    ##################################################################
+    # Installing
+    ##################################################################
+
+    def getProfiledNames(self, cls):
+        names = []
+        for name in dir(cls):
+            if not (name in handlerNames or
+                    any([name.startswith(prefix)
+                         for prefix in drawingPrefixes])):
+                continue
+            if name == 'presentFrame':
+                continue # the overlay is drawn in there
+            if inspect.ismethod(getattr(cls, name)):
+                names.append(name)
+        return names
+
+    def wrap(self, cls, name):
+        method = getattr(cls, name)
+        label = '%s.%s' % (cls.__name__, name)
+        histogram = self.histograms.setdefault(label, Histogram())
+        profiler = self
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profiler.record(label, histogram, start, time.time())
+        timed.__name__ = name
+        timed.__doc__ = method.__doc__
+        self.originals.append((cls, name, cls.__dict__.get(name)))
+        setattr(cls, name, timed)
+
+    def wrapDisplayUpdate(self, name):
+        """Count the calls to pygame.display.update or flip"""
+        function = getattr(pygame.display, name)
+        profiler = self
+        def counted(*args):
+            profiler.updates += 1
+            return function(*args)
+        self.originals.append((pygame.display, name, function))
+        setattr(pygame.display, name, counted)
+
+    def install(self, classes):
+        """Start profiling the game mode classes"""
+        global active
+        for cls in classes:
+            for name in self.getProfiledNames(cls):
+                self.wrap(cls, name)
+        self.wrapDisplayUpdate('update')
+        self.wrapDisplayUpdate('flip')
+        active = self
+        self.startCounting()
+
+    def uninstall(self):
+        global active
+        self.stopCounting()
+        for (owner, name, original) in reversed(self.originals):
+            if original == None:
+                delattr(owner, name) # it was inherited
+            else:
+                setattr(owner, name, original)
+        self.originals = []
+        active = None
+
+    ##################################################################
+    # Recording
+    ##################################################################
+
+    def startCounting(self):
+        if self.countBlits:
+            sys.setprofile(self.onProfileEvent)
+
+    def stopCounting(self):
+        if self.countBlits:
+            sys.setprofile(None)
+
+    def onProfileEvent(self, frame, event, arg):
+        if event == 'c_call' and arg.__name__ == 'blit':
+            self.blits += 1
+
+    def addTraceEvent(self, name, start, end):
+        if len(self.traceEvents) >= Profiler.maxTraceEvents:
+            self.droppedEvents += 1
+            return
+        self.traceEvents.append({
+            'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+            'ts': int((start - self.startTime) * 1000000),
+            'dur': int((end - start) * 1000000)})
+
+    def record(self, label, histogram, start, end):
+        histogram.add((end - start) * 1000)
+        self.addTraceEvent(label, start, end)
+
+    def endFrame(self, frameStart):
+        """Close the counts of the frame the main loop just presented"""
+        self.frames += 1
+        self.lastFrameBlits = self.blits
+        self.lastFrameUpdates = self.updates
+        self.totalBlits += self.blits
+        self.totalUpdates += self.updates
+        self.blits = self.updates = 0
+        self.addTraceEvent('frame %d' % self.frames, frameStart, time.time())
+
+    ##################################################################
+    # Reporting
+    ##################################################################
+
+    def getSlowest(self, count):
+        """Get the labels and histograms of the methods with the most time
+        spent in them, inclusive of the methods they call"""
+        used = [(histogram.total, label, histogram)
+                for (label, histogram) in self.histograms.iteritems()
+                if histogram.count > 0]
+        used.sort(reverse=True)
+        return [(label, histogram) for (total, label, histogram)
+                in used[:count]]
+
+    def getReport(self):
+        """Get a text table of every method called, slowest first"""
+        lines = ['%-36s %7s %9s %8s %8s %8s' % ('method', 'calls',
+                                                'total ms', 'mean', 'p95',
+                                                'max')]
+        for (label, histogram) in self.getSlowest(len(self.histograms)):
+            lines.append('%-36s %7d %9.1f %8.3f %8.3f %8.3f' % (
+                label, histogram.count, histogram.total, histogram.mean,
+                histogram.getPercentile(95), histogram.maximum))
+        if self.countBlits:
+            lines.append('%d frames, %d blits, %d display updates' % (
+                self.frames, self.totalBlits, self.totalUpdates))
+        else:
+            lines.append('%d frames, %d display updates' % (
+                self.frames, self.totalUpdates))
+        return '\n'.join(lines)
+
+    def drawOverlay(self, game):
+        """Draw the frame counts and the slowest methods over the bottom
+        left of the display"""
+        self.stopCounting() # don't count the overlay's own blits
+        if self.countBlits:
+            lines = ['frame %d: %d blits, %d updates' % (
+                self.frames, self.lastFrameBlits, self.lastFrameUpdates)]
+        else:
+            lines = ['frame %d: %d updates' % (self.frames,
+                                               self.lastFrameUpdates)]
+        frameClock = getattr(game, 'frameClock', None)
+        if frameClock != None:
+            stats = frameClock.getStats()
+            lines.append('%.2fms per frame, %.0f%% idle' % (
+                stats['averageFrameMs'], stats['idlePercent']))
+        for (label, histogram) in self.getSlowest(Profiler.overlayLines):
+            lines.append('%s: %d x %.2fms, p95 %.2fms' % (
+                label, histogram.count, histogram.mean,
+                histogram.getPercentile(95)))
+        lineHeight = 16
+        width = 420
+        height = lineHeight * (Profiler.overlayLines + 2) + 8
+        left, top = 8, game.display.get_height() - height - 8
+        panel = pygame.Rect(left, top, width, height)
+        game.display.fill((0, 0, 0), panel)
+        for (index, line) in enumerate(lines):
+            text = renderText(line, 'Courier New', 14, color=(255, 255, 0))
+            game.display.blit(text, (left + 4, top + 4 + lineHeight * index))
+        game.compositor.markDirty(panel)
+        self.startCounting()
+
+    def dumpTrace(self, path=tracePath):
+        """Write the recorded timings in the trace event format"""
+        with open(path, 'w') as output:
+            json.dump({'traceEvents': self.traceEvents,
+                       'displayTimeUnit': 'ms',
+                       'otherData': {'droppedEvents': self.droppedEvents}},
+                      output)
@@ -0,0 +1,443 @@
+# gameState.py
+# Headless game rules for PyWars
+# Dec 2014
+
+import copy
+import random
+from map import Tile, Objective, Map
+from units import *
+import pathfinding
+import mapFile
+from grid import Grid, TerrainGrid
+
+class Team(object):
+    colors = ["Red", "Blue", "Green", "Yellow"]
+    def __init__(self, teamNumber, funds):
+        self.teamNumber = teamNumber
+        self.funds = funds
+        self.color = Team.colors[teamNumber]
+        self.heldObjectives = [] # coords of the objectives the team holds
+        self.units = set()
+
+class GameState(object):
+    """
+    The rules of a battle, independent of how it is drawn
+    """
+    shopTypes = {
+        1: Infantry,
+        2: RocketInf,
+        3: APC,
+        4: SmTank,
+        5: LgTank,
+        6: Artillery
+    }
+    shopCosts = {
+        1: 1000,
+        2: 3000,
+        3: 4000,
+        4: 7000,
+        5: 16000,
+        6: 6000
+    }
+    fundsPerObjective = 1000 # income per held objective per turn
+    objectiveHealing = 50 # health restored to units on their own objectives
+    emptyTeam = 4 # team number of unowned objectives
+    objectiveTerrainType = 7 # terrain type used for movement onto objectives
+
+    @staticmethod
+    def fromFile(path, seed=None):
+        """Load a GameState from a .tpm or .pwm scenario file"""
+        scenario = mapFile.read(path)
+        return GameState(scenario.getContents(), scenario.numPlayers,
+                         scenario.initialFunds, scenario.units, seed=seed)
+
+    ##################################################################
+    # Game setup
+    ##################################################################
+
+    def __init__(self, contents, numPlayers, initialFunds=5000,
+                 initialUnits=[], teams=None, firstPlayer=None, seed=None,
+                 startTurn=True, terrain=None, defense=None):
+        """Set up a battle on the map described by contents (as produced by
+        Map.loadContents). If teams is not given, plain Teams are created.
+        If firstPlayer is not given, it is chosen at random. The battle's
+        random numbers come from its own stream, self.rng, seeded with seed
+        if it is given, so battles with the same seed and moves play out the
+        same. If startTurn is False, the first player's turn isn't begun --
+        no funds are paid and no units healed -- e.g. to restore a save.
+        terrain and defense are the TerrainGrid and defense Grid of the
+        map, e.g. a Map's, to share instead of building them from
+        contents."""
+        self.rng = random.Random(seed)
+        self.contents = [list(row) for row in contents]
+        self.rows = len(self.contents)
+        self.cols = len(self.contents[0])
+        if terrain == None:
+            terrain = self.getTerrain()
+        if defense == None:
+            defense = self.getDefense()
+        self.terrain = terrain
+        self.defense = defense
+        self.objectiveHealth = self.getObjectiveHealth()
+        self.hqCoords = self.getHQCoords()
+        self.unitSpace = self.getUnitSpace()
+        self.unitCoords = dict() # unit -> coords, the inverse of unitSpace
+        self.changedTiles = set() # tiles changed since the renderer looked
+        self.numPlayers = numPlayers
+        self.initialFunds = initialFunds
+        if teams == None:
+            teams = self.createTeams()
+        self.teams = teams
+        self.placeInitialUnits(initialUnits)
+        self.eliminatedPlayers = set()
+        self.gameIsOver = False
+        self.winner = None
+        self.getHeldObjectives()
+        if firstPlayer == None:
+            firstPlayer = self.rng.randrange(self.numPlayers)
+        self.playerIndex = firstPlayer
+        self.turn = 0
+        self.activeUnits = set()
+        if startTurn:
+            self.beginTurn()
+
+    def getTerrain(self):
+        terrain = []
+        for row in self.contents:
+            terrain.append([tile if type(tile) == int
+                            else GameState.objectiveTerrainType
+                            for tile in row])
+        return TerrainGrid.fromLists(terrain)
+
+    def getDefense(self):
+        defense = []
+        for row in self.contents:
+            defense.append([Tile.defenseValues[tile] if type(tile) == int
+                            else Objective.defenseValues[tile[1]]
+                            for tile in row])
+        return Grid.fromLists(defense)
+
+    def getObjectiveHealth(self):
+        health = dict()
+        for row in xrange(self.rows):
+            for col in xrange(self.cols):
+                if self.isObjective((row, col)):
+                    health[(row, col)] = Objective.baseHealth
+        return health
+
+    def getHQCoords(self):
+        """Map each team number to the coords of its HQ"""
+        hqCoords = dict()
+        for coords in self.objectiveHealth:
+            teamNum, typeNum = self.getObjective(coords)
+            if typeNum == 0:
+                hqCoords[teamNum] = coords
+        return hqCoords
+
+    def getUnitSpace(self):
+        """Create an empty 2D list the size of the map"""
+        contents = []
+        for row in xrange(self.rows):
+            contents += [[None] * self.cols]
+        return contents
+
+    def createTeams(self):
+        teams = []
+        for teamNumber in xrange(self.numPlayers):
+            teams.append(Team(teamNumber, self.initialFunds))
+        return teams
+
+    def placeInitialUnits(self, initialUnits):
+        """Add the initial units to the unit space"""
+        for item in initialUnits:
+            teamNum, typeNum, coords = item
+            self.placeUnit(teamNum, GameState.shopTypes[typeNum], coords)
+
+    def getHeldObjectives(self):
+        """Add each objective to the heldObjectives list of the team that
+        holds it"""
+        for coords in sorted(self.objectiveHealth):
+            teamNum, typeNum = self.getObjective(coords)
+            if teamNum < self.numPlayers:
+                self.teams[teamNum].heldObjectives.append(coords)
+
+    ##################################################################
+    # Queries
+    ##################################################################
+
+    @property
+    def activeTeam(self):
+        return self.teams[self.playerIndex]
+
+    def isObjective(self, coords):
+        row, col = coords
+        return type(self.contents[row][col]) == tuple
+
+    def getObjective(self, coords):
+        """Get the (team, type) of the objective at coords, or None"""
+        row, col = coords
+        tile = self.contents[row][col]
+        if type(tile) == tuple:
+            return tile
+        return None
+
+    def getUnit(self, coords):
+        row, col = coords
+        return self.unitSpace[row][col]
+
+    def getUnitCoords(self, unit):
+        """Get the coords of a unit on the map, or None"""
+        return self.unitCoords.get(unit)
+
+    def getHQ(self, teamNum):
+        """Get the coords of a team's HQ, or None if it has none"""
+        return self.hqCoords.get(teamNum)
+
+    def isOnMap(self, coords):
+        row, col = coords
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def isBlocked(self, coords):
+        """Return true if coords is occupied by a unit not on the active
+        team"""
+        row, col = coords
+        unit = self.unitSpace[row][col]
+        return (unit != None) and (unit.teamNum != self.playerIndex)
+
+    def getMovementRange(self, coords):
+        """Get the pathfinding.MovementRange of the unit at coords"""
+        return pathfinding.getMovementRange(self.terrain, self.getUnit(coords),
+                                            coords, self.isBlocked)
+
+    def getTargets(self, coords):
+        """Get the coords of every enemy the unit at coords can attack from
+        where it stands"""
+        unit = self.getUnit(coords)
+        cRow, cCol = coords
+        targets = []
+        if unit.isArtilleryUnit:
+            minDistance = unit.artilleryMinRange
+            maxDistance = unit.artilleryMaxRange
+            for row in xrange(cRow - maxDistance, cRow + maxDistance + 1):
+                for col in xrange(cCol - maxDistance, cCol + maxDistance + 1):
+                    taxicabDistance = abs(row - cRow) + abs(col - cCol)
+                    if (self.isOnMap((row, col)) and
+                        self.isBlocked((row, col)) and
+                        (minDistance <= taxicabDistance <= maxDistance)):
+                        targets.append((row, col))
+        else:
+            for (dRow, dCol) in [(-1, 0), (0, 1), (1, 0), (0, -1)]:
+                row, col = cRow + dRow, cCol + dCol
+                if self.isOnMap((row, col)) and self.isBlocked((row, col)):
+                    targets.append((row, col))
+        return targets
+
+    def canAttack(self, coords, distanceMoved):
+        """Artillery can only fire if it has not moved this turn"""
+        unit = self.getUnit(coords)
+        if unit.isArtilleryUnit and distanceMoved != 0:
+            return False
+        return len(self.getTargets(coords)) > 0
+
+    def canCapture(self, coords):
+        unit = self.getUnit(coords)
+        objective = self.getObjective(coords)
+        return (unit.canCapture and objective != None and
+                unit.teamNum != objective[0])
+
+    ##################################################################
+    # Commands
+    ##################################################################
+
+    def placeUnit(self, teamNum, unitType, coords):
+        """Create a unit of the given type for the team at coords"""
+        row, col = coords
+        unit = unitType(teamNum)
+        self.unitSpace[row][col] = unit
+        self.unitCoords[unit] = coords
+        self.teams[teamNum].units.add(unit)
+        self.changedTiles.add(coords)
+        return unit
+
+    def moveUnit(self, old, new):
+        """Move the unit from one tile to another, if the destination is
+        free. Legality of the move is up to the caller (see
+        getMovementRange)."""
+        oldRow, oldCol = old
+        newRow, newCol = new
+        if self.unitSpace[newRow][newCol] == None:
+            unit = self.unitSpace[oldRow][oldCol]
+            self.unitSpace[newRow][newCol] = unit
+            self.unitSpace[oldRow][oldCol] = None
+            self.unitCoords[unit] = new
+            self.changedTiles.add(old)
+            self.changedTiles.add(new)
+
+    def wait(self, coords):
+        """End the turn of the unit at coords"""
+        unit = self.getUnit(coords)
+        unit.hasMoved = True
+        self.activeUnits.discard(unit)
+        self.changedTiles.add(coords)
+
+    def attack(self, attackerCoords, targetCoords):
+        """Resolve an attack, including retaliation, and end the attacker's
+        turn. Returns the damage dealt and the damage taken."""
+        atkRow, atkCol = attackerCoords
+        defRow, defCol = targetCoords
+        attacker = self.unitSpace[atkRow][atkCol]
+        defender = self.unitSpace[defRow][defCol]
+        atkEnv = self.defense.get(atkRow, atkCol)
+        defEnv = self.defense.get(defRow, defCol)
+        damageDealt = attacker.getAttackDamage(defender, defEnv, self.rng)
+        damageTaken = 0
+        defender.health -= damageDealt
+        if defender.health <= 0:
+            self.removeUnit(targetCoords)
+        elif not attacker.isArtilleryUnit and not defender.isArtilleryUnit:
+            damageTaken = defender.getRetaliatoryDamage(attacker, atkEnv,
+                                                        self.rng)
+            attacker.health -= damageTaken
+            if attacker.health <= 0:
+                self.removeUnit(attackerCoords)
+        if self.unitSpace[atkRow][atkCol] != None:
+            self.wait(attackerCoords)
+        self.changedTiles.add(targetCoords)
+        return damageDealt, damageTaken
+
+    def capture(self, coords):
+        """Reduce the capture health of the objective under the unit at
+        coords, taking it over once it reaches 0, and end the unit's turn.
+        Returns True if the objective changed hands."""
+        row, col = coords
+        unit = self.unitSpace[row][col]
+        oldTeam, typeNum = self.getObjective(coords)
+        self.objectiveHealth[coords] -= (unit.health / 10)
+        captured = self.objectiveHealth[coords] <= 0
+        if captured:
+            if oldTeam != GameState.emptyTeam:
+                self.teams[oldTeam].heldObjectives.remove(coords)
+            if typeNum == 0:
+                self.removeTeam(oldTeam)
+                typeNum = 1 # don't allow a team to gain more than one HQ
+            self.setObjective(coords, (unit.teamNum, typeNum))
+            self.teams[unit.teamNum].heldObjectives.append(coords)
+        self.wait(coords)
+        return captured
+
+    def buyUnit(self, coords, typeNum):
+        """Buy a unit of the given shop type at the factory at coords.
+        Returns the new unit, or None if the active team can't afford it."""
+        cost = GameState.shopCosts[typeNum]
+        team = self.activeTeam
+        if cost > team.funds or self.getUnit(coords) != None:
+            return None
+        team.funds -= cost
+        unit = self.placeUnit(team.teamNumber, GameState.shopTypes[typeNum],
+                              coords)
+        unit.hasMoved = True
+        return unit
+
+    def endTurn(self):
+        """Finish the active player's turn and begin the next player's"""
+        self.restoreObjectives()
+        for unit in self.activeTeam.units:
+            unit.hasMoved = False
+        if not self.gameIsOver:
+            self.playerIndex = (self.playerIndex + 1) % self.numPlayers
+            while self.playerIndex in self.eliminatedPlayers:
+                self.playerIndex = (self.playerIndex + 1) % self.numPlayers
+        self.turn += 1
+        self.beginTurn()
+
+    commandNames = {
+        'move': 'moveUnit',
+        'wait': 'wait',
+        'attack': 'attack',
+        'capture': 'capture',
+        'buy': 'buyUnit',
+        'endTurn': 'endTurn'
+    }
+
+    def apply(self, command):
+        """Apply a command given as a tuple of its name and arguments, e.g.
+        ('move', (3, 4), (3, 6)) or ('endTurn',)"""
+        method = getattr(self, GameState.commandNames[command[0]])
+        return method(*command[1:])
+
+    ##################################################################
+    # Turn bookkeeping
+    ##################################################################
+
+    def beginTurn(self):
+        """Start the turn of the active player"""
+        team = self.activeTeam
+        team.funds += GameState.fundsPerObjective * len(team.heldObjectives)
+        self.activeUnits = copy.copy(team.units)
+        self.restoreUnitHealth()
+
+    def setObjective(self, coords, teamAndType):
+        row, col = coords
+        oldTeam, oldType = self.contents[row][col]
+        if oldType == 0 and self.hqCoords.get(oldTeam) == coords:
+            del self.hqCoords[oldTeam]
+        if teamAndType[1] == 0:
+            self.hqCoords[teamAndType[0]] = coords
+        self.contents[row][col] = teamAndType
+        self.objectiveHealth[coords] = Objective.baseHealth
+        self.changedTiles.add(coords)
+
+    def restoreObjectives(self):
+        """Objectives no longer being captured regain full health"""
+        for coords in self.objectiveHealth:
+            unit = self.getUnit(coords)
+            if unit == None or unit.teamNum == self.getObjective(coords)[0]:
+                self.objectiveHealth[coords] = Objective.baseHealth
+
+    def restoreUnitHealth(self):
+        """Heal the active player's units standing on its objectives"""
+        for coords in self.activeTeam.heldObjectives:
+            unit = self.getUnit(coords)
+            if unit != None and unit.teamNum == self.playerIndex:
+                unit.health += GameState.objectiveHealing
+                if unit.health > 100:
+                    unit.health = 100
+
+    def removeUnit(self, coords):
+        row, col = coords
+        unit = self.unitSpace[row][col]
+        team = self.teams[unit.teamNum]
+        team.units.remove(unit)
+        self.activeUnits.discard(unit)
+        self.unitSpace[row][col] = None
+        del self.unitCoords[unit]
+        self.changedTiles.add(coords)
+        if len(team.units) == 0:
+            self.removeTeam(unit.teamNum)
+
+    def removeTeam(self, teamNum):
+        """Eliminate a team, removing its units and releasing its
+        objectives"""
+        if teamNum in self.eliminatedPlayers:
+            return
+        self.eliminatedPlayers.add(teamNum)
+        team = self.teams[teamNum]
+        for unit in team.units:
+            row, col = coords = self.unitCoords.pop(unit)
+            self.unitSpace[row][col] = None
+            self.changedTiles.add(coords)
+        team.units.clear()
+        for coords in team.heldObjectives:
+            typeNum = self.getObjective(coords)[1]
+            if typeNum == 0: typeNum = 1 # replace HQ with a city
+            self.setObjective(coords, (GameState.emptyTeam, typeNum))
+        team.heldObjectives = []
+        if self.numPlayers - len(self.eliminatedPlayers) == 1:
+            self.endGame()
+
+    def endGame(self):
+        self.gameIsOver = True
+        self.winner = None
+        for team in self.teams:
+            if team.teamNumber not in self.eliminatedPlayers:
+                self.winner = team
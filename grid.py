@@ -0,0 +1,97 @@
+# grid.py
+# Compact 2D grids for PyWars
+# Dec 2014
+
+from array import array
+
+class Grid(object):
+    """
+    A rows x cols grid of numbers stored row by row in one flat array. The
+    typecode is any typecode of the array module, e.g. 'B' for values from
+    0 to 255.
+    """
+    def __init__(self, rows, cols, typecode='B', fill=0):
+        self.rows = rows
+        self.cols = cols
+        self.cells = array(typecode, [fill]) * (rows * cols)
+
+    @classmethod
+    def fromLists(cls, lists, typecode='B'):
+        """Create a grid from a 2D list of numbers"""
+        grid = cls(len(lists), len(lists[0]), typecode)
+        grid.cells = array(typecode, [value for row in lists
+                                      for value in row])
+        return grid
+
+    def toLists(self):
+        """Get the grid as a 2D list"""
+        cols = self.cols
+        return [self.cells[row * cols:(row + 1) * cols].tolist()
+                for row in xrange(self.rows)]
+
+    def copy(self):
+        grid = Grid(self.rows, self.cols, self.cells.typecode)
+        grid.cells = array(self.cells.typecode, self.cells)
+        return grid
+
+    def isOnGrid(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def getIndex(self, row, col):
+        return row * self.cols + col
+
+    def get(self, row, col):
+        return self.cells[row * self.cols + col]
+
+    def set(self, row, col, value):
+        self.cells[row * self.cols + col] = value
+
+    def __eq__(self, other):
+        return (isinstance(other, Grid) and self.rows == other.rows and
+                self.cols == other.cols and self.cells == other.cells)
+
+    def __ne__(self, other):
+        return not self == other
+
+class TerrainGrid(Grid):
+    """
+    A grid of terrain types that also keeps the movement cost of every cell
+    for each unit class that has asked for it, so pathfinding reads a
+    unit's cost of entering a cell with a single index
+    """
+    def __init__(self, rows, cols, fill=0):
+        super(TerrainGrid, self).__init__(rows, cols, 'B', fill)
+        self.movementCosts = dict() # unit class -> array of costs
+
+    @classmethod
+    def fromLists(cls, lists):
+        grid = cls(len(lists), len(lists[0]))
+        grid.cells = array('B', [value for row in lists for value in row])
+        return grid
+
+    def copy(self):
+        """Copy the terrain along with the movement costs worked out so
+        far"""
+        grid = TerrainGrid(self.rows, self.cols)
+        grid.cells = array('B', self.cells)
+        for (unitClass, costs) in self.movementCosts.iteritems():
+            grid.movementCosts[unitClass] = array('d', costs)
+        return grid
+
+    def set(self, row, col, terrainType):
+        index = row * self.cols + col
+        self.cells[index] = terrainType
+        for (unitClass, costs) in self.movementCosts.iteritems():
+            costs[index] = unitClass.movementCost[terrainType]
+
+    def getMovementCosts(self, unit):
+        """Get the flat array of the cost for unit to enter each cell, -1
+        where it cannot. Costs are shared by every unit of the same class."""
+        unitClass = type(unit) if not isinstance(unit, type) else unit
+        costs = self.movementCosts.get(unitClass)
+        if costs == None:
+            movementCost = unitClass.movementCost
+            costs = array('d', [movementCost[terrainType]
+                                for terrainType in self.cells])
+            self.movementCosts[unitClass] = costs
+        return costs
@@ -0,0 +1,193 @@
+# imageCache.py
+# Shared sprite cache for PyWars
+# Dec 2014
+
+import os
+import hashlib
+import pygame
+from pygame.locals import *
+
+class ImageCache(object):
+    """
+    Process-wide cache of sprite surfaces, keyed by file contents
+    """
+    spriteDirectories = ['tiles', 'units']
+    atlasWidth = 1024 # width of the packed atlas in pixels
+
+    def __init__(self):
+        self.digests = dict() # path -> content digest
+        self.surfaces = dict() # content digest -> surface
+        self.converted = set() # digests whose surfaces have been converted
+        self.atlasPaths = dict() # path -> rect in the atlas
+        self.atlas = None
+        self.atlasConverted = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalizePath(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    @staticmethod
+    def displayIsReady():
+        return (pygame.display.get_init() and
+                pygame.display.get_surface() != None)
+
+    def getDigest(self, path):
+        """Get the content digest of the file at path, reading it only the
+        first time the path is seen"""
+        key = self.normalizePath(path)
+        if key not in self.digests:
+            with open(path, 'rb') as imageFile:
+                contents = imageFile.read()
+            self.digests[key] = hashlib.sha1(contents).hexdigest()
+        return self.digests[key]
+
+    def convert(self, digest):
+        """Convert the surface for the digest to the display format, once"""
+        if digest in self.converted or not self.displayIsReady():
+            return
+        surface = self.surfaces[digest]
+        if surface.get_flags() & SRCALPHA:
+            surface = surface.convert_alpha()
+        else:
+            surface = surface.convert()
+        self.surfaces[digest] = surface
+        self.converted.add(digest)
+
+    def load(self, path, convert=True):
+        """Get the surface for the image at path. Surfaces are shared, so
+        callers must copy them before drawing onto them. Pass convert=False
+        off the main thread and call convertAll on it afterwards."""
+        digest = self.getDigest(path)
+        if digest in self.surfaces:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.surfaces[digest] = pygame.image.load(path)
+        if convert:
+            self.convert(digest)
+        return self.surfaces[digest]
+
+    def convertAll(self):
+        """Convert every cached surface, e.g. once the display is created"""
+        if (self.atlas != None and not self.atlasConverted and
+            self.displayIsReady()):
+            # convert the atlas as a whole, so its sprites stay in it
+            self.useAtlas(self.atlas.convert_alpha(), self.atlasPaths)
+        for digest in self.surfaces.keys():
+            self.convert(digest)
+
+    def preload(self, directories=None, convert=True):
+        """Warm the cache with every image in the given directories"""
+        if directories == None:
+            directories = ImageCache.spriteDirectories
+        for directory in directories:
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith('.png'):
+                    self.load(os.path.join(directory, filename), convert)
+
+    ##################################################################
+    # Texture atlas
+    ##################################################################
+
+    def getAtlasLayout(self, paths):
+        """Shelf-pack the images at the given paths, tallest first. Returns
+        the atlas height and a dict of path -> rect"""
+        sizes = dict()
+        for path in paths:
+            sizes[path] = self.load(path).get_size()
+        order = sorted(paths, key=lambda path: (-sizes[path][1], path))
+        layout = dict()
+        left = top = shelfHeight = 0
+        for path in order:
+            width, height = sizes[path]
+            if left + width > ImageCache.atlasWidth:
+                left = 0
+                top += shelfHeight
+                shelfHeight = 0
+            layout[path] = pygame.Rect(left, top, width, height)
+            left += width
+            shelfHeight = max(shelfHeight, height)
+        return top + shelfHeight, layout
+
+    def useAtlas(self, atlas, layout, converted=True):
+        """Serve every path in the layout as a subsurface of the atlas"""
+        self.atlas = atlas
+        self.atlasConverted = converted
+        for path, rect in layout.iteritems():
+            digest = self.getDigest(path)
+            self.surfaces[digest] = atlas.subsurface(rect)
+            if converted:
+                self.converted.add(digest)
+            self.atlasPaths[self.normalizePath(path)] = rect
+
+    def buildAtlas(self, directories=None):
+        """Pack every sprite in the given directories into a single surface"""
+        if directories == None:
+            directories = ImageCache.spriteDirectories
+        paths = []
+        for directory in directories:
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith('.png'):
+                    paths.append(os.path.join(directory, filename))
+        height, layout = self.getAtlasLayout(paths)
+        atlas = pygame.Surface((ImageCache.atlasWidth, height), SRCALPHA, 32)
+        for path, rect in layout.iteritems():
+            atlas.blit(self.load(path), rect)
+        converted = self.displayIsReady()
+        if converted:
+            atlas = atlas.convert_alpha()
+        self.useAtlas(atlas, layout, converted)
+        return atlas
+
+    def saveAtlas(self, path):
+        """Save the atlas as a PNG with a plain-text index next to it. Each
+        index line is: size mtime left top width height imagePath"""
+        if self.atlas == None:
+            self.buildAtlas()
+        pygame.image.save(self.atlas, path)
+        with open(path + '.idx', 'wt') as index:
+            for imagePath, rect in sorted(self.atlasPaths.iteritems()):
+                stat = os.stat(imagePath)
+                index.write('%d %d %d %d %d %d %s\n' %
+                            (stat.st_size, int(stat.st_mtime), rect.left,
+                             rect.top, rect.width, rect.height, imagePath))
+
+    def loadAtlas(self, path, convert=True):
+        """Load a prebuilt atlas. Entries whose source file changed since the
+        atlas was saved are skipped and will be loaded from disk instead.
+        Returns False if there is no prebuilt atlas."""
+        if not (os.path.exists(path) and os.path.exists(path + '.idx')):
+            return False
+        layout = dict()
+        with open(path + '.idx', 'rt') as index:
+            for line in index:
+                fields = line.rstrip('\n').split(' ', 6)
+                size, mtime = int(fields[0]), int(fields[1])
+                rect = pygame.Rect([int(field) for field in fields[2:6]])
+                imagePath = fields[6]
+                if not os.path.exists(imagePath):
+                    continue
+                stat = os.stat(imagePath)
+                if stat.st_size == size and int(stat.st_mtime) == mtime:
+                    layout[imagePath] = rect
+        atlas = pygame.image.load(path)
+        converted = convert and self.displayIsReady()
+        if converted:
+            atlas = atlas.convert_alpha()
+        self.useAtlas(atlas, layout, converted)
+        return True
+
+imageCache = ImageCache()
+
+def loadImage(path):
+    """Load an image through the shared cache"""
+    return imageCache.load(path)
+
+if __name__ == '__main__':
+    # Prebuild the sprite atlas so the game can load it with a single decode
+    pygame.init()
+    imageCache.buildAtlas()
+    imageCache.saveAtlas('spriteAtlas.png')
+    print 'Packed %d sprites into spriteAtlas.png' % len(imageCache.atlasPaths)
@@ -4,28 +4,32 @@
 
 # Based on Advance Wars (Intelligent Systems, Nintendo)
 
+import os
+import sys
 import pygame
 from pygame.locals import *
+import preloader
 from pygameBaseClass import PygameBaseClass
-from map import *
-from units import *
-from battle import *
-from mapEditor import *
+from imageCache import loadImage
+from textCache import renderText
+import mapFile
+import music
+import frameProfiler
 
 class mainMenu(PygameBaseClass):
     def initGraphics(self):
-        self.background = self.loadBackground()
+        preloader.mark('display created')
+        # the full art is swapped in by update once it has been preloaded
+        self.background = preloader.loadPreview('menuArt.png')
+        self.backgroundIsPreview = True
         self.title = self.loadTitleSurface()
         self.button = self.loadButton()
         self.highlightedButton = self.loadHighlightedButton()
         self.window = self.loadWindow()
 
     def beginMusic(self):
-        pygame.mixer.music.fadeout(1000)
         musicpath = os.path.join('audio', 'mainMenu.ogg')
-        pygame.mixer.music.load(musicpath)
-        pygame.mixer.music.set_volume(0.3)
-        pygame.mixer.music.play(1)
+        music.play(musicpath, 0.3, 1)
 
     def initGame(self):
         self.modes = ['Battle', 'Edit', 'Quit']
@@ -33,15 +37,33 @@ class mainMenu(PygameBaseClass):
         self.setupBattle = False
         self.setupEditor = False
         self.editorOpenFiles = False
+        self.versusComputer = False
         self.files = self.getFiles()
         self.beginMusic()
         self.redrawAll()
         self.minRows = self.rows = 10
         self.minCols = self.cols = 16
+        preloader.mark('menu shown')
+        # import the game modes and decode their sprites while the player
+        # is still in the menu
+        preloader.start()
+
+    def update(self):
+        if self.backgroundIsPreview and preloader.finished:
+            self.background = self.loadBackground()
+            self.backgroundIsPreview = False
+            self.redrawAll()
+            preloader.mark('menu art shown')
+
+    def getBattleClass(self):
+        return preloader.importModule('battle').Battle
+
+    def getEditorClass(self):
+        return preloader.importModule('mapEditor').Editor
 
     def loadBackground(self):
         path = 'menuArt.png'
-        image = pygame.image.load(path)
+        image = loadImage(path)
         return image
 
     def loadTitleSurface(self):
@@ -52,9 +74,8 @@ class mainMenu(PygameBaseClass):
         rect = pygame.Rect(0, 0, width, height)
         pygame.draw.rect(titleSurface, color, rect)
         titleSurface.set_alpha(192)
-        font = pygame.font.SysFont('Tahoma', 128, True, True)
         text = "PyWars"
-        textSurface = font.render(text, 1, (0, 0, 0))
+        textSurface = renderText(text, 'Tahoma', 128, True, True)
         vertPadding = 4
         horizPadding = 64
         titleSurface.blit(textSurface, (horizPadding, vertPadding))
@@ -90,29 +111,38 @@ class mainMenu(PygameBaseClass):
         return window
 
     def runBattle(self):
-        fileName = self.files[self.selectionIndex] + '.tpm'
-        path = os.path.join('maps', fileName)
-        battleMode = Battle.fromFile(path)
+        path = mapFile.getScenarioPath('maps', self.files[self.selectionIndex])
+        battleMode = self.getBattleClass().fromFile(path)
+        self.setComputerPlayers(battleMode)
         if battleMode.runAsChild() == 1: self.quit()
         else: self.initGame()
 
+    def runSavedBattle(self):
+        Battle = self.getBattleClass()
+        if not os.path.exists(Battle.autosavePath): return
+        battleMode = Battle.fromSave(Battle.autosavePath)
+        self.setComputerPlayers(battleMode)
+        if battleMode.runAsChild() == 1: self.quit()
+        else: self.initGame()
+
+    def setComputerPlayers(self, battleMode):
+        """Let the computer play every team but the first, if chosen"""
+        if self.versusComputer:
+            battleMode.aiPlayers = set(xrange(1, battleMode.numPlayers))
+
     def runEditFile(self):
-        fileName = self.files[self.selectionIndex] + '.tpm'
-        path = os.path.join('maps', fileName)
-        editMode = Editor(path)
+        path = mapFile.getScenarioPath('maps', self.files[self.selectionIndex])
+        editMode = self.getEditorClass()(path)
         if editMode.runAsChild() == 1: self.quit()
         else: self.initGame()
 
     def runMapEditor(self):
-        editMode = Editor((self.rows, self.cols))
+        editMode = self.getEditorClass()((self.rows, self.cols))
         if editMode.runAsChild() == 1: self.quit()
         else: self.initGame()
 
     def getFiles(self):
-        files = []
-        for filename in os.listdir('maps'):
-            files.append(filename[:len(filename)-4])
-        return files
+        return mapFile.getScenarioNames('maps')
 
     def select(self):
         mode = self.modes[self.selectionIndex]
@@ -154,6 +184,11 @@ class mainMenu(PygameBaseClass):
             self.initGame()
         elif keyName == 'return':
             self.runBattle()
+        elif keyName == 'c':
+            self.runSavedBattle()
+        elif keyName == 'a':
+            self.versusComputer = not self.versusComputer
+            self.redrawAll()
             
     def editSetup(self, keyName):
         if self.editorOpenFiles:
@@ -212,8 +247,7 @@ class mainMenu(PygameBaseClass):
             button = self.highlightedButton.copy()
         else:
             button = self.button.copy()
-        font = pygame.font.SysFont('Arial', 64, True)
-        buttonText = font.render(text, 1, (0, 0, 0))
+        buttonText = renderText(text, 'Arial', 64, True)
         button.blit(buttonText, (horizPadding, vertPadding))
         self.display.blit(button, (0, top))
 
@@ -235,9 +269,19 @@ class mainMenu(PygameBaseClass):
         self.display.blit(self.window, (left, top))
         padding = 8
         fontSize = 32
-        font = pygame.font.SysFont('Arial', fontSize, True)
-        text = font.render('Maps:', 1, (0, 0, 0))
+        text = renderText('Maps:', 'Arial', fontSize, True)
         self.display.blit(text, (left + 32, top + 24))
+        if (self.setupBattle and
+            os.path.exists(self.getBattleClass().autosavePath)):
+            text = renderText('(c) Continue last battle', 'Arial', fontSize,
+                              True)
+            self.display.blit(text, (left + 480, top + 24))
+        if self.setupBattle:
+            if self.versusComputer: opponents = 'computer'
+            else: opponents = 'human'
+            text = renderText('(a) Opponents: ' + opponents, 'Arial',
+                              fontSize, True)
+            self.display.blit(text, (left + 480, top + 64))
         for i in xrange(len(self.files)):
             fileLeft = left + 32
             fileTop = top + 64 + (fontSize + padding) * i
@@ -246,7 +290,7 @@ class mainMenu(PygameBaseClass):
                 color = (96, 96, 96)
             else:
                 color = (0, 0, 0)
-            text = font.render(fileName, 1, color)
+            text = renderText(fileName, 'Arial', fontSize, True, color=color)
             self.display.blit(text, (fileLeft, fileTop))
 
     def drawEditSetup(self):
@@ -254,13 +298,12 @@ class mainMenu(PygameBaseClass):
         self.display.blit(self.background, (0, 0))
         self.display.blit(self.window, (left, top))
         fontSize = 32
-        font = pygame.font.SysFont('Arial', fontSize, True)
         instructions = ('Use arrow keys to adjust dimensions, or press (o)' +
                         ' to open a file')
-        text = font.render(instructions, 1, (0, 0, 0))
+        text = renderText(instructions, 'Arial', fontSize, True)
         self.display.blit(text, (left + 32, top + 24))
         dimText = '%d rows x %d columns' % (self.rows, self.cols)
-        dimensions = font.render(dimText, 1, (0, 0, 0))
+        dimensions = renderText(dimText, 'Arial', fontSize, True)
         self.display.blit(dimensions, (left + 32, top + 64))
 
     def redrawAll(self):
@@ -272,5 +315,24 @@ class mainMenu(PygameBaseClass):
             self.drawEditSetup()
         pygame.display.flip()
 
+# python mainMenu.py --frame-stats prints how each screen's frames went
+PygameBaseClass.reportFrameStats = '--frame-stats' in sys.argv
+# python mainMenu.py --profile times handlers and drawing, and
+# --profile-blits counts blits as well; see frameProfiler
+profiler = None
+if '--profile' in sys.argv or '--profile-blits' in sys.argv:
+    profiler = frameProfiler.Profiler('--profile-blits' in sys.argv)
+    profiler.install([mainMenu, preloader.importModule('battle').Battle,
+                      preloader.importModule('mapEditor').Editor])
 PyWars = mainMenu('PyWars')
-PyWars.run()
+try:
+    PyWars.run()
+finally:
+    # python mainMenu.py --startup-times prints when each stage of
+    # startup was reached; see preloader
+    if '--startup-times' in sys.argv:
+        print preloader.getReport()
+    if profiler != None:
+        profiler.uninstall()
+        profiler.dumpTrace()
+        print profiler.getReport()
@@ -8,6 +8,8 @@ import os
 import pygame
 from pygame.locals import *
 from pygameBaseClass import PygameBaseClass
+from imageCache import loadImage
+from grid import Grid, TerrainGrid
 
 class Tile(pygame.sprite.Sprite):
     """
@@ -111,55 +113,59 @@ class Tile(pygame.sprite.Sprite):
         self.overflow = self.height - Tile.size
         self.defense = Tile.defenseValues[terrainType]
 
-    def getBridgeImage(self, cardinalsIdentifier):
-        cardinalsIdentifier = self.getCardinalsIdentifier(5)
-        n = int(cardinalsIdentifier[0])
-        e = int(cardinalsIdentifier[1])
-        s = int(cardinalsIdentifier[2])
-        w = int(cardinalsIdentifier[3])
+    @staticmethod
+    def getBridgeImage(riverIdentifier):
+        """Bridges run across the river they span"""
+        n = int(riverIdentifier[0])
+        e = int(riverIdentifier[1])
+        s = int(riverIdentifier[2])
+        w = int(riverIdentifier[3])
         if (e == 1 or w == 1) and not (n == 1 or s == 1):
             return 'BridgeVert.png'
         else:
             return 'BridgeHoriz.png'
 
-    def getCardinalsIdentifier(self, terrType):
+    @staticmethod
+    def getCardinalsIdentifier(surroundings, terrType):
         neswIndex = [1, 4, 6, 3] # Indices for cardinal directions
         cardinalsIdentifier = ''
         for index in neswIndex:
-            tileType = self.surroundings[index]
+            tileType = surroundings[index]
             if tileType == terrType or tileType == None:
                 cardinalsIdentifier += '1'
             else:
                 cardinalsIdentifier += '0'
         return cardinalsIdentifier
 
-    def getDynamicImage(self, terrType):
+    @staticmethod
+    def getSpriteFile(terrType, surroundings):
         """Get the appropriate filename for the terrain based on the
         surroundings"""
-        cardinalsIdentifier = self.getCardinalsIdentifier(terrType)
+        if terrType not in Tile.dynamicSpriteTypes:
+            return Tile.staticSpriteFiles[terrType]
+        elif terrType == 6:
+            riverIdentifier = Tile.getCardinalsIdentifier(surroundings, 5)
+            return Tile.getBridgeImage(riverIdentifier)
+        cardinalsIdentifier = Tile.getCardinalsIdentifier(surroundings,
+                                                          terrType)
         if terrType == 0:
-            return self.waterFiles[cardinalsIdentifier]
+            return Tile.waterFiles[cardinalsIdentifier]
         elif terrType == 2:
-            return self.roadFiles[cardinalsIdentifier]
+            return Tile.roadFiles[cardinalsIdentifier]
         elif terrType == 5:
-            return self.riverFiles[cardinalsIdentifier]
-        elif terrType == 6:
-            return self.getBridgeImage(cardinalsIdentifier)
+            return Tile.riverFiles[cardinalsIdentifier]
 
     def getImage(self):
         """Gets the appropriate sprite for this tile"""
-        if self.terrainType in Tile.dynamicSpriteTypes:
-            filename = self.getDynamicImage(self.terrainType)
-        else:
-            filename = Tile.staticSpriteFiles[self.terrainType]
+        filename = Tile.getSpriteFile(self.terrainType, self.surroundings)
         path = os.path.join('tiles', filename)
-        image = pygame.image.load(path)
+        image = loadImage(path)
         return image
 
     def getStaticImage(self):
         filename = Tile.staticSpriteFiles[self.terrainType]
         path = os.path.join('tiles', filename)
-        image = pygame.image.load(path)
+        image = loadImage(path)
         return image
 
 class Objective(Tile):
@@ -182,8 +188,9 @@ class Objective(Tile):
     }
     baseHealth = 20
 
+    terrainType = 7 # terrain type used for movement costs
+
     def __init__(self, teamAndType):
-        self.terrainType = 7
         self.teamNum, self.typeNum = teamAndType
         self.team = Objective.teams[self.teamNum]
         self.type = Objective.types[self.typeNum]
@@ -195,43 +202,52 @@ class Objective(Tile):
         self.overflow = self.height - Tile.size
         self.defense = Objective.defenseValues[self.typeNum]
 
+    @staticmethod
+    def getSpriteFile(teamAndType):
+        teamNum, typeNum = teamAndType
+        return Objective.teams[teamNum] + Objective.types[typeNum] + '.png'
+
     def getImage(self):
-        filename = self.team + self.type + '.png'
+        filename = Objective.getSpriteFile((self.teamNum, self.typeNum))
         path = os.path.join('tiles', filename)
-        image = pygame.image.load(path)
+        image = loadImage(path)
         return image
-        
+
 class Map(pygame.sprite.Sprite):
     """
     Represents an in-game map
+
+    The map is stored as grids of small numbers (see grid.py): the terrain
+    type of every tile, the team and type of every objective, and the
+    defense factor of every tile. Tile sprites are only created when
+    something asks for one with getTile.
     """
-    def __init__(self, contents=None):
+    neighbourDirs = [(0, 1), (0, -1), (-1, 0), (1, 0)]
+    maxOverflow = Tile.size # tall sprites reach at most one row up
+    noObjective = 255 # owners and objectiveTypes value of plain terrain
+
+    def __init__(self, contents=None, grids=None):
+        """contents is either the (rows, cols) of a blank map or a map
+        string as read by loadContents. Alternatively, grids is the
+        (terrain, owners, objectiveTypes) tuple of a mapFile.Scenario."""
         super(Map, self).__init__()
-        if type(contents) == tuple:
-            contents = self.blankMap(contents)
-        else:
-            contents = self.loadContents(contents)
-        self.rows = len(contents)
-        self.cols = len(contents[0])
+        if grids == None:
+            if type(contents) == tuple:
+                contents = self.blankMap(contents)
+            else:
+                contents = self.loadContents(contents)
+            grids = self.getGrids(contents)
+        self.terrain, self.owners, self.objectiveTypes = grids
+        self.rows = self.terrain.rows
+        self.cols = self.terrain.cols
         self.width = self.cols * Tile.size
         self.height = self.rows * Tile.size
-        self.contents = contents
-        self.map = self.getMap(contents)
         self.defense = self.getDefense()
-        self.image = self.getImage()
-        self.objectives = self.getObjectives()
-
-    def refreshImage(self):
-        self.image = self.getImage()
-
-    def getObjectives(self):
-        objectives = []
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                tile = self.map[row][col]
-                if isinstance(tile, Objective):
-                    objectives.append((row, col, tile))
-        return objectives
+        self.tiles = dict() # coords -> Tile, for the tiles asked for so far
+        # the sprite of each tile once it has been drawn, by row * cols + col
+        self.sprites = [None] * (self.rows * self.cols)
+        self.objectives = self.getObjectives() # coords -> (team, type)
+        self.hqCoords = self.getHQCoords() # team number -> coords
 
     @staticmethod
     def blankMap(dimensions):
@@ -242,45 +258,161 @@ class Map(pygame.sprite.Sprite):
             contents += [[Tile.defaultType] * cols]
         return contents
 
-    def getMap(self, contents):
-        """Translates the list of contents into a map"""
-        map = []
-        for row in xrange(self.rows):
-            thisRow = []
-            for col in xrange(self.cols):
-                terrainType = contents[row][col]
-                if type(terrainType) == int:
-                    tile = Tile(terrainType,
-                                self.getSurroundingTiles(row, col))
+    @staticmethod
+    def getGrids(contents):
+        """Get the (terrain, owners, objectiveTypes) grids of a 2D list as
+        produced by loadContents"""
+        rows, cols = len(contents), len(contents[0])
+        terrain = TerrainGrid(rows, cols)
+        owners = Grid(rows, cols, 'B', Map.noObjective)
+        objectiveTypes = Grid(rows, cols, 'B', Map.noObjective)
+        index = 0
+        for row in contents:
+            for tile in row:
+                if type(tile) == int:
+                    terrain.cells[index] = tile
                 else:
-                    tile = Objective(terrainType)
-                thisRow += [tile]
-            map.append(thisRow)
-        return map
+                    terrain.cells[index] = Objective.terrainType
+                    owners.cells[index], objectiveTypes.cells[index] = tile
+                index += 1
+        return terrain, owners, objectiveTypes
 
-    def deleteHQ(self, team):
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                tile = self.map[row][col]
-                if (isinstance(tile, Objective) and tile.typeNum == 0 and
-                    tile.teamNum == team):
-                    self.changeTile(Tile.defaultType, (row, col))
+    @staticmethod
+    def getContentsFromGrids(terrain, owners, objectiveTypes):
+        """Get the 2D list, as produced by loadContents, of a set of grids"""
+        contents = []
+        for row in xrange(terrain.rows):
+            start = row * terrain.cols
+            rowContents = []
+            for index in xrange(start, start + terrain.cols):
+                typeNum = objectiveTypes.cells[index]
+                if typeNum == Map.noObjective:
+                    rowContents.append(terrain.cells[index])
+                else:
+                    rowContents.append((owners.cells[index], typeNum))
+            contents.append(rowContents)
+        return contents
+
+    def getDefense(self):
+        """Get the grid of the defense factor of each tile"""
+        defense = Grid(self.rows, self.cols)
+        for index in xrange(self.rows * self.cols):
+            typeNum = self.objectiveTypes.cells[index]
+            if typeNum == Map.noObjective:
+                terrType = self.terrain.cells[index]
+                defense.cells[index] = Tile.defenseValues[terrType]
+            else:
+                defense.cells[index] = Objective.defenseValues[typeNum]
+        return defense
 
+    def getObjectives(self):
+        objectives = dict()
+        for index in xrange(self.rows * self.cols):
+            typeNum = self.objectiveTypes.cells[index]
+            if typeNum != Map.noObjective:
+                coords = (index / self.cols, index % self.cols)
+                objectives[coords] = (self.owners.cells[index], typeNum)
+        return objectives
 
-    def changeTile(self, terrType, coords):
+    def getHQCoords(self):
+        hqCoords = dict()
+        for (coords, (teamNum, typeNum)) in self.objectives.iteritems():
+            if typeNum == 0:
+                hqCoords[teamNum] = coords
+        return hqCoords
+
+    def getContent(self, coords):
+        """Get what is at coords in the form used by loadContents: a terrain
+        type, or a (team, type) tuple for objectives"""
+        row, col = coords
+        typeNum = self.objectiveTypes.get(row, col)
+        if typeNum == Map.noObjective:
+            return self.terrain.get(row, col)
+        return (self.owners.get(row, col), typeNum)
+
+    def getContents(self):
+        """Get the whole map as a 2D list, as produced by loadContents"""
+        return self.getContentsFromGrids(self.terrain, self.owners,
+                                         self.objectiveTypes)
+
+    def setContent(self, coords, terrType):
+        """Store terrType at coords in the grids and the objective index,
+        without touching the image"""
         row, col = coords
+        oldObjective = self.objectives.pop(coords, None)
+        if (oldObjective != None and oldObjective[1] == 0 and
+            self.hqCoords.get(oldObjective[0]) == coords):
+            del self.hqCoords[oldObjective[0]]
         if type(terrType) == int:
-            self.contents[row][col] = terrType
-            self.map[row][col] = Tile(terrType,
-                                      self.getSurroundingTiles(row, col))
-            self.updateSurroundings(coords)
+            self.terrain.set(row, col, terrType)
+            self.owners.set(row, col, Map.noObjective)
+            self.objectiveTypes.set(row, col, Map.noObjective)
+            self.defense.set(row, col, Tile.defenseValues[terrType])
         else:
-            self.contents[row][col] = terrType
-            if terrType[1] == 0:
-                self.deleteHQ(terrType[0])
-            self.map[row][col] = Objective(terrType)
-            self.updateSurroundings(coords)
-        self.refreshImage()
+            teamNum, typeNum = terrType
+            self.terrain.set(row, col, Objective.terrainType)
+            self.owners.set(row, col, teamNum)
+            self.objectiveTypes.set(row, col, typeNum)
+            self.defense.set(row, col, Objective.defenseValues[typeNum])
+            self.objectives[coords] = terrType
+            if typeNum == 0:
+                self.hqCoords[teamNum] = coords
+
+    def getTile(self, coords):
+        """Get the Tile or Objective sprite at coords"""
+        tile = self.tiles.get(coords)
+        if tile == None:
+            row, col = coords
+            terrType = self.getContent(coords)
+            if type(terrType) == int:
+                tile = Tile(terrType, self.getSurroundingTiles(row, col))
+            else:
+                tile = Objective(terrType)
+            self.tiles[coords] = tile
+        return tile
+
+    def getSprite(self, row, col):
+        """Get the image of the tile at (row, col) without creating a Tile"""
+        sprite = self.sprites[row * self.cols + col]
+        if sprite == None:
+            sprite = self.findSprite(row, col)
+            self.sprites[row * self.cols + col] = sprite
+        return sprite
+
+    def findSprite(self, row, col):
+        typeNum = self.objectiveTypes.get(row, col)
+        if typeNum != Map.noObjective:
+            teamAndType = (self.owners.get(row, col), typeNum)
+            filename = Objective.getSpriteFile(teamAndType)
+        else:
+            terrType = self.terrain.get(row, col)
+            if terrType in Tile.dynamicSpriteTypes:
+                surroundings = self.getSurroundingTiles(row, col)
+            else:
+                surroundings = None
+            filename = Tile.getSpriteFile(terrType, surroundings)
+        return loadImage(os.path.join('tiles', filename))
+
+    def deleteHQ(self, team):
+        coords = self.hqCoords.get(team)
+        if coords != None:
+            self.changeTile(Tile.defaultType, coords)
+
+    def changeTile(self, terrType, coords):
+        """Put a new tile at coords, updating the sprites of its neighbours.
+        Whatever shows the map redraws those tiles and the one above."""
+        row, col = coords
+        if type(terrType) != int and terrType[1] == 0:
+            self.deleteHQ(terrType[0])
+        self.setContent(coords, terrType)
+        self.tiles.pop(coords, None)
+        self.sprites[row * self.cols + col] = None
+        for (dRow, dCol) in self.neighbourDirs:
+            newRow, newCol = row + dRow, col + dCol
+            if (0 <= newRow < self.rows and 0 <= newCol < self.cols):
+                # neighbours may need a different sprite now
+                self.tiles.pop((newRow, newCol), None)
+                self.sprites[newRow * self.cols + newCol] = None
 
     def getSurroundingTiles(self, row, col):
         """Get a list of all of the tiles surrounding (row, col)"""
@@ -296,65 +428,77 @@ class Map(pygame.sprite.Sprite):
                         # Ensure that the checked tile is on the map
                         terrainType = None
                     else:
-                        terrainType = self.contents[newRow][newCol]
+                        terrainType = self.getContent((newRow, newCol))
                     surroundings.append(terrainType)
         return surroundings
 
-    def getDefense(self):
-        """Creates and populates a 2D list representing defense factor for
-        each tile in the map"""
-        defenseValues = []
-        # create an empty, appropriately sized 2D list
-        for row in xrange(self.rows):
-            defenseValues += [[None] * self.cols]
-        # populate the list with restrictions
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                tile = self.map[row][col]
-                defenseValues[row][col] = tile.defense
-        return defenseValues
-
-    def updateSurroundings(self, coords):
-        dirs = [(0, 1), (0, -1), (-1, 0), (1, 0)]
-        cRow, cCol = coords
-        for (dRow, dCol) in dirs:
-            newRow, newCol = cRow + dRow, cCol + dCol
-            if (0 <= newRow < self.rows and 0 <= newCol < self.cols):
-                tile = self.map[newRow][newCol]
-                if not isinstance(tile, Objective):
-                    terrType = tile.terrainType
-                    self.map[newRow][newCol] = Tile(terrType,
-                        self.getSurroundingTiles(newRow, newCol))
+    def getTileRect(self, row, col):
+        """Get the part of the map image covered by the sprite at (row, col),
+        including any overflow into the row above"""
+        height = self.getSprite(row, col).get_height()
+        top = (row + 1) * Tile.size - height
+        left = col * Tile.size
+        return pygame.Rect(left, top, Tile.size, height)
+
+    def drawTiles(self, image, firstRow, lastRow, firstCol, lastCol):
+        """Draw a block of tiles onto image, top to bottom, so tall sprites
+        overlap the row above"""
+        for row in xrange(firstRow, lastRow + 1):
+            bottom = (row + 1) * Tile.size
+            for col in xrange(firstCol, lastCol + 1):
+                sprite = self.getSprite(row, col)
+                top = bottom - sprite.get_height()
+                image.blit(sprite, (col * Tile.size, top))
+
+    def getTileRange(self, rect):
+        """Get the (firstRow, lastRow, firstCol, lastCol) of the tiles under
+        a rect of the map image"""
+        return (rect.top / Tile.size, (rect.bottom - 1) / Tile.size,
+                rect.left / Tile.size, (rect.right - 1) / Tile.size)
+
+    def drawArea(self, surface, rect):
+        """Draw the terrain under rect onto a surface the size of the map,
+        leaving the rest of the surface as it was"""
+        oldClip = surface.get_clip()
+        rect = rect.clip(oldClip)
+        if rect.width <= 0 or rect.height <= 0:
+            return
+        firstRow, lastRow, firstCol, lastCol = self.getTileRange(rect)
+        # sprites in the row below can reach up into rect
+        lastRow = min(lastRow + self.maxOverflow / Tile.size, self.rows - 1)
+        surface.set_clip(rect)
+        surface.fill((0, 0, 0), rect)
+        self.drawTiles(surface, firstRow, lastRow, firstCol, lastCol)
+        surface.set_clip(oldClip)
 
     def getImage(self):
-        """Creates a surface with the appearance of the map"""
+        """Creates a surface with the appearance of the whole map. Only
+        small maps fit in one surface: the game draws maps in chunks (see
+        chunkedSurface.py)."""
         image = pygame.Surface((self.width, self.height))
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                tile = self.map[row][col]
-                top = row * Tile.size - tile.overflow
-                left = col * Tile.size
-                width = height = Tile.size
-                dest = (left, top, width, height)
-                image.blit(tile.image, dest)
+        self.drawTiles(image, 0, self.rows - 1, 0, self.cols - 1)
         return image
 
+    tokenValues = dict() # map token -> terrain type or (team, type)
+
+    @staticmethod
+    def parseToken(token):
+        value = Map.tokenValues.get(token)
+        if value == None:
+            if len(token) == 2:
+                value = (int(token[0]), int(token[1]))
+            else:
+                value = int(token)
+            Map.tokenValues[token] = value
+        return value
+
     @staticmethod
     def loadContents(contentString):
-        rows = contentString.splitlines()
+        """Parse a map string in the .tpm format into a 2D list of terrain
+        types and (team, type) objective tuples"""
         map = []
-        for row in rows:
-            cols = row.split()
-            mapRow = []
-            for tile in cols:
-                if len(tile) == 2:
-                    team = int(tile[0])
-                    type = int(tile[1])
-                    mapRow.append((team, type))
-                else:
-                    terrType = int(tile)
-                    mapRow.append(terrType)
-            map.append(mapRow)
+        for row in contentString.splitlines():
+            map.append([Map.parseToken(tile) for tile in row.split()])
         return map
 
 # class MapTest(PygameBaseClass):
@@ -7,9 +7,16 @@
 import pygame
 from pygame.locals import *
 from pygameBaseClass import PygameBaseClass
+from imageCache import loadImage
+from textCache import renderText
+import mapFile
+import music
 from map import *
 from units import *
 from battle import *
+from viewport import Viewport
+from chunkedSurface import ChunkedSurface
+from tileRenderer import TileRenderer
 
 class Editor(PygameBaseClass):
     modes = ['Terrain', 'Objective', 'Unit']
@@ -19,18 +26,20 @@ class Editor(PygameBaseClass):
     units = [Infantry, RocketInf, APC, SmTank, LgTank, Artillery]
     unitNames = ['Infantry', 'RocketInf', 'APC',
                  'SmTank', 'LgTank', 'Artillery']
+    fontStyle = ('Arial', 32, True) # family, size, bold
 
     def initGraphics(self):
         self.backgrounds = self.loadBackgrounds()
         self.camWidth = 16
         self.camHeight = 10
-        self.camTop = 0
-        self.camLeft = 0
-        self.camBottom = 10
-        self.camRight = 16
         self.screenTopLeft = (0, 128)
+        self.viewport = Viewport(self.compositor, Rect(self.screenTopLeft, (
+            self.camWidth * Tile.size, self.camHeight * Tile.size)),
+                                 self.screen)
+        self.renderer = TileRenderer(self.map, self.screen, self.presentTile)
+        self.renderer.addGroup('units', TileRenderer.unitLayer)
+        self.renderer.addGroup('cursor', TileRenderer.cursorLayer)
         self.loadCursor()
-        self.font = pygame.font.SysFont('Arial', 32, True)
 
     def __init__(self, arg):
         if type(arg) == tuple:
@@ -44,7 +53,7 @@ class Editor(PygameBaseClass):
             self.loadFile(arg)
         self.rows, self.cols = self.map.rows, self.map.cols
         screenSize = (self.cols * Tile.size, self.rows* Tile.size)
-        self.screen = pygame.Surface(screenSize)
+        self.screen = ChunkedSurface(screenSize, self.drawArea)
         self.cursorCoords = (0, 0)
         self.unitSpace = self.getUnitSpace()
 
@@ -66,61 +75,43 @@ class Editor(PygameBaseClass):
             self.redrawMapTile(coords)
 
     def redrawMapTile(self, coords):
-        """Redraw the tile at the given coords"""
-        row, col = coords
-        left, top = col * Tile.size, row * Tile.size
-        width = height = Tile.size
-        self.drawMap(pygame.Rect(left, top, width, height))
+        """Redraw the tile at the given coords, with its unit, at the end of
+        the frame"""
         self.drawUnit(coords)
-        if coords == self.cursorCoords:
-            self.drawCursor(coords)
+        self.renderer.markDirty(coords)
+
+    def presentTile(self, coords):
+        row, col = coords
+        self.viewport.presentRect(self.map.getTileRect(row, col))
+
+    def drawArea(self, rect):
+        """Draw a part of the screen surface from scratch. The screen calls
+        this for each chunk of it the camera shows that it hasn't kept."""
+        self.renderer.drawArea(rect)
 
     def drawMap(self, boundingBox=None):
         """Draw the game map to the screen. If a boundingBox rect is given,
-        only draw that portion of the map. Otherwise, draw the entire map."""
+        only draw that portion of the map. Otherwise, draw the entire map,
+        which is done chunk by chunk as the camera shows it."""
         if boundingBox == None:
-            self.screen.blit(self.map.image, (0,0))
+            self.screen.clear()
+            self.renderer.clear()
+            self.viewport.invalidate()
         else:
-            self.screen.blit(self.map.image, boundingBox, area=boundingBox)
+            self.map.drawArea(self.screen, boundingBox)
 
     def drawUnit(self, coords):
-        """Draw a single unit at the specified unit space coords"""
+        """Show the unit at coords, if there is one"""
         row, col = coords
         unit = self.unitSpace[row][col]
-        if unit != None:
-            drawCoords = (col*Tile.size, row*Tile.size)
-            self.screen.blit(unit.image, drawCoords)
-
-    def drawCursor(self, coords):
-        """Draws a white rectangle"""
-        row, col = coords
-        top, left = row * Tile.size, col * Tile.size
-        self.screen.blit(self.cursor, (left, top))
-
-    @staticmethod
-    def loadUnits(unitString):
-        if len(unitString) == 0: return []
-        units = []
-        unitIdentifiers = unitString.splitlines()
-        for i in xrange(len(unitIdentifiers)):
-            thisUnitStr = unitIdentifiers[i]
-            thisUnitList = thisUnitStr.split()
-            team = int(thisUnitList[0])
-            type = int(thisUnitList[1])
-            rowAndCol = thisUnitList[2].split(',')
-            coords = (int(rowAndCol[0]), int(rowAndCol[1]))
-            units.append((team, type, coords))
-        return units
+        self.renderer.setSprite('units', coords,
+                                unit.image if unit != None else None)
 
     def loadFile(self, path):
-        with open(path, "rt") as input:
-            save = input.read()
-        saveContents = save.split('\n*\n')
-        mapString = saveContents[0]
-        self.initFunds = int(saveContents[2])
-        unitString = saveContents[3]
-        self.map = Map(mapString)
-        self.unitList = self.loadUnits(unitString)
+        scenario = mapFile.read(path)
+        self.initFunds = scenario.initialFunds
+        self.map = Map(grids=scenario.getGrids())
+        self.unitList = scenario.units
 
     def loadBackgrounds(self):
         backgrounds = []
@@ -129,17 +120,14 @@ class Editor(PygameBaseClass):
                 team = 'Red'
             filename = team + 'Background.png'
             path = os.path.join('backgrounds', filename)
-            image = pygame.image.load(path)
+            image = loadImage(path)
             backgrounds.append(image)
         return backgrounds
 
     def placeCursor(self, coords):
-        """Move the cursor to a new location, redrawing the old and new
-        locations"""
-        oldRow, oldCol = self.cursorCoords
+        """Move the cursor to a new location"""
         self.cursorCoords = coords
-        self.redrawMapTile((oldRow, oldCol))
-        self.redrawMapTile(self.cursorCoords)
+        self.renderer.setSprites('cursor', {coords: self.cursor})
 
     def loadCursor(self):
         """Create a white overlay, one tile in size, and store it in
@@ -151,11 +139,8 @@ class Editor(PygameBaseClass):
         self.cursor.set_alpha(128)
 
     def beginMusic(self):
-        pygame.mixer.music.fadeout(1000)
         musicpath = os.path.join('audio', 'editor.ogg')
-        pygame.mixer.music.load(musicpath)
-        pygame.mixer.music.set_volume(0.2)
-        pygame.mixer.music.play(-1)
+        music.play(musicpath, 0.2)
 
     def initGame(self):
         self.modeIndex = 0
@@ -169,27 +154,31 @@ class Editor(PygameBaseClass):
         self.redrawAll()
 
     def drawScreen(self):
-        displayTopLeft = (self.camLeft * Tile.size, self.camTop * Tile.size)
-        displayDimensions = (self.camWidth * Tile.size,
-                             self.camHeight * Tile.size)
-        boundingBox = Rect(displayTopLeft, displayDimensions)
-        self.display.blit(self.screen, self.screenTopLeft, area=boundingBox)
-        pygame.display.flip()
+        """Bring the camera's view of the screen surface on the display up
+        to date"""
+        self.renderer.flush()
+        self.viewport.present()
+
+    def drawFrame(self):
+        self.drawScreen()
 
     def adjustCam(self):
+        """Scroll the camera, if need be, to keep the cursor in view"""
         row, col = self.cursorCoords
-        if col < self.camLeft:
-            self.camLeft -= 1
-            self.camRight -= 1
-        elif col >= self.camRight:
-            self.camLeft += 1
-            self.camRight += 1
-        if row < self.camTop:
-            self.camTop -= 1
-            self.camBottom -= 1
-        elif row >= self.camBottom:
-            self.camTop += 1
-            self.camBottom += 1
+        self.viewport.scrollToShow(pygame.Rect(col * Tile.size,
+                                               row * Tile.size,
+                                               Tile.size, Tile.size))
+
+    def isBusy(self):
+        """The camera glides without waiting for keys"""
+        return self.viewport.isMoving()
+
+    def update(self):
+        self.viewport.update()
+
+    def onMouseMotion(self, event):
+        """Pan the camera while the mouse is near an edge of the map"""
+        self.viewport.panAt(event.pos)
 
     def moveCursor(self, dir):
         """Handle motion of the cursor by the arrow keys"""
@@ -256,44 +245,33 @@ class Editor(PygameBaseClass):
         elif keyName == 'n':
             self.nameEntry = True
 
-    def getSaveString(self):
-        mapStr = ''
-        unitStr = ''
+    def getScenario(self):
+        """Get the map being edited as a mapFile.Scenario"""
         numPlayers = 0
+        for (teamNum, typeNum) in self.map.objectives.itervalues():
+            if typeNum == 0:
+                numPlayers += 1
+        units = []
         for row in xrange(self.rows):
-            if row != 0: mapStr += '\n'
             for col in xrange(self.cols):
-                tile = self.map.map[row][col]
                 unit = self.unitSpace[row][col]
-                if isinstance(tile, Objective):
-                    mapStr += '%d%d ' % (tile.teamNum, tile.typeNum)
-                    if tile.typeNum == 0:
-                        numPlayers += 1
-                else:
-                    mapStr += '%d  ' % tile.terrainType
                 if unit != None:
-                    if len(unitStr) != 0: unitStr += '\n'
                     typeNum = self.unitNames.index(unit.type) + 1
-                    unitStr += '%d %d %d,%d' % (unit.teamNum, typeNum,
-                                                row, col)
-        saveStr = '%s\n*\n%d\n*\n%d\n*\n%s' % (mapStr, numPlayers,
-                                               self.initFunds, unitStr)
-        return saveStr
+                    units.append((unit.teamNum, typeNum, (row, col)))
+        return mapFile.Scenario(self.map.terrain, self.map.owners,
+                                self.map.objectiveTypes, numPlayers,
+                                self.initFunds, units)
+
+    def getSaveString(self):
+        return mapFile.formatText(self.getScenario())
 
     def save(self):
-        saveStr = self.getSaveString()
-        path = os.path.join('maps', self.fileName + '.tpm')
-        with open(path, 'wt') as saveFile:
-            saveFile.write(saveStr)
+        path = os.path.join('maps', self.fileName + mapFile.textExtension)
+        mapFile.write(self.getScenario(), path)
 
 
     def findOldHQ(self):
-        for row in xrange(self.rows):
-            for col in xrange(self.cols):
-                tile = self.map.map[row][col]
-                if (isinstance(tile, Objective) and tile.typeNum == 0 and
-                    tile.teamNum == self.teamIndex):
-                    return (row, col)
+        return self.map.hqCoords.get(self.teamIndex)
 
     def changeMap(self):
         if self.modeIndex == 0:
@@ -392,22 +370,22 @@ class Editor(PygameBaseClass):
 
     def drawFileName(self):
         text = '(n) File: %s' % self.fileName
-        surface = self.font.render(text, 1, (0, 0, 0))
+        surface = renderText(text, *self.fontStyle)
         self.display.blit(surface, (32, 48))
 
     def drawTeam(self):
         text = '(q/a) Team: %s' % self.teams[self.teamIndex]
-        surface = self.font.render(text, 1, (0, 0, 0))
+        surface = renderText(text, *self.fontStyle)
         self.display.blit(surface, (352, 48))
 
     def drawMode(self):
         text = '(w/s) Mode: %s' % self.modes[self.modeIndex]
-        surface = self.font.render(text, 1, (0, 0, 0))
+        surface = renderText(text, *self.fontStyle)
         self.display.blit(surface, (640, 48))
 
     def drawFunds(self):
         text = '(e/d) Funds: %d' % self.initFunds
-        surface = self.font.render(text, 1, (0, 0, 0))
+        surface = renderText(text, *self.fontStyle)
         self.display.blit(surface, (960, 48))
 
     def drawPossible(self):
@@ -425,7 +403,7 @@ class Editor(PygameBaseClass):
                 possible = self.objectives[1:]
             else:
                 possible = self.objectives
-        text = self.font.render('(r/f) Types:', 1, (0, 0, 0))
+        text = renderText('(r/f) Types:', *self.fontStyle)
         self.display.blit(text, (left, top))
         for i in xrange(len(possible)):
             typeName = possible[i]
@@ -433,7 +411,7 @@ class Editor(PygameBaseClass):
                 color = (0, 0, 255)
             else:
                 color = (0, 0, 0)
-            text = self.font.render(typeName, 1, color)
+            text = renderText(typeName, *self.fontStyle, color=color)
             nameTop = top + 32 + (i * 32)
             self.display.blit(text, (left, nameTop))
 
@@ -443,7 +421,7 @@ class Editor(PygameBaseClass):
                 '(x) Delete', '(space) Save']
         for i in xrange(len(instructions)):
             text = instructions[i]
-            surface = self.font.render(text, 1, (0, 0, 0))
+            surface = renderText(text, *self.fontStyle)
             self.display.blit(surface, (left, top + i * 32))
 
     def redrawAll(self):
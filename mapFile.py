@@ -0,0 +1,230 @@
+# mapFile.py
+# Reading and writing PyWars scenarios
+# Dec 2014
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+from grid import Grid, TerrainGrid
+from map import Map
+
+# A .pwm file, little-endian, is a header of magic, version, rows, cols,
+# numPlayers, padding, initialFunds and unitCount; then the terrain types,
+# objective owners and objective types, one byte per tile each, row by row
+# (255 means no objective); then unitCount records of team, type, row, col.
+magic = 'PWMP'
+version = 1
+headerFormat = struct.Struct('<4sHHHBxII')
+unitFormat = struct.Struct('<BBHH')
+textExtension = '.tpm'
+binaryExtension = '.pwm'
+
+class MapFileError(Exception):
+    pass
+
+class Scenario(object):
+    """
+    Everything stored in a scenario file: the map grids, the number of
+    players, the initial funds and the initial units as (team, type,
+    (row, col)) tuples
+    """
+    def __init__(self, terrain, owners, objectiveTypes, numPlayers,
+                 initialFunds, units):
+        self.terrain = terrain
+        self.owners = owners
+        self.objectiveTypes = objectiveTypes
+        self.numPlayers = numPlayers
+        self.initialFunds = initialFunds
+        self.units = units
+
+    @property
+    def rows(self):
+        return self.terrain.rows
+
+    @property
+    def cols(self):
+        return self.terrain.cols
+
+    @staticmethod
+    def fromContents(contents, numPlayers, initialFunds, units):
+        """Create a scenario from a 2D list as produced by
+        Map.loadContents"""
+        terrain, owners, objectiveTypes = Map.getGrids(contents)
+        return Scenario(terrain, owners, objectiveTypes, numPlayers,
+                        initialFunds, units)
+
+    def getGrids(self):
+        return (self.terrain, self.owners, self.objectiveTypes)
+
+    def getContents(self):
+        """Get the map as a 2D list, as produced by Map.loadContents"""
+        return Map.getContentsFromGrids(*self.getGrids())
+
+    def __eq__(self, other):
+        return (isinstance(other, Scenario) and
+                self.getGrids() == other.getGrids() and
+                self.numPlayers == other.numPlayers and
+                self.initialFunds == other.initialFunds and
+                self.units == other.units)
+
+    def __ne__(self, other):
+        return not self == other
+
+##################################################################
+# .tpm text format
+##################################################################
+
+def parseUnits(unitString):
+    if len(unitString) == 0: return []
+    units = []
+    for line in unitString.splitlines():
+        team, typeNum, rowAndCol = line.split()
+        row, col = rowAndCol.split(',')
+        units.append((int(team), int(typeNum), (int(row), int(col))))
+    return units
+
+def parseText(text):
+    sections = text.split('\n*\n')
+    if len(sections) != 4:
+        raise MapFileError('expected 4 sections, found %d' % len(sections))
+    contents = Map.loadContents(sections[0])
+    return Scenario.fromContents(contents, int(sections[1]),
+                                 int(sections[2]), parseUnits(sections[3]))
+
+def formatText(scenario):
+    """Get the .tpm text of a scenario"""
+    rows = []
+    for rowContents in scenario.getContents():
+        tokens = []
+        for tile in rowContents:
+            if type(tile) == tuple:
+                tokens.append('%d%d ' % tile)
+            else:
+                tokens.append('%d  ' % tile)
+        rows.append(''.join(tokens))
+    units = ['%d %d %d,%d' % (team, typeNum, row, col)
+             for (team, typeNum, (row, col)) in scenario.units]
+    return '%s\n*\n%d\n*\n%d\n*\n%s' % ('\n'.join(rows), scenario.numPlayers,
+                                        scenario.initialFunds,
+                                        '\n'.join(units))
+
+##################################################################
+# .pwm binary format
+##################################################################
+
+def parseBinary(data):
+    """Parse a .pwm file from a string, buffer or mmap"""
+    if len(data) < headerFormat.size:
+        raise MapFileError('file is too short for a header')
+    header = headerFormat.unpack_from(data, 0)
+    fileMagic, fileVersion, rows, cols, numPlayers, funds, unitCount = header
+    if fileMagic != magic:
+        raise MapFileError('not a PyWars binary map')
+    if fileVersion != version:
+        raise MapFileError('unsupported version %d' % fileVersion)
+    area = rows * cols
+    size = headerFormat.size + 3 * area + unitCount * unitFormat.size
+    if len(data) < size:
+        raise MapFileError('file is truncated')
+    grids = []
+    offset = headerFormat.size
+    for gridType in (TerrainGrid, Grid, Grid):
+        grid = gridType(rows, cols)
+        grid.cells = array('B', data[offset:offset + area])
+        grids.append(grid)
+        offset += area
+    units = []
+    for i in xrange(unitCount):
+        team, typeNum, row, col = unitFormat.unpack_from(data, offset)
+        units.append((team, typeNum, (row, col)))
+        offset += unitFormat.size
+    terrain, owners, objectiveTypes = grids
+    return Scenario(terrain, owners, objectiveTypes, numPlayers, funds,
+                    units)
+
+def formatBinary(scenario):
+    """Get the .pwm bytes of a scenario"""
+    header = headerFormat.pack(magic, version, scenario.rows, scenario.cols,
+                               scenario.numPlayers, scenario.initialFunds,
+                               len(scenario.units))
+    parts = [header]
+    for grid in scenario.getGrids():
+        parts.append(grid.cells.tostring())
+    for (team, typeNum, (row, col)) in scenario.units:
+        parts.append(unitFormat.pack(team, typeNum, row, col))
+    return ''.join(parts)
+
+##################################################################
+# Files
+##################################################################
+
+def isBinary(path):
+    with open(path, 'rb') as input:
+        return input.read(len(magic)) == magic
+
+def read(path, useMmap=True):
+    """Read a scenario from a .tpm or .pwm file, telling them apart by
+    their contents. Binary files are memory-mapped unless useMmap is
+    False."""
+    if not isBinary(path):
+        with open(path, 'rt') as input:
+            return parseText(input.read())
+    with open(path, 'rb') as input:
+        if not useMmap:
+            return parseBinary(input.read())
+        data = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return parseBinary(data)
+        finally:
+            data.close()
+
+def write(scenario, path):
+    """Write a scenario, as binary if path ends in .pwm and as text
+    otherwise"""
+    if path.endswith(binaryExtension):
+        with open(path, 'wb') as output:
+            output.write(formatBinary(scenario))
+    else:
+        with open(path, 'wt') as output:
+            output.write(formatText(scenario))
+
+def convert(path):
+    """Write a .pwm copy of a .tpm file next to it, returning its path"""
+    binaryPath = os.path.splitext(path)[0] + binaryExtension
+    write(read(path), binaryPath)
+    return binaryPath
+
+def getScenarioPath(directory, name):
+    """Get the file to load for a scenario name: the .pwm copy if there is
+    one at least as new as the .tpm file, otherwise the .tpm file"""
+    textPath = os.path.join(directory, name + textExtension)
+    binaryPath = os.path.join(directory, name + binaryExtension)
+    if not os.path.exists(binaryPath):
+        return textPath
+    if (os.path.exists(textPath) and
+        os.path.getmtime(textPath) > os.path.getmtime(binaryPath)):
+        return textPath
+    return binaryPath
+
+def getScenarioNames(directory):
+    """Get the names of the scenarios in a directory, without
+    extensions"""
+    names = set()
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        if extension in (textExtension, binaryExtension):
+            names.add(name)
+    return sorted(names)
+
+if __name__ == '__main__':
+    # python mapFile.py [files...] converts .tpm files, by default every one
+    # in maps/, to .pwm
+    paths = sys.argv[1:]
+    if len(paths) == 0:
+        paths = [os.path.join('maps', filename)
+                 for filename in sorted(os.listdir('maps'))
+                 if filename.endswith(textExtension)]
+    for path in paths:
+        print '%s -> %s' % (path, convert(path))
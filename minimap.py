@@ -0,0 +1,164 @@
+# minimap.py
+# Overview of the whole battle map for PyWars
+# Dec 2014
+
+import pygame
+from pygame.locals import *
+from map import Tile
+from grid import Grid
+
+class Minimap(object):
+    """
+    Shows a GameState's map, objectives and units in a rect of the display,
+    with an outline around the part the camera shows
+    """
+    terrainColors = {
+        0: (48, 88, 200), # sea
+        1: (136, 192, 88), # plain
+        2: (200, 192, 152), # road
+        3: (40, 120, 48), # forest
+        4: (144, 112, 80), # mountain
+        5: (88, 152, 232), # river
+        6: (176, 152, 112) # bridge
+    }
+    unitColors = {
+        0: (232, 24, 24),
+        1: (24, 64, 240),
+        2: (16, 176, 16),
+        3: (240, 216, 0)
+    }
+    objectiveColors = {
+        0: (248, 144, 136),
+        1: (136, 168, 248),
+        2: (136, 224, 128),
+        3: (248, 232, 128),
+        4: (224, 224, 224) # not held by anyone
+    }
+    borderColor = (0, 0, 0)
+    viewColor = (255, 255, 255)
+
+    def __init__(self, state, area):
+        """Fit the map of state into area, a rect of the display"""
+        self.state = state
+        rows, cols = state.rows, state.cols
+        area = pygame.Rect(area)
+        # tiles along each side of a block, then pixels along each side
+        self.step = max(1, -(-rows // area.height), -(-cols // area.width))
+        self.blockRows = -(-rows // self.step)
+        self.blockCols = -(-cols // self.step)
+        self.scale = max(1, min(area.width // self.blockCols,
+                                area.height // self.blockRows))
+        self.rect = pygame.Rect(0, 0, self.blockCols * self.scale,
+                                self.blockRows * self.scale)
+        self.rect.center = area.center
+        self.terrain = self.getTerrain()
+        self.image = pygame.Surface(self.rect.size)
+        self.isDirty = True # the image changed since it was drawn
+        self.shownView = None # the camera rect outlined when it was drawn
+        self.drawTerrain()
+        for coords in state.objectiveHealth: # every objective's coords
+            self.patch(coords)
+        for coords in state.unitCoords.itervalues():
+            self.patch(coords)
+
+    def getTerrain(self):
+        """Get the terrain type of each block, sampled at its middle tile"""
+        terrain = Grid(self.blockRows, self.blockCols)
+        source = self.state.terrain
+        half = self.step // 2
+        for blockRow in xrange(self.blockRows):
+            row = min(blockRow * self.step + half, source.rows - 1)
+            for blockCol in xrange(self.blockCols):
+                col = min(blockCol * self.step + half, source.cols - 1)
+                terrain.set(blockRow, blockCol, source.get(row, col))
+        return terrain
+
+    def getBlockRect(self, blockRow, blockCol):
+        scale = self.scale
+        return pygame.Rect(blockCol * scale, blockRow * scale, scale, scale)
+
+    def drawTerrain(self):
+        colors = Minimap.terrainColors
+        for blockRow in xrange(self.blockRows):
+            for blockCol in xrange(self.blockCols):
+                color = colors.get(self.terrain.get(blockRow, blockCol),
+                                   Minimap.objectiveColors[4])
+                self.image.fill(color, self.getBlockRect(blockRow, blockCol))
+
+    ##################################################################
+    # Keeping up with the game
+    ##################################################################
+
+    def getBlockColor(self, blockRow, blockCol):
+        """A unit in the block shows over an objective, which shows over
+        the terrain"""
+        state = self.state
+        firstRow, firstCol = blockRow * self.step, blockCol * self.step
+        lastRow = min(firstRow + self.step, state.rows)
+        lastCol = min(firstCol + self.step, state.cols)
+        objective = None
+        for row in xrange(firstRow, lastRow):
+            unitRow = state.unitSpace[row]
+            for col in xrange(firstCol, lastCol):
+                unit = unitRow[col]
+                if unit != None:
+                    return Minimap.unitColors[unit.teamNum]
+                if objective == None:
+                    objective = state.getObjective((row, col))
+        if objective != None:
+            return Minimap.objectiveColors[objective[0]]
+        return Minimap.terrainColors.get(self.terrain.get(blockRow, blockCol),
+                                         Minimap.objectiveColors[4])
+
+    def patch(self, coords):
+        """Colour the block of a tile again, e.g. after a unit moved onto
+        or off it or its objective changed hands"""
+        row, col = coords
+        blockRow, blockCol = row // self.step, col // self.step
+        self.image.fill(self.getBlockColor(blockRow, blockCol),
+                        self.getBlockRect(blockRow, blockCol))
+        self.isDirty = True
+
+    def update(self, changedTiles):
+        """Catch up with the tiles the game state changed, e.g.
+        GameState.changedTiles"""
+        for coords in changedTiles:
+            self.patch(coords)
+
+    ##################################################################
+    # Drawing and input
+    ##################################################################
+
+    def getViewRect(self, cameraRect):
+        """Get the outline on the minimap of a rect of map pixels"""
+        pixels = float(self.scale) / (self.step * Tile.size)
+        rect = pygame.Rect(int(cameraRect.left * pixels),
+                           int(cameraRect.top * pixels),
+                           max(2, int(round(cameraRect.width * pixels))),
+                           max(2, int(round(cameraRect.height * pixels))))
+        return rect.move(self.rect.topleft).clamp(self.rect)
+
+    def needsDrawing(self, cameraRect):
+        return self.isDirty or self.getViewRect(cameraRect) != self.shownView
+
+    def draw(self, surface, cameraRect):
+        """Draw the minimap with the camera's view of the map outlined.
+        Returns the rect of the surface drawn over."""
+        border = self.rect.inflate(4, 4)
+        surface.fill(Minimap.borderColor, border)
+        surface.blit(self.image, self.rect)
+        self.shownView = self.getViewRect(cameraRect)
+        pygame.draw.rect(surface, Minimap.viewColor, self.shownView, 1)
+        self.isDirty = False
+        return border
+
+    def getCoordsAt(self, pos):
+        """Get the tile coords under a point of the display, or None if it
+        isn't on the minimap. Large maps give the middle tile of a block."""
+        if not self.rect.collidepoint(pos):
+            return None
+        x, y = pos[0] - self.rect.left, pos[1] - self.rect.top
+        half = self.step // 2
+        row = min((y // self.scale) * self.step + half, self.state.rows - 1)
+        col = min((x // self.scale) * self.step + half, self.state.cols - 1)
+        return (row, col)
@@ -0,0 +1,35 @@
+# music.py
+# Background music for PyWars
+# Dec 2014
+
+import pygame
+from pygame.locals import *
+
+fadeEvent = USEREVENT + 1 # posted when a fade out has finished
+fadeTime = 1000 # ms
+
+nextTrack = None # (path, volume, loops) to play once the fade is over
+
+def play(path, volume, loops=-1):
+    """Fade out the music that is playing, if any, and then play the track
+    at path loops more times, or forever if loops is -1"""
+    global nextTrack
+    nextTrack = (path, volume, loops)
+    if pygame.mixer.music.get_busy():
+        pygame.mixer.music.fadeout(fadeTime)
+        pygame.time.set_timer(fadeEvent, fadeTime)
+    else:
+        playNextTrack()
+
+def playNextTrack():
+    """Start the track waiting for a fade out. The main loop calls this
+    when it gets a fadeEvent."""
+    global nextTrack
+    pygame.time.set_timer(fadeEvent, 0) # the timer would repeat otherwise
+    if nextTrack == None:
+        return
+    path, volume, loops = nextTrack
+    nextTrack = None
+    pygame.mixer.music.load(path)
+    pygame.mixer.music.set_volume(volume)
+    pygame.mixer.music.play(loops)
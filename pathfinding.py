@@ -0,0 +1,93 @@
+# pathfinding.py
+# Movement range and path engine for PyWars
+# Dec 2014
+
+import heapq
+
+directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+class MovementRange(object):
+    """
+    The tiles a unit can reach from its starting tile, together with the
+    cheapest path to each of them
+    """
+    def __init__(self, start, movementPoints):
+        self.start = start
+        self.movementPoints = movementPoints
+        self.remaining = {start: movementPoints} # coords -> points left
+        self.parents = {start: None} # coords -> previous tile on the path
+
+    def __contains__(self, coords):
+        return coords in self.remaining
+
+    def __iter__(self):
+        return iter(self.remaining)
+
+    def __len__(self):
+        return len(self.remaining)
+
+    def getCost(self, coords):
+        """Get the movement points spent reaching the given tile"""
+        return self.movementPoints - self.remaining[coords]
+
+    def getPath(self, coords):
+        """Get the cheapest path from the start to the given tile, including
+        both ends. Returns None if the tile cannot be reached."""
+        if coords not in self.parents:
+            return None
+        path = []
+        while coords != None:
+            path.append(coords)
+            coords = self.parents[coords]
+        path.reverse()
+        return path
+
+def getMovementRange(terrain, unit, start, isBlocked=None):
+    """Get the MovementRange of the unit standing at start. terrain is a
+    grid.TerrainGrid, and isBlocked(coords), if given, returns True for tiles
+    the unit may not enter. A tile can be entered if its movement cost is
+    not -1 and the unit has points left over after paying it."""
+    reach = MovementRange(start, unit.movementPoints)
+    spread(terrain, unit, reach.remaining, reach.parents, isBlocked)
+    return reach
+
+def getCombinedRange(terrain, unit, starts, isBlocked=None):
+    """Get every tile that a unit of unit's class starting from any of the
+    given tiles can reach, mapped to the most movement points it can have
+    left there. One pass over all of the starts together costs about as
+    much as finding the range of a single unit."""
+    remaining = dict([(start, unit.movementPoints) for start in starts])
+    spread(terrain, unit, remaining, None, isBlocked)
+    return remaining
+
+def spread(terrain, unit, remaining, parents=None, isBlocked=None):
+    """Expand best-first from the tiles in remaining, a dict of coords to
+    the movement points left there, adding every tile reachable from them.
+    parents, if given, records the previous tile of each cheapest path."""
+    rows, cols = terrain.rows, terrain.cols
+    movementCost = terrain.getMovementCosts(unit)
+    queue = [(-points, coords) for (coords, points) in remaining.iteritems()]
+    heapq.heapify(queue)
+    while queue:
+        negPoints, coords = heapq.heappop(queue)
+        points = -negPoints
+        if points < remaining[coords]:
+            continue # a better path to this tile was already expanded
+        row, col = coords
+        for (dRow, dCol) in directions:
+            newRow, newCol = row + dRow, col + dCol
+            if not (0 <= newRow < rows and 0 <= newCol < cols):
+                continue
+            cost = movementCost[newRow * cols + newCol]
+            pointsAfterMove = points - cost
+            if cost == -1 or pointsAfterMove <= 0:
+                continue
+            newCoords = (newRow, newCol)
+            if remaining.get(newCoords, 0) >= pointsAfterMove:
+                continue
+            if isBlocked != None and isBlocked(newCoords):
+                continue
+            remaining[newCoords] = pointsAfterMove
+            if parents != None:
+                parents[newCoords] = coords
+            heapq.heappush(queue, (-pointsAfterMove, newCoords))
@@ -0,0 +1,124 @@
+# preloader.py
+# Staged startup for PyWars
+# Dec 2014
+
+import os
+import sys
+import imp
+import time
+import importlib
+import threading
+import pygame
+from pygame.locals import *
+from imageCache import imageCache
+
+startTime = time.time()
+doneEvent = USEREVENT + 2 # posted when the background thread has finished
+
+moduleNames = ['battle', 'mapEditor']
+atlasPath = 'spriteAtlas.png'
+artPaths = ['menuArt.png']
+audioPaths = [os.path.join('audio', 'battle.ogg'),
+              os.path.join('audio', 'editor.ogg')]
+previewScale = 4 # previews are this many times smaller than the art
+
+stages = [] # (stage, seconds since startTime, thread)
+thread = None
+finished = False
+error = None # sys.exc_info() of an exception raised by the thread
+
+def mark(stage):
+    """Record the time a stage of startup was first reached"""
+    if stage not in [name for (name, seconds, threadName) in stages]:
+        stages.append((stage, time.time() - startTime,
+                       threading.current_thread().name))
+
+def preloadAll():
+    """Run on the background thread"""
+    global error
+    try:
+        for name in moduleNames:
+            importlib.import_module(name)
+            mark('imported ' + name)
+        if not imageCache.loadAtlas(atlasPath, convert=False):
+            imageCache.preload(convert=False)
+        mark('decoded sprites')
+        for path in artPaths:
+            imageCache.load(path, convert=False)
+        mark('decoded menu art')
+        for path in audioPaths:
+            with open(path, 'rb') as audioFile:
+                while audioFile.read(1 << 20):
+                    pass
+        mark('read music')
+    except:
+        error = sys.exc_info()
+    finally:
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(doneEvent))
+
+def start():
+    """Start preloading in the background, once"""
+    global thread
+    if imp.lock_held():
+        # e.g. mainMenu is being imported rather than run, and the thread
+        # couldn't import anything until it was: load things when needed
+        return
+    if thread == None and not finished:
+        thread = threading.Thread(target=preloadAll, name='preloader')
+        thread.daemon = True # don't keep a quitting game waiting
+        thread.start()
+
+def finish():
+    """Wait for the background thread, if it is still running, and convert
+    what it loaded. The main loop calls this when it gets a doneEvent."""
+    global thread, finished, error
+    if thread == None:
+        return
+    thread.join()
+    thread = None
+    finished = True
+    if error != None:
+        exceptionType, value, traceback = error
+        error = None
+        raise exceptionType, value, traceback
+    imageCache.convertAll()
+    mark('preloaded')
+
+def importModule(name):
+    """Get a game mode's module, waiting for preloading to finish if it
+    has started"""
+    finish()
+    return importlib.import_module(name)
+
+def getPreviewPath(path):
+    root, extension = os.path.splitext(path)
+    return root + 'Preview' + extension
+
+def loadPreview(path):
+    """Get a copy of the image at path, blown up from a copy previewScale
+    times smaller that is cached next to it and decodes much faster. If
+    the cached copy is missing or older than the image, the image itself
+    is loaded and the copy made for next time."""
+    previewPath = getPreviewPath(path)
+    if (os.path.exists(previewPath) and
+        os.path.getmtime(previewPath) >= os.path.getmtime(path)):
+        preview = pygame.image.load(previewPath)
+        width, height = preview.get_size()
+        image = pygame.transform.smoothscale(preview, (
+            width * previewScale, height * previewScale)).convert()
+    else:
+        original = imageCache.load(path, convert=False)
+        width, height = original.get_size()
+        preview = pygame.transform.smoothscale(original, (
+            width / previewScale, height / previewScale))
+        pygame.image.save(preview, previewPath)
+        image = original.convert()
+    mark('loaded preview of ' + path)
+    return image
+
+def getReport():
+    lines = ['%-28s %9s  %s' % ('startup stage', 'ms', 'thread')]
+    for (stage, seconds, threadName) in stages:
+        lines.append('%-28s %9.1f  %s' % (stage, seconds * 1000, threadName))
+    return '\n'.join(lines)
@@ -5,12 +5,30 @@
 # Changes:
 # - Added EXIT condition to allow game to exit
 # - Created runAsChild method to allow for nested game objects (menu, game)
+# - Convert cached sprites to the display format once the display exists
+# - Added a FrameCompositor and drawFrame hook so that game modes can push
+#   only the changed parts of the display, once per frame
+# - Added an update hook, called once per frame after the events
+# - The main loop sleeps until the next event while the game mode is idle,
+#   can update in fixed steps, and measures frame times through a FrameClock
+# - Draw the frameProfiler overlay and count frames for it when profiling
 
 import pygame
 from pygame.locals import *
+from imageCache import imageCache
+from compositor import FrameCompositor
+from frameClock import FrameClock
+import frameProfiler
+import music
+import preloader
 
 class PygameBaseClass(object):
     """Provides a framework for games based on Pygame"""
+    frameRate = 60 # the most frames per second
+    updateRate = None # update steps per second, or None for one per frame
+    waitForEvents = True # sleep until the next event whenever not busy
+    reportFrameStats = False # print the frame stats when the loop ends
+
     def __init__(self, name='PygameBase', width=1280, height=768):
         self.name = name
         self.width = width
@@ -21,6 +39,7 @@ class PygameBaseClass(object):
         dimensions = (self.width, self.height)
         self.display = pygame.display.set_mode(dimensions)
         pygame.display.set_caption(self.name)
+        imageCache.convertAll()
 
     def onKeyDown(self, event): pass
     def onKeyUp(self, event): pass
@@ -28,6 +47,14 @@ class PygameBaseClass(object):
     def onMouseButtonDown(self, event): pass
     def onMouseButtonUp(self, event): pass
     def redrawAll(self): pass
+    def drawFrame(self): pass
+    def update(self): pass
+
+    def isBusy(self):
+        """Return True while the game mode has work to do without any
+        input, e.g. an animation, so that the main loop keeps running
+        frames instead of waiting for the next event"""
+        return False
 
     def initGraphics(self): pass
     def initGame(self): pass
@@ -38,11 +65,23 @@ class PygameBaseClass(object):
     def mainloop(self):
         """Handles events"""
         self.EXIT = False
+        self.frameClock = FrameClock(self.frameRate, self.updateRate)
+        try:
+            self.runFrames()
+        finally:
+            if self.reportFrameStats:
+                self.printFrameStats()
+
+    def runFrames(self):
         while self.EXIT == False:
-            self.clock.tick(60) # limits the game to 60 frames per second
-            for event in pygame.event.get():
+            wait = self.waitForEvents and not self.isBusy()
+            for event in self.frameClock.getEvents(wait):
                 if event.type == QUIT:
                     return
+                elif event.type == music.fadeEvent:
+                    music.playNextTrack()
+                elif event.type == preloader.doneEvent:
+                    preloader.finish()
                 elif event.type == KEYDOWN:
                     self.onKeyDown(event)
                 elif event.type == KEYUP:
@@ -53,6 +92,32 @@ class PygameBaseClass(object):
                     self.onMouseButtonDown(event)
                 elif event.type == MOUSEBUTTONUP:
                     self.onMouseButtonUp(event)
+            if self.updateRate == None:
+                self.update()
+            else:
+                for step in xrange(self.frameClock.getUpdateSteps()):
+                    self.update()
+            self.presentFrame()
+            self.frameClock.endFrame()
+            if frameProfiler.active != None:
+                frameProfiler.active.endFrame(self.frameClock.frameStart)
+
+    def printFrameStats(self):
+        stats = self.frameClock.getStats()
+        print ('%s: %d frames, %.1f per second, %.2fms average, %.1fms '
+               'worst, %.0f%% idle' % (type(self).__name__, stats['frames'],
+                                       stats['framesPerSecond'],
+                                       stats['averageFrameMs'],
+                                       stats['maxFrameMs'],
+                                       stats['idlePercent']))
+
+    def presentFrame(self):
+        """Draw anything the game mode deferred and push the dirty parts
+        of the display"""
+        self.drawFrame()
+        if frameProfiler.active != None:
+            frameProfiler.active.drawOverlay(self)
+        self.compositor.present()
 
     def run(self):
         """Run the game"""
@@ -61,9 +126,10 @@ class PygameBaseClass(object):
         self.createDisplay()
 
         # Initialize stuff
+        self.compositor = FrameCompositor(self.display)
         self.initGraphics()
         self.initGame()
-        self.clock = pygame.time.Clock()
+        self.drawFrame()
         pygame.display.flip()
 
         # Call the main loop
@@ -80,9 +146,10 @@ class PygameBaseClass(object):
         self.display = pygame.display.get_surface()
 
         # Initialize stuff
+        self.compositor = FrameCompositor(self.display)
         self.initGraphics()
         self.initGame()
-        self.clock = pygame.time.Clock()
+        self.drawFrame()
         pygame.display.flip()
 
         # Call the main loop
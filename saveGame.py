@@ -0,0 +1,379 @@
+# saveGame.py
+# Snapshots of battles in progress
+# Dec 2014
+
+import os
+import struct
+import mapFile
+from gameState import GameState
+
+# A save file, little-endian, is a header followed by chunks. A FULL chunk
+# holds the length of a .pwm map, the map and a state block; a DELT chunk
+# holds a state block of only what changed since the chunk before it. A
+# state block is the game record, then the teams, the rng state, the
+# objectives, the removed units and the units, each list after its count.
+# Version 1 blocks have every team, without a count or team numbers, and
+# no rng state. A truncated last chunk, as left by a crash mid-save, is
+# ignored.
+magic = 'PWSV'
+version = 2
+readableVersions = [1, 2]
+extension = '.pws'
+fileHeaderFormat = struct.Struct('<4sH') # magic, version
+chunkFormat = struct.Struct('<4sI') # kind, payload length
+lengthFormat = struct.Struct('<I')
+# playerIndex, turn, gameIsOver, winner, eliminated players bitmask
+gameFormat = struct.Struct('<BIBBB')
+# GameState.rng.getstate(): version, 625 words, hasGauss, gauss
+rngFormat = struct.Struct('<B625IBd')
+# team, funds, hasView, cursor row and col, camera left, top, right and
+# bottom; version 1 has no team number
+teamFormat = struct.Struct('<BiBHHhhhh')
+version1TeamFormat = struct.Struct('<iBHHhhhh')
+objectiveFormat = struct.Struct('<HHBBh') # row, col, team, type, health
+removedFormat = struct.Struct('<HH') # row, col
+unitFormat = struct.Struct('<HHBBhB') # row, col, team, type, health, moved
+noWinner = 255
+
+class SaveGameError(Exception):
+    pass
+
+class Snapshot(object):
+    """
+    The state of a battle at one point in time
+    """
+    unitTypeNumbers = dict([(unitType, typeNum) for (typeNum, unitType)
+                            in GameState.shopTypes.iteritems()])
+
+    def __init__(self):
+        self.scenario = None # map and setup, only kept by full snapshots
+        self.playerIndex = 0
+        self.turn = 0
+        self.gameIsOver = False
+        self.winner = None # team number
+        self.eliminatedPlayers = set()
+        self.teams = [] # (funds, cursorCoords, camRect) per team
+        self.objectives = dict() # coords -> (team, type, capture health)
+        self.units = dict() # coords -> (team, type, health, hasMoved)
+        self.rngState = None # GameState.rng.getstate(), if it was saved
+
+    @staticmethod
+    def fromState(state, includeMap=True):
+        """Record a GameState. Cursors and cameras are recorded for teams
+        that have them (see battle.Team). Unless includeMap is True the map
+        is left out, which is all a delta needs."""
+        snapshot = Snapshot()
+        if includeMap:
+            snapshot.scenario = mapFile.Scenario.fromContents(
+                state.contents, state.numPlayers, state.initialFunds, [])
+        snapshot.playerIndex = state.playerIndex
+        snapshot.turn = state.turn
+        snapshot.gameIsOver = state.gameIsOver
+        if state.winner != None:
+            snapshot.winner = state.winner.teamNumber
+        snapshot.eliminatedPlayers = set(state.eliminatedPlayers)
+        snapshot.rngState = state.rng.getstate()
+        for team in state.teams:
+            if hasattr(team, 'cursorCoords'):
+                camRect = (team.camLeft, team.camTop,
+                           team.camRight, team.camBottom)
+                snapshot.teams.append((team.funds, team.cursorCoords,
+                                       camRect))
+            else:
+                snapshot.teams.append((team.funds, None, None))
+        for (coords, health) in state.objectiveHealth.iteritems():
+            teamNum, typeNum = state.getObjective(coords)
+            snapshot.objectives[coords] = (teamNum, typeNum, health)
+        for (unit, coords) in state.unitCoords.iteritems():
+            typeNum = Snapshot.unitTypeNumbers[type(unit)]
+            snapshot.units[coords] = (unit.teamNum, typeNum, unit.health,
+                                      unit.hasMoved)
+        return snapshot
+
+    def getScenario(self):
+        """Get the map as it stands in this snapshot, with its units, as a
+        mapFile.Scenario"""
+        terrain, owners, objectiveTypes = self.scenario.getGrids()
+        owners = owners.copy()
+        objectiveTypes = objectiveTypes.copy()
+        for ((row, col), (teamNum, typeNum, health)) in \
+                self.objectives.iteritems():
+            owners.set(row, col, teamNum)
+            objectiveTypes.set(row, col, typeNum)
+        units = []
+        for coords in sorted(self.units):
+            teamNum, typeNum, health, hasMoved = self.units[coords]
+            units.append((teamNum, typeNum, coords))
+        return mapFile.Scenario(terrain, owners, objectiveTypes,
+                                self.scenario.numPlayers,
+                                self.scenario.initialFunds, units)
+
+    def toGameState(self):
+        scenario = self.getScenario()
+        state = GameState(scenario.getContents(), scenario.numPlayers,
+                          scenario.initialFunds, scenario.units,
+                          firstPlayer=self.playerIndex, startTurn=False)
+        self.restore(state)
+        return state
+
+    def restore(self, state):
+        """Bring a GameState created from getScenario, without starting its
+        turn, up to this snapshot"""
+        for (coords, (teamNum, typeNum, health)) in \
+                self.objectives.iteritems():
+            state.objectiveHealth[coords] = health
+        for (coords, (teamNum, typeNum, health, hasMoved)) in \
+                self.units.iteritems():
+            unit = state.getUnit(coords)
+            unit.health = health
+            unit.hasMoved = hasMoved
+        for (team, (funds, cursorCoords, camRect)) in zip(state.teams,
+                                                          self.teams):
+            team.funds = funds
+            if cursorCoords != None and hasattr(team, 'cursorCoords'):
+                team.cursorCoords = cursorCoords
+                (team.camLeft, team.camTop,
+                 team.camRight, team.camBottom) = camRect
+        state.playerIndex = self.playerIndex
+        state.turn = self.turn
+        state.eliminatedPlayers = set(self.eliminatedPlayers)
+        state.gameIsOver = self.gameIsOver
+        if self.winner == None:
+            state.winner = None
+        else:
+            state.winner = state.teams[self.winner]
+        state.activeUnits = set([unit for unit in state.activeTeam.units
+                                 if not unit.hasMoved])
+        if self.rngState != None:
+            state.rng.setstate(self.rngState)
+        state.changedTiles = set()
+
+    def __eq__(self, other):
+        """Snapshots are equal if they describe the same battle, even if
+        one was built up from an older map by deltas"""
+        return (isinstance(other, Snapshot) and
+                self.getScenario() == other.getScenario() and
+                self.playerIndex == other.playerIndex and
+                self.turn == other.turn and
+                self.gameIsOver == other.gameIsOver and
+                self.winner == other.winner and
+                self.eliminatedPlayers == other.eliminatedPlayers and
+                self.teams == other.teams and
+                self.objectives == other.objectives and
+                self.units == other.units and
+                self.rngState == other.rngState)
+
+    def __ne__(self, other):
+        return not self == other
+
+##################################################################
+# Encoding
+##################################################################
+
+def encodeState(snapshot, previous=None):
+    """Encode a state block holding what changed in snapshot since
+    previous, or everything if previous is None"""
+    eliminated = 0
+    for teamNum in snapshot.eliminatedPlayers:
+        eliminated |= 1 << teamNum
+    if snapshot.winner == None:
+        winner = noWinner
+    else:
+        winner = snapshot.winner
+    parts = [gameFormat.pack(snapshot.playerIndex, snapshot.turn,
+                             snapshot.gameIsOver, winner, eliminated)]
+    if previous == None:
+        oldTeams, oldObjectives, oldUnits = [], dict(), dict()
+        oldRngState = None
+    else:
+        oldTeams = previous.teams
+        oldObjectives, oldUnits = previous.objectives, previous.units
+        oldRngState = previous.rngState
+    teams = [(teamNum, team) for (teamNum, team) in enumerate(snapshot.teams)
+             if teamNum >= len(oldTeams) or oldTeams[teamNum] != team]
+    parts.append(lengthFormat.pack(len(teams)))
+    for (teamNum, (funds, cursorCoords, camRect)) in teams:
+        if cursorCoords == None:
+            parts.append(teamFormat.pack(teamNum, funds, 0, 0, 0, 0, 0, 0,
+                                         0))
+        else:
+            parts.append(teamFormat.pack(teamNum, funds, 1, cursorCoords[0],
+                                         cursorCoords[1], *camRect))
+    if snapshot.rngState != None and snapshot.rngState != oldRngState:
+        rngVersion, words, gauss = snapshot.rngState
+        parts.append(lengthFormat.pack(1))
+        parts.append(rngFormat.pack(rngVersion, *(words + (gauss != None,
+                                                           gauss or 0.0))))
+    else:
+        parts.append(lengthFormat.pack(0)) # as it was in the last chunk
+    objectives = [(coords, objective) for (coords, objective)
+                  in snapshot.objectives.iteritems()
+                  if oldObjectives.get(coords) != objective]
+    parts.append(lengthFormat.pack(len(objectives)))
+    for ((row, col), objective) in objectives:
+        parts.append(objectiveFormat.pack(row, col, *objective))
+    removed = [coords for coords in oldUnits if coords not in snapshot.units]
+    parts.append(lengthFormat.pack(len(removed)))
+    for (row, col) in removed:
+        parts.append(removedFormat.pack(row, col))
+    units = [(coords, unit) for (coords, unit) in snapshot.units.iteritems()
+             if oldUnits.get(coords) != unit]
+    parts.append(lengthFormat.pack(len(units)))
+    for ((row, col), unit) in units:
+        parts.append(unitFormat.pack(row, col, *unit))
+    return ''.join(parts)
+
+def readRecords(data, offset, recordFormat):
+    """Read a count followed by that many records. Returns the records and
+    the offset after them."""
+    count = lengthFormat.unpack_from(data, offset)[0]
+    offset += lengthFormat.size
+    records = []
+    for i in xrange(count):
+        records.append(recordFormat.unpack_from(data, offset))
+        offset += recordFormat.size
+    return records, offset
+
+def decodeState(data, offset, snapshot, numTeams, fileVersion=version):
+    """Apply a state block to snapshot"""
+    game = gameFormat.unpack_from(data, offset)
+    offset += gameFormat.size
+    snapshot.playerIndex, snapshot.turn, gameIsOver, winner, eliminated = game
+    snapshot.gameIsOver = bool(gameIsOver)
+    if winner == noWinner:
+        snapshot.winner = None
+    else:
+        snapshot.winner = winner
+    snapshot.eliminatedPlayers = set([teamNum for teamNum in xrange(8)
+                                      if eliminated & (1 << teamNum)])
+    if fileVersion >= 2:
+        teams, offset = readRecords(data, offset, teamFormat)
+    else:
+        teams = []
+        for teamNum in xrange(numTeams):
+            teams.append((teamNum,) +
+                         version1TeamFormat.unpack_from(data, offset))
+            offset += version1TeamFormat.size
+    if len(snapshot.teams) != numTeams:
+        snapshot.teams = [None] * numTeams
+    for team in teams:
+        teamNum, funds, hasView, cursorRow, cursorCol = team[:5]
+        if hasView:
+            snapshot.teams[teamNum] = (funds, (cursorRow, cursorCol),
+                                       tuple(team[5:]))
+        else:
+            snapshot.teams[teamNum] = (funds, None, None)
+    if fileVersion >= 2:
+        rngStates, offset = readRecords(data, offset, rngFormat)
+        for rng in rngStates:
+            words, hasGauss, gauss = rng[1:-2], rng[-2], rng[-1]
+            snapshot.rngState = (rng[0], words, gauss if hasGauss else None)
+    objectives, offset = readRecords(data, offset, objectiveFormat)
+    for (row, col, teamNum, typeNum, health) in objectives:
+        snapshot.objectives[(row, col)] = (teamNum, typeNum, health)
+    removed, offset = readRecords(data, offset, removedFormat)
+    for (row, col) in removed:
+        del snapshot.units[(row, col)]
+    units, offset = readRecords(data, offset, unitFormat)
+    for (row, col, teamNum, typeNum, health, hasMoved) in units:
+        snapshot.units[(row, col)] = (teamNum, typeNum, health,
+                                      bool(hasMoved))
+    return offset
+
+def encodeFull(snapshot):
+    mapData = mapFile.formatBinary(snapshot.scenario)
+    return lengthFormat.pack(len(mapData)) + mapData + encodeState(snapshot)
+
+def encodeChunk(kind, payload):
+    return chunkFormat.pack(kind, len(payload)) + payload
+
+##################################################################
+# Files
+##################################################################
+
+def save(snapshot, path):
+    """Write snapshot to path as a single full snapshot"""
+    data = (fileHeaderFormat.pack(magic, version) +
+            encodeChunk('FULL', encodeFull(snapshot)))
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'wb') as output:
+        output.write(data)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporaryPath, path)
+    return len(data)
+
+def appendDelta(snapshot, previous, path):
+    """Append the changes from previous to snapshot to a save file.
+    Returns the number of bytes written."""
+    data = encodeChunk('DELT', encodeState(snapshot, previous))
+    with open(path, 'ab') as output:
+        output.write(data)
+    return len(data)
+
+def load(path):
+    """Read a save file, applying its deltas, and return the Snapshot"""
+    with open(path, 'rb') as input:
+        data = input.read()
+    if len(data) < fileHeaderFormat.size:
+        raise SaveGameError('file is too short for a header')
+    fileMagic, fileVersion = fileHeaderFormat.unpack_from(data, 0)
+    if fileMagic != magic:
+        raise SaveGameError('not a PyWars save')
+    if fileVersion not in readableVersions:
+        raise SaveGameError('unsupported version %d' % fileVersion)
+    snapshot = None
+    offset = fileHeaderFormat.size
+    while offset + chunkFormat.size <= len(data):
+        kind, length = chunkFormat.unpack_from(data, offset)
+        offset += chunkFormat.size
+        if offset + length > len(data):
+            break # a save was interrupted
+        if kind == 'FULL':
+            mapLength = lengthFormat.unpack_from(data, offset)[0]
+            mapStart = offset + lengthFormat.size
+            snapshot = Snapshot()
+            snapshot.scenario = mapFile.parseBinary(
+                data[mapStart:mapStart + mapLength])
+            decodeState(data, mapStart + mapLength, snapshot,
+                        snapshot.scenario.numPlayers, fileVersion)
+        elif kind == 'DELT' and snapshot != None:
+            decodeState(data, offset, snapshot,
+                        snapshot.scenario.numPlayers, fileVersion)
+        else:
+            raise SaveGameError('unexpected %r chunk' % kind)
+        offset += length
+    if snapshot == None:
+        raise SaveGameError('no full snapshot in file')
+    return snapshot
+
+class AutoSaver(object):
+    """
+    Saves a game to the same file over and over, appending deltas and
+    compacting the file back into one full snapshot when the deltas add up
+    to more than compactRatio times its size
+    """
+    def __init__(self, path, compactRatio=1.0):
+        self.path = path
+        self.compactRatio = compactRatio
+        self.last = None # the snapshot the file currently holds
+        self.fullSize = 0
+        self.deltaSize = 0
+        self.bytesWritten = 0
+
+    def save(self, state):
+        """Save a GameState. Returns the number of bytes written."""
+        if (self.last == None or
+            self.deltaSize > self.fullSize * self.compactRatio):
+            snapshot = Snapshot.fromState(state)
+            written = save(snapshot, self.path)
+            self.fullSize = written
+            self.deltaSize = 0
+        else:
+            snapshot = Snapshot.fromState(state, includeMap=False)
+            snapshot.scenario = self.last.scenario
+            written = appendDelta(snapshot, self.last, self.path)
+            self.deltaSize += written
+        self.last = snapshot
+        self.bytesWritten += written
+        return written
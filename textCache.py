@@ -0,0 +1,85 @@
+# textCache.py
+# Shared font registry and rendered text cache for PyWars
+# Dec 2014
+
+import pygame
+from collections import OrderedDict
+from pygame.locals import *
+
+class TextCache(object):
+    """
+    Process-wide font registry and LRU cache of rendered text surfaces
+    """
+    defaultCapacity = 512 # rendered strings kept before evicting the oldest
+
+    def __init__(self, capacity=None):
+        if capacity == None:
+            capacity = self.defaultCapacity
+        self.capacity = capacity
+        self.fonts = dict() # (family, size, bold, italic) -> font
+        self.surfaces = OrderedDict() # (font key, text, color) -> surface
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def getFont(self, family, size, bold=False, italic=False):
+        """Get the system font with the given style, creating it once"""
+        key = (family, size, bool(bold), bool(italic))
+        font = self.fonts.get(key)
+        if font == None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = pygame.font.SysFont(family, size, bold, italic)
+            self.fonts[key] = font
+        return font
+
+    def render(self, text, family, size, bold=False, italic=False,
+               color=(0, 0, 0)):
+        """Get an antialiased surface of text in the given font and color.
+        The surface is shared: blit it, never draw on it."""
+        fontKey = (family, size, bool(bold), bool(italic))
+        color = tuple(color)
+        key = (fontKey, text, color)
+        surface = self.surfaces.pop(key, None)
+        if surface != None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            font = self.getFont(*fontKey)
+            surface = font.render(text, 1, color)
+            if len(self.surfaces) >= self.capacity:
+                self.surfaces.popitem(last=False)
+                self.evictions += 1
+        self.surfaces[key] = surface # most recently used goes last
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+    def getStats(self):
+        """Get the cache counters as a dict"""
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            hitRate = 0.0
+        else:
+            hitRate = float(self.hits) / lookups
+        return {
+            'fonts': len(self.fonts),
+            'surfaces': len(self.surfaces),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitRate': hitRate
+        }
+
+textCache = TextCache()
+
+def getFont(family, size, bold=False, italic=False):
+    """Get a font through the shared registry"""
+    return textCache.getFont(family, size, bold, italic)
+
+def renderText(text, family, size, bold=False, italic=False,
+               color=(0, 0, 0)):
+    """Render text through the shared cache. Blit the surface, never draw
+    on it."""
+    return textCache.render(text, family, size, bold, italic, color)
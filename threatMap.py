@@ -0,0 +1,198 @@
+# threatMap.py
+# Danger zones for PyWars
+# Dec 2014
+
+import pathfinding
+from grid import Grid
+
+groupSize = 16 # units are grouped by blocks of groupSize x groupSize tiles
+
+def getGroup(unit, (row, col)):
+    """Units are grouped by team, class and the block of the map they
+    stand in"""
+    return (unit.teamNum, type(unit), row / groupSize, col / groupSize)
+
+class ThreatMap(object):
+    """
+    The tiles that the units not on team teamNum of a GameState could
+    attack next turn. Direct attackers threaten the tiles next to wherever
+    they can move to and stop; artillery cannot fire after moving, so it
+    threatens the tiles at firing range of where it stands.
+    """
+    def __init__(self, state, teamNum):
+        self.state = state
+        self.teamNum = teamNum
+        self.counts = Grid(state.rows, state.cols, 'H') # groups per tile
+        self.occupants = dict() # coords -> unit, as of the last update
+        self.members = dict() # group -> coords of its units
+        self.reaches = dict() # group -> tiles its units can move through
+        self.threatened = dict() # group -> tiles its units can attack
+        for (unit, coords) in state.unitCoords.iteritems():
+            self.occupants[coords] = unit
+            if unit.teamNum != teamNum:
+                self.members.setdefault(getGroup(unit, coords),
+                                        set()).add(coords)
+        for group in self.members.keys():
+            self.updateGroup(group)
+
+    def __contains__(self, coords):
+        row, col = coords
+        return self.counts.get(row, col) > 0
+
+    def __iter__(self):
+        cols = self.counts.cols
+        for (index, count) in enumerate(self.counts.cells):
+            if count > 0:
+                yield divmod(index, cols)
+
+    ##################################################################
+    # Finding threats
+    ##################################################################
+
+    def getReach(self, group):
+        """Get the tiles the units of a group can move through, with the
+        most movement points they can have left there"""
+        teamNum, unitClass = group[:2]
+        unitSpace = self.state.unitSpace
+        def isBlocked((row, col)):
+            unit = unitSpace[row][col]
+            return unit != None and unit.teamNum != teamNum
+        return pathfinding.getCombinedRange(self.state.terrain, unitClass,
+                                            self.members[group], isBlocked)
+
+    def getDirectThreats(self, group, reach):
+        """Get the tiles next to the tiles in reach that a unit of the group
+        can stop on: empty ones and those its own units stand on"""
+        unitSpace = self.state.unitSpace
+        members = self.members[group]
+        rows, cols = self.state.rows, self.state.cols
+        threatened = set()
+        for coords in reach:
+            row, col = coords
+            if unitSpace[row][col] != None and coords not in members:
+                continue # passing through a teammate
+            for (dRow, dCol) in pathfinding.directions:
+                newRow, newCol = row + dRow, col + dCol
+                if 0 <= newRow < rows and 0 <= newCol < cols:
+                    threatened.add((newRow, newCol))
+        return threatened
+
+    def getArtilleryThreats(self, group):
+        """Get the tiles at firing range of the artillery in a group"""
+        unitClass = group[1]
+        minDistance = unitClass.artilleryMinRange
+        maxDistance = unitClass.artilleryMaxRange
+        threatened = set()
+        for (cRow, cCol) in self.members[group]:
+            for row in xrange(cRow - maxDistance, cRow + maxDistance + 1):
+                for col in xrange(cCol - maxDistance, cCol + maxDistance + 1):
+                    taxicabDistance = abs(row - cRow) + abs(col - cCol)
+                    if (minDistance <= taxicabDistance <= maxDistance and
+                        self.state.isOnMap((row, col))):
+                        threatened.add((row, col))
+        return threatened
+
+    def updateGroup(self, group, findReach=True):
+        """Find the threats of a group again, and where its units can move
+        unless findReach is False. Returns the tiles that entered or left
+        the danger zone."""
+        counts = self.counts.cells
+        cols = self.counts.cols
+        cleared = set()
+        for (row, col) in self.threatened.pop(group, ()):
+            index = row * cols + col
+            counts[index] -= 1
+            if counts[index] == 0:
+                cleared.add((row, col))
+        reach = self.reaches.pop(group, None)
+        if len(self.members.get(group, ())) == 0:
+            self.members.pop(group, None)
+            return cleared
+        if group[1].isArtilleryUnit:
+            threatened = self.getArtilleryThreats(group)
+        else:
+            if findReach or reach == None:
+                reach = self.getReach(group)
+            self.reaches[group] = reach
+            threatened = self.getDirectThreats(group, reach)
+        self.threatened[group] = threatened
+        entered = set()
+        for (row, col) in threatened:
+            index = row * cols + col
+            counts[index] += 1
+            if counts[index] == 1:
+                entered.add((row, col))
+        # a tile that was cleared and entered again did not change
+        return cleared ^ entered
+
+    ##################################################################
+    # Keeping up with the game
+    ##################################################################
+
+    def isAffected(self, group, reach, coords, oldUnit):
+        """Return True if a change of unit at coords could change where
+        the units of a group can move or stop: either they could reach the
+        tile, or a unit of another team that was in their way has left it
+        and they could now step onto it"""
+        if coords in reach:
+            return True
+        if oldUnit == None or oldUnit.teamNum == group[0]:
+            return False
+        row, col = coords
+        cost = self.state.terrain.getMovementCosts(group[1])[
+            row * self.state.cols + col]
+        if cost == -1:
+            return False
+        for (dRow, dCol) in pathfinding.directions:
+            if reach.get((row + dRow, col + dCol), 0) > cost:
+                return True
+        return False
+
+    def isTeammate(self, group, unit):
+        """Return True if unit doesn't block the units of a group: it is
+        None or on their team"""
+        return unit == None or unit.teamNum == group[0]
+
+    def update(self, changedTiles):
+        """Catch up with the units that moved, died or were bought on the
+        given tiles, e.g. GameState.changedTiles. Only groups with a unit on
+        one of the tiles, or whose movement it could have changed, are found
+        again. Groups that only had a teammate come or go on a tile they can
+        reach move as before, so only where they can stop is found again.
+        Returns the tiles that entered or left the danger zone."""
+        stale = set()
+        stopsChanged = set() # groups whose reach is still right
+        for coords in changedTiles:
+            row, col = coords
+            unit = self.state.unitSpace[row][col]
+            oldUnit = self.occupants.get(coords)
+            if unit is oldUnit:
+                continue # e.g. the unit only waited or was attacked
+            if oldUnit != None:
+                del self.occupants[coords]
+                if oldUnit.teamNum != self.teamNum:
+                    group = getGroup(oldUnit, coords)
+                    self.members[group].discard(coords)
+                    stale.add(group)
+            if unit != None:
+                self.occupants[coords] = unit
+                if unit.teamNum != self.teamNum:
+                    group = getGroup(unit, coords)
+                    self.members.setdefault(group, set()).add(coords)
+                    stale.add(group)
+            for (group, reach) in self.reaches.iteritems():
+                if group in stale:
+                    continue
+                if (coords in reach and self.isTeammate(group, oldUnit) and
+                    self.isTeammate(group, unit)):
+                    stopsChanged.add(group)
+                elif self.isAffected(group, reach, coords, oldUnit):
+                    stale.add(group)
+        changed = set()
+        for group in stale:
+            # a tile can leave the zone with one group and enter it again
+            # with another
+            changed ^= self.updateGroup(group)
+        for group in stopsChanged - stale:
+            changed ^= self.updateGroup(group, findReach=False)
+        return changed
@@ -0,0 +1,126 @@
+# tileRenderer.py
+# Layered, dirty-tracked tile drawing for PyWars
+# Dec 2014
+
+import pygame
+from pygame.locals import *
+from map import Tile
+
+class TileRenderer(object):
+    """
+    Draws a Map and groups of tile-sized sprites over it on a screen
+    surface. The map draws the bottom two layers itself: the terrain, then
+    the tall sprites, like HQs, that overflow into the row above. Each
+    group holds at most one image per tile and is drawn on one of the
+    layers above those, over the groups added to that layer before it.
+    """
+    terrainLayer = 0 # drawn by the map
+    overflowLayer = 1 # drawn by the map
+    unitLayer = 2
+    overlayLayer = 3
+    cursorLayer = 4
+
+    def __init__(self, map, screen, presentTile):
+        """presentTile(coords) is called for each tile once it has been
+        repainted, e.g. to copy it to the display"""
+        self.map = map
+        self.screen = screen
+        self.presentTile = presentTile
+        self.groups = dict() # name -> {coords: image}
+        self.drawOrder = [] # (layer, index, group), bottom first
+        self.dirtyTiles = set() # tiles to repaint at the next flush
+
+    def addGroup(self, name, layer):
+        """Add an empty group of sprites drawn on a layer"""
+        group = dict()
+        self.groups[name] = group
+        self.drawOrder.append((layer, len(self.drawOrder), group))
+        self.drawOrder.sort()
+
+    ##################################################################
+    # Changing what is shown
+    ##################################################################
+
+    def getSprites(self, name):
+        """Get the {coords: image} of a group, which callers shouldn't
+        change: use setSprite or setSprites"""
+        return self.groups[name]
+
+    def setSprite(self, name, coords, image=None):
+        """Show image on a tile in a group, or nothing if it is None"""
+        group = self.groups[name]
+        if group.get(coords) is image:
+            return
+        if image == None:
+            del group[coords]
+        else:
+            group[coords] = image
+        self.dirtyTiles.add(coords)
+
+    def setSprites(self, name, images):
+        """Replace everything a group shows with the {coords: image} of
+        images. Only tiles whose image changed are repainted."""
+        group = self.groups[name]
+        for (coords, image) in group.iteritems():
+            if images.get(coords) is not image:
+                self.dirtyTiles.add(coords)
+        for (coords, image) in images.iteritems():
+            if group.get(coords) is not image:
+                self.dirtyTiles.add(coords)
+        group.clear()
+        group.update(images)
+
+    def markDirty(self, coords):
+        """Repaint a tile at the next flush, e.g. after its terrain
+        changed"""
+        self.dirtyTiles.add(coords)
+
+    ##################################################################
+    # Drawing
+    ##################################################################
+
+    def drawTile(self, coords):
+        row, col = coords
+        left, top = col * Tile.size, row * Tile.size
+        self.map.drawArea(self.screen, pygame.Rect(left, top, Tile.size,
+                                                   Tile.size))
+        for (layer, index, group) in self.drawOrder:
+            image = group.get(coords)
+            if image != None:
+                self.screen.blit(image, (left, top))
+
+    def drawArea(self, rect):
+        """Draw a part of the screen from scratch, e.g. a chunk of it"""
+        self.map.drawArea(self.screen, rect)
+        firstRow, lastRow, firstCol, lastCol = self.map.getTileRange(rect)
+        tiles = (lastRow - firstRow + 1) * (lastCol - firstCol + 1)
+        blit = self.screen.blit
+        # sprites are tile-sized, so drawing a group at a time layers them
+        # the same as drawing a tile at a time
+        for (layer, index, group) in self.drawOrder:
+            if len(group) < tiles:
+                for ((row, col), image) in group.iteritems():
+                    if (firstRow <= row <= lastRow and
+                        firstCol <= col <= lastCol):
+                        blit(image, (col * Tile.size, row * Tile.size))
+            else:
+                for row in xrange(firstRow, lastRow + 1):
+                    for col in xrange(firstCol, lastCol + 1):
+                        image = group.get((row, col))
+                        if image != None:
+                            blit(image, (col * Tile.size, row * Tile.size))
+
+    def flush(self):
+        """Repaint and present every dirty tile. Returns how many there
+        were."""
+        dirtyTiles = self.dirtyTiles
+        self.dirtyTiles = set()
+        for coords in dirtyTiles:
+            self.drawTile(coords)
+            self.presentTile(coords)
+        return len(dirtyTiles)
+
+    def clear(self):
+        """Forget the dirty tiles, e.g. when the whole screen is about to be
+        drawn again anyway"""
+        self.dirtyTiles.clear()
@@ -0,0 +1,288 @@
+# tournament.py
+# Self-play tournaments between computer players
+# Dec 2014
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+import mapFile
+import ai
+import combat
+from gameState import GameState
+
+csvFields = ['variant', 'map', 'game', 'seed', 'winner', 'turns',
+             'unitsBuilt', 'finalUnits', 'finalFunds', 'fundsCurve',
+             'seconds']
+
+##################################################################
+# Variants
+##################################################################
+
+def getTypeNumber(name):
+    """Get the shop number of a unit type from its name, e.g. 'LgTank'"""
+    for (typeNum, unitType) in GameState.shopTypes.iteritems():
+        if unitType.type == name:
+            return typeNum
+    raise ValueError('unknown unit type %r' % name)
+
+def applyVariant(variant):
+    """Apply a variant's shop costs and unit stats. Returns what they
+    replaced, for restoreVariant."""
+    saved = []
+    for (name, cost) in variant.get('costs', {}).iteritems():
+        typeNum = getTypeNumber(name)
+        saved.append((GameState.shopCosts, typeNum,
+                      GameState.shopCosts[typeNum]))
+        GameState.shopCosts[typeNum] = cost
+    for (key, value) in variant.get('stats', {}).iteritems():
+        name, attribute = key.split('.')
+        unitType = GameState.shopTypes[getTypeNumber(name)]
+        saved.append((unitType, attribute, unitType.__dict__.get(attribute)))
+        setattr(unitType, attribute, value)
+    return saved
+
+def restoreVariant(saved):
+    for (owner, key, value) in reversed(saved):
+        if isinstance(owner, dict):
+            owner[key] = value
+        elif value == None:
+            delattr(owner, key) # the stat was inherited from Unit
+        else:
+            setattr(owner, key, value)
+
+def parseOverrides(costs, stats):
+    """Make a variant out of --cost and --stat arguments"""
+    variant = {'name': 'default', 'costs': {}, 'stats': {}}
+    for item in costs:
+        name, value = item.split('=')
+        variant['costs'][name] = int(value)
+    for item in stats:
+        key, value = item.split('=')
+        variant['stats'][key] = json.loads(value)
+    if len(costs) > 0 or len(stats) > 0:
+        variant['name'] = 'custom'
+    return variant
+
+##################################################################
+# Games
+##################################################################
+
+def playGame(task):
+    """Play one game between computer players. Runs in a worker process."""
+    variant, path, gameNumber, seed, settings = task
+    saved = applyVariant(variant)
+    combat.buildTables()
+    try:
+        start = time.time()
+        state = GameState.fromFile(path, seed)
+        unitsBuilt = [0] * state.numPlayers
+        fundsCurve = [[] for team in state.teams]
+        while not state.gameIsOver and state.turn < settings['maxTurns']:
+            team = state.activeTeam
+            fundsCurve[team.teamNumber].append(team.funds)
+            planner = ai.playTurn(state, settings['timeBudget'],
+                                  settings['nodeBudget'])
+            for command in planner.applied:
+                if command[0] == 'buy':
+                    unitsBuilt[team.teamNumber] += 1
+            if not state.gameIsOver:
+                state.endTurn()
+        if state.winner == None:
+            winner = None
+        else:
+            winner = state.winner.teamNumber
+        return {
+            'variant': variant['name'],
+            'map': os.path.splitext(os.path.basename(path))[0],
+            'game': gameNumber,
+            'seed': seed,
+            'winner': winner,
+            'turns': state.turn,
+            'unitsBuilt': unitsBuilt,
+            'finalUnits': [len(team.units) for team in state.teams],
+            'finalFunds': [team.funds for team in state.teams],
+            'fundsCurve': fundsCurve,
+            'seconds': round(time.time() - start, 3)
+        }
+    finally:
+        restoreVariant(saved)
+        combat.buildTables()
+
+def getTasks(variants, paths, games, baseSeed, settings):
+    tasks = []
+    for variant in variants:
+        for path in paths:
+            for gameNumber in xrange(games):
+                tasks.append((variant, path, gameNumber,
+                              baseSeed + gameNumber, settings))
+    return tasks
+
+def runTasks(tasks, processes, onResult=None):
+    """Play the games in a pool of processes, calling onResult with each
+    record as it comes in. Returns the number of seconds taken."""
+    start = time.time()
+    if processes == 1:
+        results = (playGame(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(playGame, tasks)
+    for result in results:
+        if onResult != None:
+            onResult(result)
+    if processes != 1:
+        pool.close()
+        pool.join()
+    return time.time() - start
+
+##################################################################
+# Output
+##################################################################
+
+class ResultWriter(object):
+    """
+    Writes game records to a .jsonl file, or to a .csv file with the lists
+    in each record written as JSON
+    """
+    def __init__(self, path):
+        self.isCSV = path.endswith('.csv')
+        self.output = open(path, 'wb' if self.isCSV else 'wt')
+        if self.isCSV:
+            self.writer = csv.DictWriter(self.output, csvFields)
+            self.writer.writeheader()
+
+    def write(self, result):
+        if self.isCSV:
+            row = dict([(key, json.dumps(value) if type(value) == list
+                         else value) for (key, value) in result.iteritems()])
+            self.writer.writerow(row)
+        else:
+            self.output.write(json.dumps(result, sort_keys=True) + '\n')
+        self.output.flush()
+
+    def close(self):
+        self.output.close()
+
+class Summary(object):
+    """
+    Wins and game lengths per variant and map
+    """
+    def __init__(self):
+        self.games = dict() # (variant, map) -> list of records
+
+    def add(self, result):
+        key = (result['variant'], result['map'])
+        self.games.setdefault(key, []).append(result)
+
+    def show(self):
+        print '%-10s %-12s %6s %10s  %s' % ('variant', 'map', 'games',
+                                             'mean turns', 'wins by team')
+        for (variant, mapName) in sorted(self.games):
+            results = self.games[(variant, mapName)]
+            wins = dict()
+            for result in results:
+                wins[result['winner']] = wins.get(result['winner'], 0) + 1
+            winText = ' '.join(['%s:%d' % ('draw' if team == None else team,
+                                            count)
+                                for (team, count) in sorted(wins.items())])
+            turns = sum([result['turns'] for result in results])
+            print '%-10s %-12s %6d %10.1f  %s' % (
+                variant, mapName, len(results),
+                float(turns) / len(results), winText)
+
+def getProcessCounts(maximum):
+    """1, 2, 4, ... up to maximum, ending with maximum"""
+    counts = []
+    count = 1
+    while count < maximum:
+        counts.append(count)
+        count *= 2
+    counts.append(maximum)
+    return counts
+
+def reportScaling(tasks, maximum):
+    """Play the same games with more and more processes"""
+    print '%9s %6s %9s %8s %8s' % ('processes', 'games', 'seconds',
+                                   'games/s', 'speedup')
+    baseline = None
+    for processes in getProcessCounts(maximum):
+        seconds = runTasks(tasks, processes)
+        rate = len(tasks) / seconds
+        if baseline == None:
+            baseline = rate
+        print '%9d %6d %9.2f %8.2f %7.2fx' % (processes, len(tasks), seconds,
+                                              rate, rate / baseline)
+        sys.stdout.flush()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Play computer players '
+                                     'against each other')
+    parser.add_argument('maps', nargs='*', help='scenario files (default: '
+                        'every map in maps/)')
+    parser.add_argument('--games', type=int, default=10,
+                        help='games per map and variant')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the first game')
+    parser.add_argument('--nodes', type=int, default=2000,
+                        help='search nodes per turn')
+    parser.add_argument('--time', type=float, default=None,
+                        help='seconds per turn, instead of --nodes; games '
+                        'are then no longer reproducible')
+    parser.add_argument('--max-turns', type=int, default=300)
+    parser.add_argument('--out', help='.jsonl or .csv file for the results')
+    parser.add_argument('--cost', action='append', default=[],
+                        help='override a shop cost, e.g. LgTank=14000')
+    parser.add_argument('--stat', action='append', default=[],
+                        help='override a unit stat, e.g. Artillery.attack=75')
+    parser.add_argument('--variants', help='JSON file of variants to play '
+                        'one after the other with the same seeds: a list of '
+                        '{"name": ..., "costs": {type: cost}, '
+                        '"stats": {"Type.attribute": value}} objects')
+    parser.add_argument('--scaling', action='store_true',
+                        help='report games/second for 1 up to --processes '
+                        'processes instead of writing results')
+    args = parser.parse_args(argv)
+
+    paths = args.maps
+    if len(paths) == 0:
+        paths = [mapFile.getScenarioPath('maps', name)
+                 for name in mapFile.getScenarioNames('maps')]
+    if args.variants != None:
+        with open(args.variants) as input:
+            variants = json.load(input)
+    else:
+        variants = [parseOverrides(args.cost, args.stat)]
+    if args.time != None:
+        settings = {'timeBudget': args.time, 'nodeBudget': None}
+    else:
+        settings = {'timeBudget': None, 'nodeBudget': args.nodes}
+    settings['maxTurns'] = args.max_turns
+    tasks = getTasks(variants, paths, args.games, args.seed, settings)
+
+    if args.scaling:
+        reportScaling(tasks, args.processes)
+        return
+    summary = Summary()
+    writer = None
+    if args.out != None:
+        writer = ResultWriter(args.out)
+    def onResult(result):
+        summary.add(result)
+        if writer != None:
+            writer.write(result)
+    try:
+        seconds = runTasks(tasks, args.processes, onResult)
+    finally:
+        if writer != None:
+            writer.close()
+    summary.show()
+    print '%d games in %.1fs (%.2f games/s) with %d processes' % (
+        len(tasks), seconds, len(tasks) / seconds, args.processes)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
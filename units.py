@@ -8,6 +8,7 @@ import random
 import os
 import pygame
 from pygame.locals import *
+from imageCache import loadImage
 
 class Unit(pygame.sprite.Sprite):
     """
@@ -26,6 +27,8 @@ class Unit(pygame.sprite.Sprite):
     artilleryMaxRange = 0
     # define strengths and weaknesses against other types
     attackModifiers = dict()
+    # damage varies by up to this fraction of the base damage either way
+    randomnessFactor = 0.2
     # fields for game methods to use
     hasMoved = False
     canCapture = False
@@ -36,12 +39,20 @@ class Unit(pygame.sprite.Sprite):
         self.teamNum = teamNum
         self.team = Unit.colors[teamNum]
         self.health = 100
-        self.image = self.getImage()
+        self.loadedImage = None
+
+    @property
+    def image(self):
+        """The unit's sprite, loaded on first use so that units can be
+        created without a display"""
+        if self.loadedImage == None:
+            self.loadedImage = self.getImage()
+        return self.loadedImage
 
     def getImage(self):
         filename = self.team + self.type + '.png'
         path = os.path.join('units', filename)
-        image = pygame.image.load(path)
+        image = loadImage(path)
         return image
 
     def getAttackModifier(self, other):
@@ -52,39 +63,73 @@ class Unit(pygame.sprite.Sprite):
             # if there is no attack modifier for these types
             return 0
 
-    def damageCalc(self, other, envFactor, attack):
-        """Determine the damage based on the attack strength and health
-         of this unit, the defense value of the enemy unit, the environmental
-         defense factor of the defender, with some randomness factor"""
+    def getBaseDamage(self, other, envFactor, attack, health=None):
+        """Determine the damage before randomness based on the attack
+        strength and health of this unit (its current health unless health
+        is given), the defense value of the enemy unit and the environmental
+        defense factor of the defender"""
+        if health == None:
+            health = self.health
         # Determine base damage accounting for the health of the unit, with a
         # minimum of half of the base attack
         baseAttackDamage = attack + self.getAttackModifier(other)
         minimumDamageFactor = 0.5
         minimumBaseDamage = baseAttackDamage * minimumDamageFactor
         maxHealth = 100.0
-        healthPercentage = self.health / maxHealth
+        healthPercentage = health / maxHealth
         baseDamage = minimumBaseDamage + minimumBaseDamage * healthPercentage
         # account for defense
         defenseFactor = 0.1 * other.defense
         baseDefense = defenseFactor * envFactor
-        baseDamage = int(baseDamage - baseDefense)
+        return int(baseDamage - baseDefense)
+
+    @staticmethod
+    def getRandomAllowance(baseDamage):
+        """Get how far either side of baseDamage an attack's damage may
+        fall. A base damage below 0 always does no damage."""
+        return int(round(Unit.randomnessFactor * max(0, baseDamage)))
+
+    def damageCalc(self, other, envFactor, attack, rng=None):
+        """Determine the damage based on the attack strength and health
+         of this unit, the defense value of the enemy unit, the environmental
+         defense factor of the defender, with some randomness factor drawn
+         from rng (a random.Random, or the random module if not given)"""
+        if rng == None:
+            rng = random
+        baseDamage = self.getBaseDamage(other, envFactor, attack)
         # modify this by some random factor
-        randomnessFactor = 0.2
-        randomAllowance = int(round(randomnessFactor * baseDamage))
-        damage = random.randint(baseDamage - randomAllowance,
-                                      baseDamage + randomAllowance)
+        randomAllowance = Unit.getRandomAllowance(baseDamage)
+        damage = rng.randint(baseDamage - randomAllowance,
+                             baseDamage + randomAllowance)
         return max(0, damage) # if the damage is less than 0, do no damage
 
-    def getAttackDamage(self, other, defenderEnvFactor=0):
+    def getAttackDamage(self, other, defenderEnvFactor=0, rng=None):
         """Get the damage dealt to a unit by an attacking unit"""
-        return self.damageCalc(other, defenderEnvFactor, self.attack)
+        return self.damageCalc(other, defenderEnvFactor, self.attack, rng)
 
-    def getRetaliatoryDamage(self, other, attackerEnvFactor=0):
-        """Get the damage dealt to an attacking unit by a defending unit"""
+    def getRetaliationAttack(self):
+        """Get the attack strength of a defending unit striking back"""
         retaliationDamageFactor = 0.75
         # retaliation attacks should not do full damage
-        retaliationAttack = int(round(retaliationDamageFactor * self.attack))
-        return self.damageCalc(other, attackerEnvFactor, retaliationAttack)
+        return int(round(retaliationDamageFactor * self.attack))
+
+    def getRetaliatoryDamage(self, other, attackerEnvFactor=0, rng=None):
+        """Get the damage dealt to an attacking unit by a defending unit"""
+        return self.damageCalc(other, attackerEnvFactor,
+                               self.getRetaliationAttack(), rng)
+
+    def getExpectedAttackDamage(self, other, defenderEnvFactor=0,
+                                health=None):
+        """Get the average of getAttackDamage. The random range is centred
+        on the base damage, so that is the average unless it is negative."""
+        return max(0, self.getBaseDamage(other, defenderEnvFactor,
+                                         self.attack, health))
+
+    def getExpectedRetaliatoryDamage(self, other, attackerEnvFactor=0,
+                                     health=None):
+        """Get the average of getRetaliatoryDamage"""
+        return max(0, self.getBaseDamage(other, attackerEnvFactor,
+                                         self.getRetaliationAttack(), health))
 
     def __repr__(self):
         return self.type + '(%r)' % self.team
@@ -0,0 +1,202 @@
+# viewport.py
+# Scrolling camera for PyWars
+# Dec 2014
+
+import time
+import pygame
+from pygame.locals import *
+
+class Viewport(object):
+    """
+    Shows the part of a source surface under a camera in a rect of the
+    display, through a FrameCompositor. Positions are of the source pixel
+    shown at the view's top left.
+    """
+    scrollSpeed = 1200.0 # pixels per second when gliding to a position
+    panSpeed = 600.0 # pixels per second when panning at an edge
+    edgeWidth = 24 # pixels from the edge of the view where the mouse pans
+    maxStep = 0.1 # seconds; a longer frame doesn't make the camera jump
+    prefetchMargin = 512 # pixels around the view drawn ahead while moving
+
+    def __init__(self, compositor, rect, source):
+        self.compositor = compositor
+        self.display = compositor.display
+        self.rect = pygame.Rect(rect)
+        self.source = source
+        self.maxX = max(0, source.get_width() - self.rect.width)
+        self.maxY = max(0, source.get_height() - self.rect.height)
+        self.x = self.y = 0.0 # where the camera is
+        self.targetX = self.targetY = 0.0 # where it is gliding to
+        self.panX = self.panY = 0 # -1, 0 or 1 while panning at an edge
+        self.shown = None # the position on the display, if it is up to date
+        self.lastUpdate = None
+
+    ##################################################################
+    # Moving the camera
+    ##################################################################
+
+    def clamp(self, x, y):
+        return (min(max(x, 0), self.maxX), min(max(y, 0), self.maxY))
+
+    def getPosition(self):
+        """Get the pixel position the camera shows, or will once it stops"""
+        return (int(round(self.targetX)), int(round(self.targetY)))
+
+    def getSourceRect(self):
+        """Get the rect of the source the camera shows at the moment"""
+        return pygame.Rect(int(round(self.x)), int(round(self.y)),
+                           self.rect.width, self.rect.height)
+
+    def jumpTo(self, x, y):
+        """Move the camera at once"""
+        self.x, self.y = self.targetX, self.targetY = self.clamp(x, y)
+
+    def scrollTo(self, x, y):
+        """Glide the camera to a position over the next frames"""
+        self.targetX, self.targetY = self.clamp(x, y)
+
+    def scrollToShow(self, rect):
+        """Glide the camera as little as it takes to bring a rect of the
+        source into view, e.g. the tile under the cursor"""
+        x, y = self.targetX, self.targetY
+        if rect.left < x:
+            x = rect.left
+        elif rect.right > x + self.rect.width:
+            x = rect.right - self.rect.width
+        if rect.top < y:
+            y = rect.top
+        elif rect.bottom > y + self.rect.height:
+            y = rect.bottom - self.rect.height
+        self.scrollTo(x, y)
+
+    def panAt(self, pos):
+        """Pan while the mouse is at pos near an edge of the view"""
+        self.panX = self.panY = 0
+        if not self.rect.collidepoint(pos):
+            return
+        x, y = pos
+        if x < self.rect.left + Viewport.edgeWidth:
+            self.panX = -1
+        elif x >= self.rect.right - Viewport.edgeWidth:
+            self.panX = 1
+        if y < self.rect.top + Viewport.edgeWidth:
+            self.panY = -1
+        elif y >= self.rect.bottom - Viewport.edgeWidth:
+            self.panY = 1
+
+    def isPanning(self):
+        """Return True if the camera is panning and hasn't reached the
+        edge of the source it is panning towards"""
+        if not pygame.mouse.get_focused():
+            self.panX = self.panY = 0 # the mouse left the window
+        return ((self.panX < 0 and self.targetX > 0) or
+                (self.panX > 0 and self.targetX < self.maxX) or
+                (self.panY < 0 and self.targetY > 0) or
+                (self.panY > 0 and self.targetY < self.maxY))
+
+    def isMoving(self):
+        return ((self.x, self.y) != (self.targetX, self.targetY) or
+                self.isPanning())
+
+    def update(self):
+        """Move the camera by the time since the last update. Returns True
+        if it moved."""
+        if not self.isMoving():
+            self.lastUpdate = None
+            return False
+        now = time.time()
+        if self.lastUpdate == None:
+            step = 1.0 / 60 # the first frame of a move
+        else:
+            step = min(now - self.lastUpdate, Viewport.maxStep)
+        self.lastUpdate = now
+        if self.isPanning():
+            self.targetX, self.targetY = self.clamp(
+                self.targetX + self.panX * Viewport.panSpeed * step,
+                self.targetY + self.panY * Viewport.panSpeed * step)
+        dx, dy = self.targetX - self.x, self.targetY - self.y
+        distance = (dx ** 2 + dy ** 2) ** 0.5
+        reach = Viewport.scrollSpeed * step
+        if distance <= reach:
+            self.x, self.y = self.targetX, self.targetY
+        else:
+            self.x += dx * reach / distance
+            self.y += dy * reach / distance
+        return True
+
+    ##################################################################
+    # Drawing
+    ##################################################################
+
+    def invalidate(self):
+        """Copy the whole view again at the next present, e.g. after the
+        whole source has been redrawn"""
+        self.shown = None
+
+    def copy(self, sourceRect):
+        """Copy part of the source to where the display shows it"""
+        shownX, shownY = self.shown
+        dest = pygame.Rect(self.rect.left + sourceRect.left - shownX,
+                           self.rect.top + sourceRect.top - shownY,
+                           sourceRect.width, sourceRect.height)
+        dest = dest.clip(self.rect)
+        if dest.width > 0 and dest.height > 0:
+            area = dest.move(shownX - self.rect.left, shownY - self.rect.top)
+            self.source.copyTo(self.display, dest, area)
+        return dest
+
+    def present(self):
+        """Bring the view on the display up to date with the camera"""
+        position = (int(round(self.x)), int(round(self.y)))
+        if position == self.shown:
+            return
+        width, height = self.rect.size
+        if self.shown != None:
+            dx = position[0] - self.shown[0]
+            dy = position[1] - self.shown[1]
+        if (self.shown == None or abs(dx) >= width or abs(dy) >= height):
+            self.shown = position
+            self.copy(pygame.Rect(position, self.rect.size))
+        else:
+            self.display.set_clip(self.rect)
+            self.display.scroll(-dx, -dy)
+            self.display.set_clip(None)
+            self.shown = position
+            x, y = position
+            misses = self.source.misses
+            # the strips that scrolled into view
+            if dx > 0:
+                self.copy(pygame.Rect(x + width - dx, y, dx, height))
+            elif dx < 0:
+                self.copy(pygame.Rect(x, y, -dx, height))
+            if dy > 0:
+                self.copy(pygame.Rect(x, y + height - dy, width, dy))
+            elif dy < 0:
+                self.copy(pygame.Rect(x, y, width, -dy))
+            if self.source.misses == misses:
+                # no chunk had to be drawn for this frame: draw one of those
+                # around the view, so that frames stay even as it moves on
+                margin = Viewport.prefetchMargin
+                self.source.prefetch(pygame.Rect(position, self.rect.size)
+                                     .inflate(2 * margin, 2 * margin))
+        self.compositor.markDirty(self.rect)
+
+    def drawOver(self, image, sourceRect):
+        """Draw an image over the view where the source has sourceRect,
+        e.g. a sprite moving between tiles. The source itself is left
+        alone, so copying that part of it again erases the image."""
+        if self.shown == None:
+            return
+        shownX, shownY = self.shown
+        dest = sourceRect.move(self.rect.left - shownX,
+                               self.rect.top - shownY)
+        self.display.set_clip(self.rect)
+        self.display.blit(image, dest)
+        self.display.set_clip(None)
+        self.compositor.markDirty(dest.clip(self.rect))
+
+    def presentRect(self, sourceRect):
+        """Copy a redrawn part of the source to the display, if it is in
+        view and the whole view isn't about to be copied anyway"""
+        if self.shown != None:
+            self.compositor.markDirty(self.copy(sourceRect))